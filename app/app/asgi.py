@@ -0,0 +1,22 @@
+"""
+ASGI config for app project.
+
+It exposes the ASGI callable as a module-level variable named
+``application``. Views still run synchronously in a bounded thread pool,
+see core.asgi.AsgiHandler. Slow clients no longer hold a thread, but a
+view that waits (long-poll) holds one until it returns.
+"""
+
+import os
+
+from django.conf import settings
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+
+from core.asgi import AsgiHandler  # noqa: E402
+
+application = AsgiHandler(
+    get_wsgi_application(),
+    max_threads=getattr(settings, 'ASGI_THREADS', None),
+)
@@ -45,6 +45,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.RequestMetricsMiddleware',
+    'core.middleware.QueryInspectionMiddleware',
+    'core.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -88,6 +91,48 @@ DATABASES = {
     }
 }
 
+# Cache
+# Throttle counters, replica pins, facets and the catalog version are
+# shared by all processes through the default cache. The database cache
+# needs `manage.py createcachetable`, CACHE_BACKEND and CACHE_LOCATION
+# select another shared backend such as memcached.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'CACHE_BACKEND', 'django.core.cache.backends.db.DatabaseCache'
+        ),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'core_cache'),
+    }
+}
+
+# Read replicas
+# GET requests read from a replica, see core.replicas. Replicas more than
+# REPLICA_MAX_LAG_SECONDS behind are skipped, and clients read from the
+# primary for REPLICA_PIN_SECONDS after a write. Pins are kept in the
+# default cache, replicas are refused with a cache local to the process.
+# Credentials are always read from the primary, so a token or account
+# created a moment ago is found.
+
+if os.environ.get('DB_REPLICA_HOST'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': os.environ.get('DB_REPLICA_HOST'),
+        'TEST': {'MIRROR': 'default'},
+    }
+
+REPLICA_DATABASES = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['core.replicas.ReplicaRouter']
+REPLICA_MAX_LAG_SECONDS = 5
+REPLICA_LAG_CHECK_SECONDS = 1
+REPLICA_PIN_SECONDS = 10
+
+# Partitioning
+# Number of hash partitions the partition_recipes command creates for the
+# recipe tables, see core.partitioning. Needs PostgreSQL 11 or later.
+
+RECIPE_PARTITIONS = 16
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
@@ -132,3 +177,129 @@ STATIC_ROOT = '/vol/web/static'
 MEDIA_ROOT = '/vol/web/media'
 
 AUTH_USER_MODEL = 'core.User'
+
+
+# Throttling
+# Token buckets are kept in THROTTLE_COUNTER_STORE. The local memory store
+# only works for a single process, use core.throttling.CacheCounterStore
+# with a shared cache backend when running several workers. It counts with
+# atomic increments, on the database cache each one locks its row, so a
+# memcached or redis cache is cheaper. Views map actions to the upload and
+# bulk scopes with throttle_scopes.
+
+REST_FRAMEWORK = {
+    'DEFAULT_THROTTLE_CLASSES': (
+        'core.throttling.UserTokenBucketThrottle',
+        'core.throttling.EndpointTokenBucketThrottle',
+    ),
+    'DEFAULT_THROTTLE_RATES': {
+        'read': os.environ.get('THROTTLE_READ_RATE', '600/min'),
+        'write': os.environ.get('THROTTLE_WRITE_RATE', '120/min'),
+        'upload': os.environ.get('THROTTLE_UPLOAD_RATE', '20/min'),
+        'bulk': os.environ.get('THROTTLE_BULK_RATE', '10/min'),
+        'endpoint_read': os.environ.get('THROTTLE_ENDPOINT_READ_RATE',
+                                        '6000/min'),
+        'endpoint_write': os.environ.get('THROTTLE_ENDPOINT_WRITE_RATE',
+                                         '1200/min'),
+        'endpoint_upload': os.environ.get('THROTTLE_ENDPOINT_UPLOAD_RATE',
+                                          '200/min'),
+        'endpoint_bulk': os.environ.get('THROTTLE_ENDPOINT_BULK_RATE',
+                                        '100/min'),
+    },
+}
+
+THROTTLE_COUNTER_STORE = os.environ.get(
+    'THROTTLE_COUNTER_STORE', 'core.throttling.LocalMemoryCounterStore'
+)
+
+
+# Metrics
+# Client addresses allowed to scrape /metrics, None allows everyone.
+# Request histograms are kept in the memory of each worker. With several
+# workers, point METRICS_DIR at a directory they share: each writes its
+# histograms there every METRICS_FLUSH_SECONDS and a scrape sums them up.
+# Without it a scrape only shows the worker that answered. Empty the
+# directory when the workers are restarted. Gauges reading the database
+# are reused for core.metrics.GAUGE_MAX_AGE seconds.
+
+METRICS_ALLOWED_IPS = os.environ.get(
+    'METRICS_ALLOWED_IPS', '127.0.0.1'
+).split(',')
+METRICS_DIR = os.environ.get('METRICS_DIR') or None
+METRICS_FLUSH_SECONDS = 5
+
+
+# Query inspection
+# Logs N+1 style repeated queries and slow queries per request. Meant for
+# staging, it adds overhead to every query.
+
+QUERY_INSPECTION_ENABLED = os.environ.get('QUERY_INSPECTION') == '1'
+QUERY_INSPECTION_DUPLICATE_THRESHOLD = 3
+QUERY_INSPECTION_SLOW_QUERY_MS = 100
+
+
+# Recipe stats
+# Serve /recipes/stats/ from the incrementally maintained summary tables.
+# When off, stats are aggregated over the user's recipes on every request.
+
+RECIPE_STATS_SUMMARY = True
+
+
+# Shared catalog
+# Tags and ingredients are linked to shared catalog entries of the same
+# name, and the API serves the catalog names from memory. Each process
+# keeps the catalog in memory and checks the version in the default
+# cache, shared between processes, every CATALOG_CACHE_CHECK_SECONDS.
+
+CATALOG_ENABLED = True
+CATALOG_CACHE_CHECK_SECONDS = 30
+
+
+# Change feed
+# Clients syncing less often than this have to download everything again,
+# see the prune_changes command.
+
+CHANGE_FEED_RETENTION_DAYS = 30
+
+
+# Soft delete
+# Recipes deleted through the API are only hidden. The purge_recipes
+# command removes those deleted more than this many days ago.
+
+RECIPE_PURGE_AFTER_DAYS = 1
+
+
+# Thumbnails
+# Resized recipe images are generated on first request and cached on disk.
+# The least recently used ones are deleted by a background job once the
+# cache grows beyond THUMBNAIL_CACHE_MAX_BYTES. Behind nginx, set THUMBNAIL_ACCEL_REDIRECT to
+# an internal location aliased to THUMBNAIL_ROOT to let nginx send them.
+
+THUMBNAIL_ROOT = '/vol/web/thumbs'
+THUMBNAIL_SIZES = (64, 128, 256, 512)
+THUMBNAIL_LIST_SIZE = 256
+THUMBNAIL_CACHE_MAX_BYTES = int(os.environ.get(
+    'THUMBNAIL_CACHE_MAX_BYTES', 512 * 1024 * 1024
+))
+THUMBNAIL_ACCEL_REDIRECT = os.environ.get('THUMBNAIL_ACCEL_REDIRECT')
+
+
+# Background jobs
+# Jobs are stored in core_job and run by the run_jobs command. Failed jobs
+# are retried after JOBS_RETRY_DELAY seconds, doubling with each attempt.
+# Workers mark their running jobs alive every JOBS_HEARTBEAT_SECONDS and
+# requeue those whose worker went silent for JOBS_TIMEOUT seconds.
+
+JOBS_RETRY_DELAY = 10
+JOBS_TIMEOUT = 600
+JOBS_HEARTBEAT_SECONDS = 60
+JOBS_KEEP_DONE_DAYS = 7
+
+
+# ASGI
+# app.asgi serves Django from a pool of ASGI_THREADS threads. Keep it at
+# or below the database connection limit of one process. Views are still
+# synchronous, so requests that wait in a view, such as long-polls, each
+# take a thread for their whole wait.
+
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 20))
@@ -2,10 +2,14 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from core.views import metrics_view, thumbnail_view
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
+    path(settings.MEDIA_URL.lstrip('/') + 'thumbs/<int:size>/<path:name>',
+         thumbnail_view, name='thumbnail'),
     path('api/user/', include('user.urls')),
     path('api/recipe/', include('recipe.urls')),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -1,12 +1,30 @@
 from django.contrib import admin
-from core import models
+from core import bulk, models, tasks
+from django.contrib.admin.widgets import AutocompleteSelectMultiple
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.utils import timezone
 from django.utils.translation import gettext as _
+from core.pagination import EstimatedCountPaginator
 
 
-class UserAdmin(BaseUserAdmin):
+class SetBasedDeleteMixin:
+    '''Drop the delete_selected action
+
+    It loads every related row through the collector. The admins offer
+    the set based deletes of core.bulk instead.
+    '''
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+
+class UserAdmin(SetBasedDeleteMixin, BaseUserAdmin):
     ordering = ['id']
     list_display = ['email', 'name']
+    search_fields = ['^email', '^name']
+    actions = ['delete_with_data', 'delete_recipes']
     fieldsets = (
         (None, {'fields': ('email', 'password')}),
         (_('Personal Information'), {'fields': ('name',)}),
@@ -23,8 +41,195 @@ class UserAdmin(BaseUserAdmin):
         }),
     )
 
+    def delete_with_data(self, request, queryset):
+        user_ids = list(queryset.values_list('pk', flat=True))
+        tasks.delete_users.delay(user_ids=user_ids)
+        self.message_user(
+            request, _('Queued deletion of %d users') % len(user_ids)
+        )
+    delete_with_data.short_description = _(
+        'Delete selected users with all their data (in the background)'
+    )
+
+    def delete_recipes(self, request, queryset):
+        deleted = bulk.delete_user_recipes(
+            list(queryset.values_list('pk', flat=True))
+        )
+        self.message_user(request, _('Deleted %d recipes') % deleted)
+    delete_recipes.short_description = _(
+        'Delete all recipes of selected users (batched)'
+    )
+
+
+class LargeTableAdmin(SetBasedDeleteMixin, admin.ModelAdmin):
+    '''Admin for big per user tables, avoids full scans and huge widgets'''
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+    list_per_page = 50
+
+
+def delete_selected_recipes(modeladmin, request, queryset):
+    '''Delete recipes with set based DELETEs'''
+
+    deleted = bulk.delete_recipes(queryset)
+    modeladmin.message_user(request, _('Deleted %d recipes') % deleted)
+
+
+delete_selected_recipes.short_description = _(
+    'Delete selected recipes (batched)'
+)
+
+
+def restore_selected_recipes(modeladmin, request, queryset):
+    '''Undo the soft delete of recipes that were not purged yet'''
+
+    restored = bulk.restore_recipes(queryset)
+    modeladmin.message_user(request, _('Restored %d recipes') % restored)
+
+
+restore_selected_recipes.short_description = _(
+    'Restore selected deleted recipes'
+)
+
+
+class DeletedListFilter(admin.SimpleListFilter):
+    title = _('deleted')
+    parameter_name = 'deleted'
+
+    def lookups(self, request, model_admin):
+        return (('yes', _('Yes')), ('no', _('No')))
+
+    def queryset(self, request, queryset):
+        if self.value() in ('yes', 'no'):
+            return queryset.filter(deleted_at__isnull=self.value() == 'no')
+        return queryset
+
+
+class OwnerAutocompleteSelectMultiple(AutocompleteSelectMultiple):
+    '''Autocomplete asking for the objects of one user only'''
+
+    def __init__(self, *args, user_id, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.user_id = user_id
+
+    def get_url(self):
+        return f'{super().get_url()}?user={self.user_id}'
+
+
+class OwnedNameAdmin(LargeTableAdmin):
+    '''Admin for the tags and ingredients of users'''
+
+    list_display = ['name', 'user', 'recipe_count']
+    raw_id_fields = ('user', 'canonical')
+    search_fields = ['^name']
+    ordering = ['-id']
+
+    def get_search_results(self, request, queryset, search_term):
+        # ?user= comes from the autocomplete of a recipe's owner
+        queryset, use_distinct = super().get_search_results(
+            request, queryset, search_term
+        )
+        try:
+            user_id = int(request.GET.get('user', ''))
+        except ValueError:
+            return queryset, use_distinct
+        return queryset.filter(user_id=user_id), use_distinct
+
+
+class TagAdmin(OwnedNameAdmin):
+    pass
+
+
+class IngredientAdmin(OwnedNameAdmin):
+    pass
+
+
+class RecipeAdmin(LargeTableAdmin):
+    list_display = ['title', 'user', 'time_minutes', 'price', 'deleted_at']
+    list_filter = [DeletedListFilter]
+    search_fields = ['^title']
+    autocomplete_fields = ['tags', 'ingredients']
+    ordering = ['-id']
+    actions = [delete_selected_recipes, restore_selected_recipes]
+
+    def get_queryset(self, request):
+        # Soft deleted recipes too, so they can be restored. Without the
+        # deleted_at filter of Recipe.objects the paginator can estimate.
+        queryset = models.Recipe.all_objects.get_queryset()
+        ordering = self.get_ordering(request)
+        if ordering:
+            queryset = queryset.order_by(*ordering)
+        return queryset
+
+    def get_form(self, request, obj=None, **kwargs):
+        # formfield_for_manytomany isn't told which recipe is edited
+        request.recipe_owner_id = obj.user_id if obj is not None else None
+        return super().get_form(request, obj, **kwargs)
+
+    def formfield_for_manytomany(self, db_field, request, **kwargs):
+        '''Offer only tags and ingredients of the recipe's owner'''
+
+        owner_id = getattr(request, 'recipe_owner_id', None)
+        if owner_id is None or db_field.name not in self.autocomplete_fields:
+            return super().formfield_for_manytomany(db_field, request,
+                                                    **kwargs)
+        formfield = super().formfield_for_manytomany(
+            db_field, request,
+            queryset=db_field.related_model.objects.filter(user_id=owner_id),
+            **kwargs
+        )
+        formfield.widget = OwnerAutocompleteSelectMultiple(
+            db_field.remote_field, self.admin_site,
+            using=kwargs.get('using'), user_id=owner_id,
+        )
+        return formfield
+
+    def has_change_permission(self, request, obj=None):
+        # Edits would skip the bookkeeping of restore_selected_recipes
+        if obj is not None and obj.deleted_at is not None:
+            return False
+        return super().has_change_permission(request, obj)
+
+
+class CatalogAdmin(admin.ModelAdmin):
+    list_display = ['name']
+    search_fields = ['^name']
+    ordering = ['name']
+
+
+def retry_jobs(modeladmin, request, queryset):
+    '''Queue failed jobs again'''
+
+    retried = queryset.filter(status=models.Job.FAILED).update(
+        status=models.Job.QUEUED, attempts=0, run_at=timezone.now(),
+        finished_at=None,
+    )
+    modeladmin.message_user(request, _('Queued %d jobs') % retried)
+
+
+retry_jobs.short_description = _('Retry selected failed jobs')
+
+
+class JobAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_display = ['id', 'name', 'status', 'attempts', 'run_at',
+                    'finished_at']
+    list_filter = ['status']
+    ordering = ['-id']
+    readonly_fields = ['name', 'payload', 'status', 'attempts',
+                       'max_attempts', 'run_at', 'locked_at', 'locked_by',
+                       'last_error', 'created_at', 'finished_at']
+    actions = [retry_jobs]
+
 
 admin.site.register(models.User, UserAdmin)
-admin.site.register(models.Tag)
-admin.site.register(models.Ingredient)
-admin.site.register(models.Recipe)
+admin.site.register(models.Tag, TagAdmin)
+admin.site.register(models.Ingredient, IngredientAdmin)
+admin.site.register(models.Recipe, RecipeAdmin)
+admin.site.register(models.CatalogTag, CatalogAdmin)
+admin.site.register(models.CatalogIngredient, CatalogAdmin)
+admin.site.register(models.Job, JobAdmin)
@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        # Connects signal handlers
+        from core import (  # noqa: F401
+            catalog, changes, counts, quantities, similarity, stats, tasks,
+        )
@@ -0,0 +1,167 @@
+import asyncio
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from django.db import close_old_connections
+
+
+# Request bodies larger than this are spooled to a temporary file
+SPOOL_MAX_SIZE = 1024 * 1024
+
+
+class DatabaseThreadPool:
+    '''Bounded pool of threads for blocking Django and database work
+
+    Each thread keeps its own database connections. Stale ones are closed
+    before and after every call, like Django does around requests.
+    '''
+
+    def __init__(self, max_threads=None):
+        self.executor = ThreadPoolExecutor(max_threads,
+                                           thread_name_prefix='db')
+
+    def _call(self, func, args):
+        close_old_connections()
+        try:
+            return func(*args)
+        finally:
+            close_old_connections()
+
+    async def run(self, func, *args):
+        '''Run func(*args) in the pool and wait for it without blocking'''
+
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, self._call, func,
+                                          args)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+class AsgiHandler:
+    '''ASGI application serving a WSGI application from a thread pool
+
+    The request body is read and the response is sent on the event loop,
+    so slow uploads and downloads only cost a coroutine. A pool thread is
+    held while Django builds the response or produces the next chunk of a
+    streamed one. Views are still synchronous: one that waits, like a
+    long-poll, holds its thread for the whole wait, so the number of such
+    requests served at once is limited by the pool size.
+    '''
+
+    def __init__(self, wsgi_application, max_threads=None):
+        self.wsgi_application = wsgi_application
+        self.pool = DatabaseThreadPool(max_threads)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+        else:
+            raise ValueError(f'Unsupported ASGI scope {scope["type"]}')
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.pool.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def read_body(self, receive):
+        '''Return the request body as a file, None if the client left'''
+
+        body = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return None
+            body.write(message.get('body', b''))
+            if not message.get('more_body', False):
+                body.seek(0)
+                return body
+
+    async def http(self, scope, receive, send):
+        body = await self.read_body(receive)
+        if body is None:
+            return
+        response = {}
+        result = None
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [
+                (name.lower().encode('latin1'), value.encode('latin1'))
+                for name, value in headers
+            ]
+
+        try:
+            result = await self.pool.run(
+                self.wsgi_application, build_environ(scope, body),
+                start_response,
+            )
+            chunks = iter(result)
+            await send({
+                'type': 'http.response.start',
+                'status': response['status'],
+                'headers': response['headers'],
+            })
+            while True:
+                chunk = await self.pool.run(next, chunks, None)
+                if chunk is None:
+                    break
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk,
+                                'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            body.close()
+            if hasattr(result, 'close'):
+                await self.pool.run(result.close)
+
+
+def build_environ(scope, body):
+    '''Translate an ASGI HTTP scope into a WSGI environ'''
+
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf8')
+        .decode('latin1'),
+        'PATH_INFO': scope['path'].encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': f'HTTP/{scope.get("http_version", "1.1")}',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+        environ['REMOTE_PORT'] = str(scope['client'][1])
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin1').upper().replace('-', '_')
+        value = value.decode('latin1')
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = name
+        else:
+            key = f'HTTP_{name}'
+        if key in environ:
+            # RFC 6265 joins cookies with '; ', other headers take ','
+            separator = '; ' if key == 'HTTP_COOKIE' else ','
+            value = f'{environ[key]}{separator}{value}'
+        environ[key] = value
+    if 'CONTENT_LENGTH' not in environ:
+        # Chunked uploads, the whole body has been read already
+        environ['CONTENT_LENGTH'] = str(body.seek(0, 2))
+        body.seek(0)
+    return environ
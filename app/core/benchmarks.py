@@ -0,0 +1,164 @@
+import io
+import math
+import random
+import time
+from django.test.utils import override_settings
+from django.urls import reverse
+from PIL import Image
+from rest_framework.test import APIClient
+from core.models import Tag, Ingredient, Recipe
+from core.queries import QueryInspector
+
+
+def percentile(values, pct):
+    '''Return the pct percentile of values using nearest rank'''
+
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class BenchmarkContext:
+    '''Users and ids the scenarios pick their requests from'''
+
+    def __init__(self, users, password, seed=0):
+        self.users = users
+        self.password = password
+        self.rng = random.Random(seed)
+        user_ids = [user.id for user in users]
+        self.recipes = _group(Recipe, user_ids)
+        self.tags = _group(Tag, user_ids)
+        self.ingredients = _group(Ingredient, user_ids)
+
+    def pick_user(self):
+        return self.rng.choice(self.users)
+
+
+def _group(model, user_ids):
+    result = {user_id: [] for user_id in user_ids}
+    rows = model.objects.filter(user_id__in=user_ids) \
+        .values_list('user_id', 'id')
+    for user_id, pk in rows:
+        result[user_id].append(pk)
+    return result
+
+
+def _sample_ids(ctx, ids, count=2):
+    picked = ctx.rng.sample(ids, min(count, len(ids)))
+    return ','.join(str(pk) for pk in picked)
+
+
+def list_recipes(client, ctx, user):
+    return client.get(reverse('recipe:recipe-list'))
+
+
+def filter_recipes(client, ctx, user):
+    return client.get(reverse('recipe:recipe-list'), {
+        'tags': _sample_ids(ctx, ctx.tags[user.id]),
+        'ingredients': _sample_ids(ctx, ctx.ingredients[user.id]),
+    })
+
+
+def recipe_detail(client, ctx, user):
+    recipe_id = ctx.rng.choice(ctx.recipes[user.id])
+    return client.get(reverse('recipe:recipe-detail', args=[recipe_id]))
+
+
+def list_tags(client, ctx, user):
+    return client.get(reverse('recipe:tag-list'), {'assigned_only': 1})
+
+
+def create_recipe(client, ctx, user):
+    return client.post(reverse('recipe:recipe-list'), {
+        'title': 'Benchmark recipe',
+        'time_minutes': ctx.rng.randint(5, 120),
+        'price': '9.99',
+        'tags': ctx.rng.sample(ctx.tags[user.id], 1),
+        'ingredients': ctx.rng.sample(ctx.ingredients[user.id], 2),
+    })
+
+
+def upload_image(client, ctx, user):
+    recipe_id = ctx.rng.choice(ctx.recipes[user.id])
+    image = io.BytesIO()
+    Image.new('RGB', (200, 200)).save(image, format='JPEG')
+    image.name = 'benchmark.jpg'
+    image.seek(0)
+    return client.post(
+        reverse('recipe:recipe-upload-image', args=[recipe_id]),
+        {'image': image},
+        format='multipart',
+    )
+
+
+def obtain_token(client, ctx, user):
+    return client.post(reverse('user:token'), {
+        'email': user.email,
+        'password': ctx.password,
+    })
+
+
+SCENARIOS = {
+    'list': list_recipes,
+    'filter': filter_recipes,
+    'detail': recipe_detail,
+    'tags': list_tags,
+    'create': create_recipe,
+    'upload-image': upload_image,
+    'token': obtain_token,
+}
+
+
+class ScenarioResult:
+    '''Latencies and query counts collected for one scenario'''
+
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.queries = []
+        self.errors = 0
+
+    def summary(self):
+        count = len(self.latencies)
+        return {
+            'scenario': self.name,
+            'requests': count,
+            'errors': self.errors,
+            'p50_ms': round(percentile(self.latencies, 50), 2),
+            'p95_ms': round(percentile(self.latencies, 95), 2),
+            'p99_ms': round(percentile(self.latencies, 99), 2),
+            'queries_avg': round(sum(self.queries) / count, 2) if count else 0,
+            'queries_max': max(self.queries) if count else 0,
+        }
+
+
+# Throttling would turn the benchmark into a benchmark of 429 responses
+@override_settings(REST_FRAMEWORK={'DEFAULT_THROTTLE_RATES': {}})
+def run_scenarios(ctx, names, iterations):
+    '''Run each named scenario iterations times, return ScenarioResults'''
+
+    client = APIClient(SERVER_NAME='localhost')
+    results = []
+    for name in names:
+        scenario = SCENARIOS[name]
+        result = ScenarioResult(name)
+        for _ in range(iterations):
+            user = ctx.pick_user()
+            if name == 'token':
+                client.force_authenticate(None)
+            else:
+                client.force_authenticate(user)
+            inspector = QueryInspector()
+            start = time.perf_counter()
+            with inspector.capture():
+                res = scenario(client, ctx, user)
+            result.latencies.append((time.perf_counter() - start) * 1000)
+            result.queries.append(len(inspector))
+            if res.status_code >= 400:
+                result.errors += 1
+            if name == 'upload-image' and res.status_code == 200:
+                Recipe.objects.get(pk=res.data['id']).image.delete()
+        results.append(result)
+    return results
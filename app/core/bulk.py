@@ -0,0 +1,264 @@
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.db import router, transaction
+from django.utils import timezone
+from core.catalog import canonical_id
+from core.changes import KINDS, record_changes, record_recipe_changes, \
+    recipes_bulk_changed
+from core.counts import reconcile_recipe_counts, release_counts
+from core.models import Tag, Ingredient, Recipe, RecipeStats, \
+    RecipePriceBucket, Change, SimilarityBand, IngredientQuantity, \
+    normalize_name
+from core.stats import refresh_recipe_stats, release_stats
+
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def _raw_delete(queryset):
+    '''Delete with a single DELETE, skipping the cascade collector'''
+
+    return queryset._raw_delete(router.db_for_write(queryset.model))
+
+
+def _delete_files(names):
+    for name in names:
+        default_storage.delete(name)
+
+
+def _delete_recipes_batch(rows, record=True):
+    '''Delete recipes given as (user_id, recipe_id, image) rows
+
+    Image files are removed once the transaction has committed.
+    '''
+
+    user_ids = {user_id for user_id, _pk, _image in rows}
+    recipe_ids = [pk for _user_id, pk, _image in rows]
+    images = [image for _user_id, _pk, image in rows if image]
+    with transaction.atomic():
+        Recipe.tags.through.objects.filter(recipe_id__in=recipe_ids).delete()
+        Recipe.ingredients.through.objects \
+            .filter(recipe_id__in=recipe_ids).delete()
+        _raw_delete(IngredientQuantity.objects.filter(
+            recipe_id__in=recipe_ids
+        ))
+        _raw_delete(SimilarityBand.objects.filter(
+            user_id__in=user_ids, recipe_id__in=recipe_ids
+        ))
+        deleted = _raw_delete(Recipe.all_objects.filter(
+            user_id__in=user_ids, pk__in=recipe_ids
+        ))
+        if record:
+            record_changes(Change.RECIPE, [row[:2] for row in rows],
+                           deleted=True)
+        if images:
+            transaction.on_commit(lambda: _delete_files(images))
+        return deleted
+
+
+def _delete_in_batches(recipes, batch_size, record=True):
+    deleted = 0
+    while True:
+        batch = list(
+            recipes.order_by('pk')
+            .values_list('user_id', 'pk', 'image')[:batch_size]
+        )
+        if not batch:
+            return deleted
+        deleted += _delete_recipes_batch(batch, record)
+
+
+def _after_bulk_change(user_ids, recipe_ids=()):
+    reconcile_recipe_counts(user_ids)
+    refresh_recipe_stats(user_ids)
+    recipes_bulk_changed.send(sender=Recipe, user_ids=user_ids,
+                              recipe_ids=recipe_ids)
+
+
+def delete_recipes(recipes, batch_size=DEFAULT_BATCH_SIZE):
+    '''Delete the recipes of a queryset in batches of plain DELETEs
+
+    Through table rows go first, then the recipes. Tag and ingredient
+    counts and stats of the owners are recomputed afterwards. Returns the
+    number of recipes deleted.
+    '''
+
+    user_ids = list(
+        recipes.order_by().values_list('user_id', flat=True).distinct()
+    )
+    deleted = _delete_in_batches(recipes, batch_size)
+    _after_bulk_change(user_ids)
+    return deleted
+
+
+def delete_user_recipes(user_ids, batch_size=DEFAULT_BATCH_SIZE):
+    '''Delete every recipe of the given users, soft deleted ones too'''
+
+    return delete_recipes(
+        Recipe.all_objects.filter(user_id__in=user_ids), batch_size
+    )
+
+
+def soft_delete_recipe(recipe):
+    '''Hide a recipe now and leave the actual delete to purge_recipes
+
+    Only the recipe row is updated. Counts, stats, similarity bands and
+    the change feed are adjusted right away, as if it was gone. Returns
+    False when the recipe was deleted already.
+    '''
+
+    with transaction.atomic():
+        recipe.deleted_at = timezone.now()
+        updated = Recipe.objects \
+            .filter(user_id=recipe.user_id, pk=recipe.pk) \
+            .update(deleted_at=recipe.deleted_at)
+        if not updated:
+            return False
+        release_counts(recipe.pk)
+        release_stats(recipe)
+        _raw_delete(SimilarityBand.objects.filter(
+            user_id=recipe.user_id, recipe_id=recipe.pk
+        ))
+        record_changes(Change.RECIPE, [(recipe.user_id, recipe.pk)],
+                       deleted=True)
+    recipes_bulk_changed.send(sender=Recipe, user_ids=[recipe.user_id])
+    return True
+
+
+def restore_recipes(recipes):
+    '''Bring soft deleted recipes of a queryset back
+
+    Counts, stats and similarity bands of the owners are rebuilt and the
+    change feed gets the recipes again. Returns the number restored.
+    '''
+
+    with transaction.atomic():
+        rows = list(
+            recipes.filter(deleted_at__isnull=False).order_by()
+            .values_list('user_id', 'pk')
+        )
+        if not rows:
+            return 0
+        user_ids = sorted({user_id for user_id, _pk in rows})
+        recipe_ids = [pk for _user_id, pk in rows]
+        Recipe.all_objects \
+            .filter(user_id__in=user_ids, pk__in=recipe_ids) \
+            .update(deleted_at=None)
+        record_changes(Change.RECIPE, rows)
+    _after_bulk_change(user_ids, recipe_ids)
+    return len(rows)
+
+
+def purge_recipes(before, batch_size=DEFAULT_BATCH_SIZE):
+    '''Delete recipes soft deleted before a datetime, in batches
+
+    Counts, stats and the change feed were updated at soft delete time,
+    so this only removes rows and image files. Returns the number purged.
+    '''
+
+    return _delete_in_batches(
+        Recipe.all_objects.filter(deleted_at__lt=before), batch_size,
+        record=False,
+    )
+
+
+def delete_users(user_ids, batch_size=DEFAULT_BATCH_SIZE):
+    '''Delete users and all their data without loading it into memory'''
+
+    delete_user_recipes(user_ids, batch_size)
+    with transaction.atomic():
+        # Links from recipes of other users, if any
+        Recipe.tags.through.objects \
+            .filter(tag__user_id__in=user_ids).delete()
+        Recipe.ingredients.through.objects \
+            .filter(ingredient__user_id__in=user_ids).delete()
+        IngredientQuantity.objects \
+            .filter(ingredient__user_id__in=user_ids).delete()
+        for model in (Tag, Ingredient, RecipeStats, RecipePriceBucket,
+                      Change, SimilarityBand):
+            _raw_delete(model.objects.filter(user_id__in=user_ids))
+        # What is left (tokens, sessions, permissions) is small
+        deleted, _ = get_user_model().objects \
+            .filter(pk__in=user_ids).delete()
+    return deleted
+
+
+def merge_into(target, duplicates):
+    '''Point every recipe using duplicates at target, then drop them
+
+    target and duplicates are Tag or Ingredient objects of one user.
+    Links are moved with one UPDATE, recipes that already use target
+    just lose the duplicate link.
+    '''
+
+    model = type(target)
+    dup_ids = [obj.pk for obj in duplicates if obj.pk != target.pk]
+    if not dup_ids:
+        return 0
+    if any(obj.user_id != target.user_id for obj in duplicates):
+        raise ValueError('Only objects of the same user can be merged')
+
+    relation = Recipe.tags if model is Tag else Recipe.ingredients
+    through = relation.through
+    column = 'tag_id' if model is Tag else 'ingredient_id'
+    with transaction.atomic():
+        relinked = set(
+            through.objects.filter(**{f'{column}__in': dup_ids})
+            .values_list('recipe_id', flat=True)
+        )
+        already_linked = through.objects.filter(**{column: target.pk}) \
+            .values('recipe_id')
+        through.objects.filter(**{f'{column}__in': dup_ids}) \
+            .exclude(recipe_id__in=already_linked) \
+            .update(**{column: target.pk})
+        through.objects.filter(**{f'{column}__in': dup_ids}).delete()
+        if model is Ingredient:
+            # Quantities follow their links
+            measured = IngredientQuantity.objects.filter(ingredient=target) \
+                .values('recipe_id')
+            IngredientQuantity.objects.filter(ingredient_id__in=dup_ids) \
+                .exclude(recipe_id__in=measured).update(ingredient=target)
+            IngredientQuantity.objects.filter(ingredient_id__in=dup_ids) \
+                .delete()
+        merged = _raw_delete(model.objects.filter(pk__in=dup_ids))
+        record_changes(KINDS[model],
+                       [(target.user_id, pk) for pk in dup_ids],
+                       deleted=True)
+        record_recipe_changes(target.user_id, relinked)
+    _after_bulk_change([target.user_id], sorted(relinked))
+    return merged
+
+
+def normalize_names(model, batch_size=DEFAULT_BATCH_SIZE):
+    '''Fill normalized_name of Tag/Ingredient rows written without one
+
+    Code from before migration 0010 inserts rows with the '' database
+    default while a deploy is under way. Rows whose name the user has
+    already are merged into that row. Only such leftovers are handled,
+    one row at a time. Returns the number of rows fixed.
+    '''
+
+    fixed = 0
+    last_pk = 0
+    while True:
+        rows = list(
+            model.objects.filter(pk__gt=last_pk, normalized_name='')
+            .order_by('pk')[:batch_size]
+        )
+        if not rows:
+            return fixed
+        last_pk = rows[-1].pk
+        for row in rows:
+            key = normalize_name(row.name)
+            if not key:
+                continue
+            existing = model.objects \
+                .filter(user_id=row.user_id, normalized_name=key).first()
+            if existing is None:
+                model.objects.filter(pk=row.pk).update(
+                    normalized_name=key,
+                    canonical_id=canonical_id(model, key),
+                )
+            else:
+                merge_into(existing, [row])
+            fixed += 1
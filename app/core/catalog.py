@@ -0,0 +1,174 @@
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Min, OuterRef, Subquery
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from core.models import Tag, Ingredient, CatalogTag, CatalogIngredient
+
+
+class CatalogCache:
+    '''In-process copy of a catalog table, normalized name -> (id, name)
+
+    The whole table is loaded once per process. A version number in the
+    shared cache is bumped on every catalog change, processes compare it
+    at most every CATALOG_CACHE_CHECK_SECONDS and reload when it moved.
+    '''
+
+    def __init__(self, model):
+        self.model = model
+        self._entries = None
+        self._names = {}
+        self._version = None
+        self._checked = 0
+        self._lock = threading.Lock()
+
+    @property
+    def version_key(self):
+        return f'catalog-version:{self.model._meta.label_lower}'
+
+    def _shared_version(self):
+        return cache.get_or_set(self.version_key, 1, None)
+
+    def entries(self):
+        '''Return the catalog, reloading it when another process changed it'''
+
+        interval = getattr(settings, 'CATALOG_CACHE_CHECK_SECONDS', 30)
+        now = time.monotonic()
+        entries = self._entries
+        if entries is not None and now - self._checked < interval:
+            return entries
+        with self._lock:
+            version = self._shared_version()
+            if self._entries is None or version != self._version:
+                entries = {
+                    normalized: (pk, name)
+                    for pk, normalized, name in self.model.objects
+                    .values_list('pk', 'normalized_name', 'name').iterator()
+                }
+                self._names = {pk: name for pk, name in entries.values()}
+                self._entries = entries
+                self._version = version
+            self._checked = now
+            return self._entries
+
+    def get(self, normalized_name):
+        '''Return (id, name) of a catalog entry or None'''
+
+        return self.entries().get(normalized_name)
+
+    def name(self, pk):
+        '''Return the name of a catalog entry by id or None'''
+
+        self.entries()
+        return self._names.get(pk)
+
+    def invalidate(self):
+        '''Drop this copy and tell the other processes to reload theirs'''
+
+        try:
+            cache.incr(self.version_key)
+        except ValueError:
+            cache.set(self.version_key, 1, None)
+        self._entries = None
+
+
+# user owned model -> cache of the catalog it references
+CATALOGS = {
+    Tag: CatalogCache(CatalogTag),
+    Ingredient: CatalogCache(CatalogIngredient),
+}
+
+
+def clear_catalog_cache():
+    '''Forget the in-process copies, for tests'''
+
+    for catalog in CATALOGS.values():
+        catalog._entries = None
+
+
+def catalog_enabled():
+    return getattr(settings, 'CATALOG_ENABLED', True)
+
+
+def canonical_id(model, normalized_name):
+    '''Return the id of the catalog entry for a Tag/Ingredient name'''
+
+    if not catalog_enabled():
+        return None
+    entry = CATALOGS[model].get(normalized_name)
+    return entry[0] if entry else None
+
+
+def canonical_name(model, pk):
+    '''Return the catalog name a Tag/Ingredient row is linked to
+
+    Served from the in-process copy, so listing rows costs no query.
+    '''
+
+    if pk is None or not catalog_enabled():
+        return None
+    return CATALOGS[model].name(pk)
+
+
+def link_to_catalog(model, user_ids=None):
+    '''Point rows of a Tag/Ingredient table at their catalog entries
+
+    A single UPDATE with a correlated subquery, rows without an entry get
+    NULL. Returns the number of rows updated.
+    '''
+
+    catalog = CATALOGS[model].model
+    rows = model.objects.all()
+    if user_ids is not None:
+        rows = rows.filter(user_id__in=user_ids)
+    return rows.update(canonical=Subquery(
+        catalog.objects.filter(normalized_name=OuterRef('normalized_name'))
+        .values('pk')[:1]
+    ))
+
+
+def promote(model, min_users):
+    '''Add names used by at least min_users users to the catalog
+
+    Returns the number of catalog entries created. Rows are not linked,
+    run link_to_catalog afterwards.
+    '''
+
+    catalog = CATALOGS[model].model
+    known = catalog.objects.values('normalized_name')
+    rows = model.objects.order_by().values('normalized_name') \
+        .annotate(users=Count('user_id', distinct=True),
+                  display_name=Min('name')) \
+        .filter(users__gte=min_users) \
+        .exclude(normalized_name__in=known)
+    with transaction.atomic():
+        # bulk_create skips save(), so normalized_name is set here
+        created = catalog.objects.bulk_create([
+            catalog(name=row['display_name'],
+                    normalized_name=row['normalized_name'])
+            for row in rows.iterator()
+        ], batch_size=5000)
+    CATALOGS[model].invalidate()
+    return len(created)
+
+
+@receiver(pre_save, sender=Tag)
+@receiver(pre_save, sender=Ingredient)
+def set_canonical(sender, instance, raw=False, **kwargs):
+    # Model.save() has already set normalized_name, and the catalog is
+    # served from memory so this costs no query
+    if not raw:
+        instance.canonical_id = canonical_id(sender, instance.normalized_name)
+
+
+@receiver(post_save, sender=CatalogTag)
+@receiver(post_delete, sender=CatalogTag)
+@receiver(post_save, sender=CatalogIngredient)
+@receiver(post_delete, sender=CatalogIngredient)
+def invalidate_on_change(sender, **kwargs):
+    for catalog in CATALOGS.values():
+        if catalog.model is sender:
+            catalog.invalidate()
@@ -0,0 +1,290 @@
+import threading
+from contextlib import contextmanager
+from django.db import connection, router
+from django.db.models import BigIntegerField, Func, Q
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import Signal, receiver
+from core.models import Tag, Ingredient, Recipe, Change, ChangePrune
+
+
+# model -> Change.kind
+KINDS = {
+    Recipe: Change.RECIPE,
+    Tag: Change.TAG,
+    Ingredient: Change.INGREDIENT,
+}
+
+
+# Sent after set based changes that skipped the per object signals, and
+# at the end of batch_recipe_changes(). recipe_ids lists the recipes that
+# still exist but were relinked.
+recipes_bulk_changed = Signal(providing_args=['user_ids', 'recipe_ids'])
+
+_local = threading.local()
+
+
+# Postgres SQL returning the commit horizon: transactions with a lower id
+# have all ended. The oldest transaction still running is the lowest id of
+# the snapshot, the own one doesn't count as its rows are visible to it.
+POSTGRES_HORIZON_SQL = '''
+    SELECT COALESCE(
+        (SELECT MIN(xip) FROM txid_snapshot_xip(txid_current_snapshot()) xip),
+        txid_snapshot_xmax(txid_current_snapshot())
+    )
+'''
+
+
+class TransactionId(Func):
+    '''Id of the current transaction, stored with every change'''
+
+    function = 'txid_current'
+    template = '%(function)s()'
+    output_field = BigIntegerField()
+
+    def as_sql(self, compiler, connection, **extra_context):
+        # Other backends allow a single writer, ids are in commit order
+        return '0', []
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection, **extra_context)
+
+
+def commit_horizon():
+    '''Return the lowest transaction id that may still commit changes
+
+    None where ids are taken in commit order anyway.
+    '''
+
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(POSTGRES_HORIZON_SQL)
+        return cursor.fetchone()[0]
+
+
+def format_cursor(cursor):
+    return '{}-{}'.format(*cursor)
+
+
+def parse_cursor(value):
+    '''Return the (txid, id) of a cursor, ValueError if malformed'''
+
+    txid, sep, pk = str(value).partition('-')
+    if not sep or not txid.isdecimal() or not pk.isdecimal():
+        raise ValueError(f'Invalid cursor {value!r}')
+    return int(txid), int(pk)
+
+
+def record_changes(kind, rows, deleted=False):
+    '''Append (user_id, object_id) pairs to the change feed in one INSERT'''
+
+    Change.objects.bulk_create([
+        Change(user_id=user_id, kind=kind, object_id=object_id,
+               deleted=deleted, txid=TransactionId())
+        for user_id, object_id in rows
+    ], batch_size=5000)
+
+
+class RecipeChangeBatch:
+    '''Side effects of recipe writes, collected by batch_recipe_changes()'''
+
+    def __init__(self):
+        # (kind, object id) -> (user id, deleted)
+        self.changes = {}
+        self.user_ids = set()
+        self.relinked = set()
+
+    def changed(self, kind, rows, deleted=False):
+        for user_id, object_id in rows:
+            self.changes[kind, object_id] = (user_id, deleted)
+            self.user_ids.add(user_id)
+
+    def flush(self):
+        Change.objects.bulk_create([
+            Change(user_id=user_id, kind=kind, object_id=object_id,
+                   deleted=deleted, txid=TransactionId())
+            for (kind, object_id), (user_id, deleted) in self.changes.items()
+        ])
+        recipes_bulk_changed.send(sender=Recipe,
+                                  user_ids=sorted(self.user_ids),
+                                  recipe_ids=sorted(self.relinked))
+
+
+def current_batch():
+    '''Return the batch of the running batch_recipe_changes(), if any'''
+
+    return getattr(_local, 'batch', None)
+
+
+@contextmanager
+def batch_recipe_changes():
+    '''Do the side effects of the recipe writes in a block once, at its end
+
+    Every save and relink otherwise appends to the change feed, bumps the
+    owner's facet version and queues a similarity refresh by itself. In
+    the block the receivers note them in the batch instead, and the end
+    writes one change per object and sends recipes_bulk_changed once.
+    Nothing is written if the block raises. Run it inside the transaction
+    of the writes.
+    '''
+
+    if current_batch() is not None:
+        yield current_batch()
+        return
+    batch = _local.batch = RecipeChangeBatch()
+    try:
+        yield batch
+    finally:
+        _local.batch = None
+    batch.flush()
+
+
+def record_recipe_changes(user_id, recipe_ids):
+    '''Record changes of a user's recipes, e.g. after relinking them'''
+
+    rows = Recipe.objects.filter(user_id=user_id, pk__in=recipe_ids) \
+        .values_list('user_id', 'pk')
+    record_changes(Change.RECIPE, list(rows))
+
+
+def _after(cursor):
+    txid, pk = cursor
+    return Q(txid__gt=txid) | Q(txid=txid, id__gt=pk)
+
+
+def _before(cursor):
+    txid, pk = cursor
+    return Q(txid__lt=txid) | Q(txid=txid, id__lt=pk)
+
+
+def read_changes(user_id, since, limit):
+    '''Return the user's changes after the cursor since, oldest first
+
+    Changes of transactions that may still be running next to ones that
+    committed are held back, so a cursor never passes a change that shows
+    up later. Several changes of one object are folded into the last one.
+    Returns (changes, cursor, has_more) where changes maps kind to a dict
+    of object id -> deleted flag and cursor is the (txid, id) of the last
+    entry read.
+    '''
+
+    queryset = Change.objects.filter(_after(since), user_id=user_id)
+    horizon = commit_horizon()
+    if horizon is not None:
+        queryset = queryset.filter(txid__lt=horizon)
+    entries = list(
+        queryset.order_by('txid', 'id')
+        .values_list('txid', 'id', 'kind', 'object_id', 'deleted')
+        [:limit + 1]
+    )
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    changes = {kind: {} for kind, _label in Change.KIND_CHOICES}
+    for _txid, _id, kind, object_id, deleted in entries:
+        changes[kind][object_id] = deleted
+    cursor = tuple(entries[-1][:2]) if entries else since
+    return changes, cursor, has_more
+
+
+def latest_cursor():
+    '''Return the cursor a new client starts from
+
+    Changes of transactions still running when it is taken come after it.
+    '''
+
+    horizon = commit_horizon()
+    if horizon is not None:
+        return (horizon, 0)
+    newest = Change.objects.order_by('-txid', '-id') \
+        .values_list('txid', 'id').first()
+    return tuple(newest) if newest else (0, 0)
+
+
+def pruned_cursor():
+    '''Return the cursor of the newest pruned change, None if none was'''
+
+    pruned = ChangePrune.objects.values_list('txid', 'change_id').first()
+    return tuple(pruned) if pruned else None
+
+
+def prune_changes(before, batch_size=10000):
+    '''Delete changes created before a datetime, in batches
+
+    The newest change is always kept. Clients with a cursor before the
+    newest deleted change have to start over, see pruned_cursor(). Returns
+    the number deleted.
+    '''
+
+    cutoff = Change.objects.filter(created_at__gte=before) \
+        .order_by('txid', 'id').values_list('txid', 'id').first()
+    if cutoff is None:
+        cutoff = Change.objects.order_by('-txid', '-id') \
+            .values_list('txid', 'id').first()
+        if cutoff is None:
+            return 0
+    older = Change.objects.filter(_before(cutoff)).order_by('txid', 'id')
+    newest = older.reverse().values_list('txid', 'id').first()
+    if newest is None:
+        return 0
+    # Recorded first, a client must not pass a change that is going away
+    ChangePrune.objects.update_or_create(
+        pk=1, defaults={'txid': newest[0], 'change_id': newest[1]}
+    )
+    deleted = 0
+    while True:
+        batch = list(older.values_list('id', flat=True)[:batch_size])
+        if not batch:
+            return deleted
+        # A plain DELETE by id, nothing references changes
+        queryset = Change.objects.filter(id__in=batch)
+        deleted += queryset._raw_delete(router.db_for_write(Change))
+
+
+def _record(kind, rows, deleted=False):
+    batch = current_batch()
+    if batch is not None:
+        batch.changed(kind, rows, deleted)
+    else:
+        record_changes(kind, rows, deleted)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def record_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        _record(KINDS[sender], [(instance.user_id, instance.pk)])
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def record_delete(sender, instance, **kwargs):
+    # Soft deleted recipes got their tombstone already
+    if getattr(instance, 'deleted_at', None) is not None:
+        return
+    _record(KINDS[sender], [(instance.user_id, instance.pk)], deleted=True)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def record_relation_change(sender, instance, action, reverse, pk_set,
+                           **kwargs):
+    '''A recipe lists its tag and ingredient ids, so relinking changes it'''
+
+    if not reverse:
+        if action.startswith('post_'):
+            _record(Change.RECIPE, [(instance.user_id, instance.pk)])
+        return
+
+    # instance is a tag or ingredient and the recipes are on the other side
+    if action == 'pre_clear':
+        instance.__dict__['_changes_pending'] = list(
+            instance.recipe_set.values_list('pk', flat=True)
+        )
+    elif action == 'post_clear':
+        record_recipe_changes(
+            instance.user_id, instance.__dict__.pop('_changes_pending', [])
+        )
+    elif action in ('post_add', 'post_remove'):
+        record_recipe_changes(instance.user_id, pk_set)
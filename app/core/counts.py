@@ -0,0 +1,111 @@
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.db.models.signals import m2m_changed, pre_delete
+from django.dispatch import receiver
+from core.models import Tag, Ingredient, Recipe
+
+
+# through model -> (counted model, through column pointing at it)
+COUNTED_RELATIONS = {
+    Recipe.tags.through: (Tag, 'tag_id'),
+    Recipe.ingredients.through: (Ingredient, 'ingredient_id'),
+}
+
+
+def adjust_recipe_counts(model, ids, delta):
+    '''Add delta to recipe_count of the given rows in one UPDATE'''
+
+    if ids and delta:
+        model.objects.filter(pk__in=ids).update(
+            recipe_count=F('recipe_count') + delta
+        )
+
+
+def _linked_ids(sender, instance, reverse, pk_set):
+    '''Return the ids on the other side that are linked to instance'''
+
+    model, column = COUNTED_RELATIONS[sender]
+    if reverse:
+        links = sender.objects.filter(**{column: instance.pk})
+        other = 'recipe_id'
+    else:
+        links = sender.objects.filter(recipe_id=instance.pk)
+        other = column
+    if pk_set is not None:
+        links = links.filter(**{f'{other}__in': pk_set})
+    return set(links.values_list(other, flat=True))
+
+
+@receiver(m2m_changed)
+def update_recipe_counts(sender, instance, action, reverse, model, pk_set,
+                         **kwargs):
+    '''Keep Tag/Ingredient.recipe_count in step with the through tables'''
+
+    if sender not in COUNTED_RELATIONS:
+        return
+
+    # remove() and clear() are not told which links really existed, so
+    # look them up before they are gone
+    if action in ('pre_remove', 'pre_clear'):
+        pending = instance.__dict__.setdefault('_recipe_count_pending', {})
+        pending[sender] = _linked_ids(sender, instance, reverse, pk_set)
+        return
+
+    if action == 'post_add':
+        changed, delta = pk_set, 1
+    elif action in ('post_remove', 'post_clear'):
+        pending = instance.__dict__.get('_recipe_count_pending', {})
+        changed, delta = pending.pop(sender, set()), -1
+    else:
+        return
+
+    counted_model = COUNTED_RELATIONS[sender][0]
+    if reverse:
+        adjust_recipe_counts(counted_model, [instance.pk],
+                             delta * len(changed))
+    else:
+        adjust_recipe_counts(counted_model, changed, delta)
+
+
+def release_counts(recipe_id):
+    '''Decrement the counts of everything linked to a recipe'''
+
+    for through, (model, column) in COUNTED_RELATIONS.items():
+        ids = through.objects.filter(recipe_id=recipe_id) \
+            .values_list(column, flat=True)
+        adjust_recipe_counts(model, list(ids), -1)
+
+
+@receiver(pre_delete, sender=Recipe)
+def release_recipe_counts(sender, instance, **kwargs):
+    '''Decrement counts before the recipe's through rows cascade away'''
+
+    # Soft deleted recipes were released already
+    if instance.deleted_at is None:
+        release_counts(instance.pk)
+
+
+def reconcile_recipe_counts(user_ids=None):
+    '''Recompute recipe_count from the through tables
+
+    Links of soft deleted recipes are not counted. Returns the number of
+    rows whose count was wrong.
+    '''
+
+    fixed = 0
+    for through, (model, column) in COUNTED_RELATIONS.items():
+        actual = Coalesce(Subquery(
+            through.objects.filter(**{column: OuterRef('pk')})
+            .filter(recipe__deleted_at__isnull=True)
+            .order_by().values(column).annotate(total=Count('*'))
+            .values('total'),
+            output_field=IntegerField(),
+        ), 0)
+        queryset = model.objects.all()
+        if user_ids is not None:
+            queryset = queryset.filter(user_id__in=user_ids)
+        wrong = queryset.annotate(actual=actual) \
+            .exclude(recipe_count=F('actual')).values('pk')
+        fixed += model.objects.filter(pk__in=wrong) \
+            .update(recipe_count=actual)
+    return fixed
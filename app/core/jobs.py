@@ -0,0 +1,310 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import timedelta
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import Count, F, Min
+from django.utils import timezone
+from core.metrics import GAUGE_MAX_AGE, GaugeFamily, register
+from core.models import Job
+
+
+logger = logging.getLogger(__name__)
+
+# Task name -> Task, filled by the @task decorator
+TASKS = {}
+
+
+class Task:
+    '''Function that can be run by a worker, see task()'''
+
+    def __init__(self, func, name, max_attempts):
+        self.func = func
+        self.name = name
+        self.max_attempts = max_attempts
+
+    def __call__(self, **kwargs):
+        return self.func(**kwargs)
+
+    def delay(self, run_at=None, **kwargs):
+        '''Queue a run of the task with the given keyword arguments'''
+
+        return enqueue(self.name, run_at=run_at,
+                       max_attempts=self.max_attempts, **kwargs)
+
+
+def task(name=None, max_attempts=3):
+    '''Register a function as a background task
+
+    Tasks take JSON serializable keyword arguments and may run more than
+    once, so they have to be idempotent.
+    '''
+
+    def decorator(func):
+        registered = Task(func, name or f'{func.__module__}.{func.__name__}',
+                          max_attempts)
+        TASKS[registered.name] = registered
+        return registered
+    return decorator
+
+
+def enqueue(name, run_at=None, max_attempts=3, **kwargs):
+    '''Insert a job, visible to workers once the transaction commits'''
+
+    return Job.objects.create(
+        name=name,
+        payload=json.dumps(kwargs, cls=DjangoJSONEncoder),
+        run_at=run_at or timezone.now(),
+        max_attempts=max_attempts,
+    )
+
+
+def backoff(attempts):
+    '''Seconds to wait before retrying a job that failed attempts times'''
+
+    base = getattr(settings, 'JOBS_RETRY_DELAY', 10)
+    return base * 2 ** (attempts - 1)
+
+
+def claim(worker_id, limit=1):
+    '''Lock due jobs for a worker and mark them running
+
+    SELECT ... FOR UPDATE SKIP LOCKED lets workers claim jobs side by side
+    without waiting on each other's row locks.
+    '''
+
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status=Job.QUEUED, run_at__lte=now)
+            .order_by('run_at').values_list('pk', flat=True)[:limit]
+        )
+        if not ids:
+            return []
+        Job.objects.filter(pk__in=ids).update(
+            status=Job.RUNNING, locked_at=now, locked_by=worker_id,
+            attempts=F('attempts') + 1,
+        )
+    return list(Job.objects.filter(pk__in=ids).order_by('run_at'))
+
+
+def requeue_stalled(timeout=None):
+    '''Give jobs of workers that died another try, or fail them
+
+    Returns the number of jobs requeued.
+    '''
+
+    if timeout is None:
+        timeout = getattr(settings, 'JOBS_TIMEOUT', 600)
+    now = timezone.now()
+    stalled = Job.objects.filter(
+        status=Job.RUNNING, locked_at__lt=now - timedelta(seconds=timeout)
+    )
+    stalled.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.FAILED, finished_at=now, last_error='Timed out',
+    )
+    return stalled.update(
+        status=Job.QUEUED, locked_at=None, locked_by='',
+        last_error='Timed out',
+    )
+
+
+def heartbeat(worker_id, job_ids):
+    '''Mark jobs of a worker as alive, requeue_stalled leaves them be'''
+
+    return Job.objects.filter(
+        pk__in=job_ids, status=Job.RUNNING, locked_by=worker_id,
+    ).update(locked_at=timezone.now())
+
+
+def _finish(job, **fields):
+    '''Record the outcome of a claimed job, if the claim still holds
+
+    A worker past the lock timeout may finish after its job was requeued
+    and claimed again, its outcome must not overwrite the new claim.
+    '''
+
+    updated = Job.objects.filter(
+        pk=job.pk, status=Job.RUNNING, locked_by=job.locked_by,
+        attempts=job.attempts,
+    ).update(**fields)
+    if not updated:
+        logger.warning('Job %s was claimed again, dropping its outcome', job)
+    return updated
+
+
+def run_job(job):
+    '''Run a claimed job and record the outcome, returns True on success'''
+
+    try:
+        registered = TASKS.get(job.name)
+        if registered is None:
+            raise LookupError(f'Unknown task {job.name}')
+        registered(**json.loads(job.payload))
+    except Exception:
+        logger.exception('Job %s failed', job)
+        now = timezone.now()
+        error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            _finish(
+                job, status=Job.QUEUED, locked_at=None, locked_by='',
+                last_error=error,
+                run_at=now + timedelta(seconds=backoff(job.attempts)),
+            )
+        else:
+            _finish(job, status=Job.FAILED, finished_at=now,
+                    last_error=error)
+        return False
+    _finish(job, status=Job.DONE, finished_at=timezone.now())
+    return True
+
+
+def prune_jobs(before):
+    '''Delete jobs that finished before a datetime'''
+
+    deleted, _ = Job.objects.filter(status=Job.DONE,
+                                    finished_at__lt=before).delete()
+    return deleted
+
+
+def queue_stats():
+    '''Return job counts per status and the age of the oldest due job'''
+
+    counts = dict(
+        Job.objects.order_by().values_list('status')
+        .annotate(total=Count('*'))
+    )
+    oldest = Job.objects.filter(
+        status=Job.QUEUED, run_at__lte=timezone.now()
+    ).aggregate(oldest=Min('run_at'))['oldest']
+    return {
+        'counts': {status: counts.get(status, 0)
+                   for status, _label in Job.STATUS_CHOICES},
+        'oldest_due_seconds': (timezone.now() - oldest).total_seconds()
+        if oldest else 0,
+    }
+
+
+class Worker:
+    '''Runs jobs in concurrency threads until stopped
+
+    In burst mode every thread exits once no job is due. While jobs run,
+    a heartbeat thread refreshes their locked_at every heartbeat_interval
+    seconds, and the poll loop requeues jobs of dead workers as often.
+    '''
+
+    def __init__(self, concurrency=1, poll_interval=1.0, worker_id=None,
+                 heartbeat_interval=None):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.worker_id = worker_id or \
+            f'{socket.gethostname()}:{os.getpid()}'
+        if heartbeat_interval is None:
+            heartbeat_interval = getattr(settings, 'JOBS_HEARTBEAT_SECONDS',
+                                         60)
+        self.heartbeat_interval = heartbeat_interval
+        self.stopping = threading.Event()
+        self.processed = 0
+        self._running = set()
+        self._requeued_at = None
+        self._lock = threading.Lock()
+
+    def stop(self):
+        self.stopping.set()
+
+    def requeue_if_due(self):
+        '''Requeue stalled jobs, at most once per heartbeat interval'''
+
+        now = time.monotonic()
+        with self._lock:
+            if self._requeued_at is not None and \
+                    now - self._requeued_at < self.heartbeat_interval:
+                return
+            self._requeued_at = now
+        requeue_stalled()
+
+    def work(self, burst=False):
+        '''Claim and run jobs one at a time until stopped or idle'''
+
+        while not self.stopping.is_set():
+            self.requeue_if_due()
+            jobs = claim(self.worker_id)
+            if not jobs:
+                if burst:
+                    return
+                self.stopping.wait(self.poll_interval)
+                continue
+            for job in jobs:
+                with self._lock:
+                    self._running.add(job.pk)
+                try:
+                    run_job(job)
+                finally:
+                    with self._lock:
+                        self._running.discard(job.pk)
+                        self.processed += 1
+
+    def _beat(self, finished):
+        try:
+            while not finished.wait(self.heartbeat_interval):
+                with self._lock:
+                    running = list(self._running)
+                if running:
+                    heartbeat(self.worker_id, running)
+        finally:
+            connection.close()
+
+    def _thread_main(self, burst):
+        try:
+            self.work(burst)
+        finally:
+            connection.close()
+
+    def run(self, burst=False):
+        finished = threading.Event()
+        beat = threading.Thread(target=self._beat, args=(finished,),
+                                name=f'{self.worker_id}-heartbeat',
+                                daemon=True)
+        beat.start()
+        try:
+            if self.concurrency == 1:
+                self.work(burst)
+                return self.processed
+            threads = [
+                threading.Thread(target=self._thread_main, args=(burst,),
+                                 name=f'{self.worker_id}-{i}', daemon=True)
+                for i in range(self.concurrency)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(1)
+            return self.processed
+        finally:
+            finished.set()
+            beat.join()
+
+
+def _collect_jobs():
+    stats = queue_stats()
+    return {
+        'jobs': {
+            (status,): count for status, count in stats['counts'].items()
+        },
+        'jobs_oldest_due_seconds': {(): stats['oldest_due_seconds']},
+    }
+
+
+register(GaugeFamily((
+    ('jobs', 'Number of background jobs per status.', ('status',)),
+    ('jobs_oldest_due_seconds', 'Age of the oldest job waiting to run.',
+     ()),
+), _collect_jobs, max_age=GAUGE_MAX_AGE))
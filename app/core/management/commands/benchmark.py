@@ -0,0 +1,70 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from core import benchmarks
+from core.seeding import generate_dataset
+
+
+class Command(BaseCommand):
+    '''Command to benchmark the API against a generated dataset'''
+
+    help = 'Measure latency percentiles and queries per request of the API'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=5)
+        parser.add_argument('--recipes', type=int, default=50,
+                            help='Recipes per user')
+        parser.add_argument('--tags', type=int, default=10,
+                            help='Tags per user')
+        parser.add_argument('--ingredients', type=int, default=20,
+                            help='Ingredients per user')
+        parser.add_argument('--iterations', type=int, default=100,
+                            help='Requests per scenario')
+        parser.add_argument('--scenarios', default=','.join(
+            benchmarks.SCENARIOS
+        ))
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', dest='json_path',
+                            help='Also write the results to this file')
+        parser.add_argument('--keep', action='store_true',
+                            help='Keep the generated data')
+
+    def handle(self, *args, **options):
+        names = options['scenarios'].split(',')
+        unknown = set(names) - set(benchmarks.SCENARIOS)
+        if unknown:
+            raise CommandError(f'Unknown scenarios: {", ".join(unknown)}')
+
+        password = 'benchpass123'
+        with transaction.atomic():
+            self.stdout.write('Generating data...')
+            users = generate_dataset(
+                users=options['users'],
+                recipes=options['recipes'],
+                tags=options['tags'],
+                ingredients=options['ingredients'],
+                password=password,
+                seed=options['seed'],
+            )
+            ctx = benchmarks.BenchmarkContext(users, password,
+                                              seed=options['seed'])
+            results = benchmarks.run_scenarios(
+                ctx, names, options['iterations']
+            )
+            if not options['keep']:
+                transaction.set_rollback(True)
+
+        summaries = [result.summary() for result in results]
+        self.write_table(summaries)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(summaries, f, indent=2)
+
+    def write_table(self, summaries):
+        columns = ('scenario', 'requests', 'errors', 'p50_ms', 'p95_ms',
+                   'p99_ms', 'queries_avg', 'queries_max')
+        self.stdout.write(''.join(f'{col:>14}' for col in columns))
+        for summary in summaries:
+            self.stdout.write(
+                ''.join(f'{summary[col]:>14}' for col in columns)
+            )
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+from core import bulk
+from core.models import Tag, Ingredient
+
+
+class Command(BaseCommand):
+    '''Command to delete or merge data with set based queries'''
+
+    help = 'Bulk delete users/recipes or merge tags and ingredients'
+
+    def add_arguments(self, parser):
+        parser.add_argument('operation', choices=(
+            'delete-users', 'delete-recipes', 'merge-tags',
+            'merge-ingredients',
+        ))
+        parser.add_argument('ids', nargs='*', type=int,
+                            help='User ids to delete or clean up, or the '
+                                 'target followed by the ids to merge')
+        parser.add_argument('--batch-size', type=int,
+                            default=bulk.DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        operation = options['operation']
+        ids = options['ids']
+        if operation == 'delete-users':
+            deleted = bulk.delete_users(ids, options['batch_size'])
+            self.stdout.write(f'Deleted {deleted} users')
+        elif operation == 'delete-recipes':
+            deleted = bulk.delete_user_recipes(ids, options['batch_size'])
+            self.stdout.write(f'Deleted {deleted} recipes')
+        else:
+            model = Tag if operation == 'merge-tags' else Ingredient
+            if len(ids) < 2:
+                raise CommandError('Give the target id and ids to merge')
+            objs = model.objects.in_bulk(ids)
+            missing = set(ids) - set(objs)
+            if missing:
+                raise CommandError(f'Not found: {sorted(missing)}')
+            try:
+                merged = bulk.merge_into(
+                    objs[ids[0]], [objs[pk] for pk in ids[1:]]
+                )
+            except ValueError as e:
+                raise CommandError(str(e))
+            self.stdout.write(f'Merged {merged} rows')
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from core import bulk
+from core.models import Tag, Ingredient
+
+
+class Command(BaseCommand):
+    '''Command to normalize names written during the 0010 deploy'''
+
+    help = 'Fill normalized_name of tags and ingredients that lack one'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+                            default=bulk.DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        for model in (Tag, Ingredient):
+            fixed = bulk.normalize_names(model, options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(
+                f'Normalized {fixed} {model._meta.verbose_name_plural}'
+            ))
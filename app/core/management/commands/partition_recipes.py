@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from core import partitioning
+
+
+class Command(BaseCommand):
+    '''Command to hash partition the recipe tables on PostgreSQL'''
+
+    help = 'Convert recipes and their through tables to partitioned tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--partitions', type=int,
+            default=getattr(settings, 'RECIPE_PARTITIONS', 16),
+            help='Number of hash partitions per table',
+        )
+        parser.add_argument('--sql', action='store_true',
+                            help='Print the statements without running them')
+
+    def handle(self, *args, **options):
+        if options['partitions'] < 2:
+            raise CommandError('Use at least 2 partitions')
+        try:
+            if options['sql']:
+                statements = partitioning.partition_statements(
+                    options['partitions']
+                )
+                self.stdout.write(';\n'.join(statements) + ';')
+                return
+            partitioning.partition_tables(options['partitions'])
+        except partitioning.PartitioningError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f'Partitioned recipe tables into {options["partitions"]} '
+            f'partitions'
+        ))
@@ -0,0 +1,23 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from core.changes import prune_changes
+
+
+class Command(BaseCommand):
+    '''Command to drop old entries of the change feed'''
+
+    help = 'Delete change feed entries older than the retention period'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int,
+            default=getattr(settings, 'CHANGE_FEED_RETENTION_DAYS', 30),
+            help='Keep changes of this many days',
+        )
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=options['days'])
+        deleted = prune_changes(before)
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} changes'))
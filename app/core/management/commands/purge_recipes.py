@@ -0,0 +1,25 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from core import bulk
+
+
+class Command(BaseCommand):
+    '''Command to delete soft deleted recipes for good'''
+
+    help = 'Delete recipes, their links and images after soft deletion'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int,
+            default=getattr(settings, 'RECIPE_PURGE_AFTER_DAYS', 1),
+            help='Only purge recipes deleted at least this many days ago',
+        )
+        parser.add_argument('--batch-size', type=int,
+                            default=bulk.DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=options['days'])
+        purged = bulk.purge_recipes(before, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Purged {purged} recipes'))
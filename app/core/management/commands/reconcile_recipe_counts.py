@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from core.counts import reconcile_recipe_counts
+
+
+class Command(BaseCommand):
+    '''Command to repair tag and ingredient recipe counts'''
+
+    help = 'Recompute Tag/Ingredient.recipe_count from the through tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append',
+                            dest='user_ids',
+                            help='Only reconcile this user, repeatable')
+
+    def handle(self, *args, **options):
+        fixed = reconcile_recipe_counts(options['user_ids'])
+        self.stdout.write(self.style.SUCCESS(f'Fixed {fixed} counts'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from core.stats import refresh_recipe_stats
+
+
+class Command(BaseCommand):
+    '''Command to rebuild the recipe stats summary tables'''
+
+    help = 'Recompute per user recipe stats from the recipe table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append',
+                            dest='user_ids',
+                            help='Only refresh this user, repeatable')
+
+    def handle(self, *args, **options):
+        refreshed = refresh_recipe_stats(options['user_ids'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Refreshed stats of {refreshed} users'
+        ))
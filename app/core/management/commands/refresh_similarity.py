@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from core import similarity
+from core.models import Recipe
+
+
+class Command(BaseCommand):
+    '''Command to rebuild the buckets used to find similar recipes'''
+
+    help = 'Recompute the MinHash bands of recipes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append',
+                            dest='user_ids',
+                            help='Only refresh recipes of this user')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.order_by('pk')
+        if options['user_ids']:
+            recipes = recipes.filter(user_id__in=options['user_ids'])
+        refreshed = 0
+        last = 0
+        while True:
+            batch = list(
+                recipes.filter(pk__gt=last)
+                .values_list('pk', flat=True)[:options['batch_size']]
+            )
+            if not batch:
+                break
+            refreshed += similarity.refresh_bands(batch)
+            last = batch[-1]
+        self.stdout.write(self.style.SUCCESS(
+            f'Refreshed {refreshed} recipes'
+        ))
@@ -0,0 +1,49 @@
+import signal
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from core import jobs
+
+
+class Command(BaseCommand):
+    '''Command to run queued background jobs'''
+
+    help = 'Run background jobs from the database queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help='Number of jobs to run at the same time')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to sleep when no job is due')
+        parser.add_argument('--burst', action='store_true',
+                            help='Exit once the queue has no due jobs')
+        parser.add_argument('--stats', action='store_true',
+                            help='Print the queue depth and exit')
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            stats = jobs.queue_stats()
+            for status, count in stats['counts'].items():
+                self.stdout.write(f'{status}: {count}')
+            self.stdout.write(
+                f'oldest due: {stats["oldest_due_seconds"]:.0f}s'
+            )
+            return
+
+        keep_days = getattr(settings, 'JOBS_KEEP_DONE_DAYS', 7)
+        jobs.prune_jobs(timezone.now() - timedelta(days=keep_days))
+
+        worker = jobs.Worker(options['concurrency'],
+                             options['poll_interval'])
+        # Finish the running jobs on shutdown instead of abandoning them
+        previous = {
+            signum: signal.signal(signum, lambda *args: worker.stop())
+            for signum in (signal.SIGINT, signal.SIGTERM)
+        }
+        try:
+            processed = worker.run(burst=options['burst'])
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+        self.stdout.write(self.style.SUCCESS(f'Ran {processed} jobs'))
@@ -0,0 +1,68 @@
+import time
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from core.seeding import DatasetGenerator
+
+
+class Command(BaseCommand):
+    '''Command to fill the database with a large synthetic dataset'''
+
+    help = 'Bulk insert users, recipes, tags and ingredients with ' \
+        'realistic skew'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=50,
+                            help='Mean recipes per user')
+        parser.add_argument('--tags', type=int, default=20,
+                            help='Tags per user')
+        parser.add_argument('--ingredients', type=int, default=60,
+                            help='Ingredients per user')
+        parser.add_argument('--tags-per-recipe', type=int, default=3)
+        parser.add_argument('--ingredients-per-recipe', type=int, default=8)
+        parser.add_argument('--zipf', type=float, default=1.1,
+                            help='Zipf exponent of tag/ingredient '
+                                 'popularity, 0 for uniform')
+        parser.add_argument('--library-skew', type=float, default=1.0,
+                            help='Sigma of the log-normal library size, '
+                                 '0 for equal sizes')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Users per transaction')
+        parser.add_argument('--password', default='password123')
+        parser.add_argument('--password-hash',
+                            help='Precomputed hash to use instead of '
+                                 'hashing --password')
+        parser.add_argument('--domain', default='seed.example.com',
+                            help='Email domain of the generated users')
+
+    def handle(self, *args, **options):
+        domain = options['domain']
+        start = get_user_model().objects \
+            .filter(email__endswith=f'@{domain}').count()
+        generator = DatasetGenerator(
+            recipes=options['recipes'],
+            tags=options['tags'],
+            ingredients=options['ingredients'],
+            tags_per_recipe=options['tags_per_recipe'],
+            ingredients_per_recipe=options['ingredients_per_recipe'],
+            zipf_exponent=options['zipf'],
+            library_skew=options['library_skew'],
+            password=options['password'],
+            password_hash=options['password_hash'],
+            seed=options['seed'] + start,
+            email_domain=domain,
+            batch_size=options['batch_size'],
+        )
+
+        started = time.monotonic()
+        total = options['users']
+        for done in generator.generate(total, start=start):
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f'{done}/{total} users ({done / elapsed:.0f} users/s)'
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {total} users in {time.monotonic() - started:.1f}s'
+        ))
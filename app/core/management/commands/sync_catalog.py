@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from core.catalog import link_to_catalog, promote
+from core.models import Tag, Ingredient
+
+
+class Command(BaseCommand):
+    '''Command to fill the shared catalog and link user rows to it'''
+
+    help = 'Link tags and ingredients to the shared catalog'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--promote-min-users', type=int, default=None,
+                            help='First add names used by at least this '
+                                 'many users to the catalog')
+        parser.add_argument('--user', type=int, action='append',
+                            dest='user_ids',
+                            help='Only link rows of this user, repeatable')
+
+    def handle(self, *args, **options):
+        for model in (Tag, Ingredient):
+            name = model._meta.verbose_name_plural
+            if options['promote_min_users']:
+                created = promote(model, options['promote_min_users'])
+                self.stdout.write(f'Added {created} {name} to the catalog')
+            linked = link_to_catalog(model, options['user_ids'])
+            self.stdout.write(self.style.SUCCESS(f'Linked {linked} {name}'))
@@ -0,0 +1,278 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from django.conf import settings
+
+
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# Gauges read the database, a scrape reuses values this recent
+GAUGE_MAX_AGE = 30
+
+
+def _format_labels(pairs):
+    escaped = (
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\')
+                         .replace('"', '\\"'))
+        for k, v in pairs
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+class Histogram:
+    '''Cumulative histogram with one series per label set'''
+
+    def __init__(self, name, description, buckets, labels):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.labels = tuple(labels)
+        self._series = defaultdict(
+            lambda: [[0] * len(self.buckets), 0.0, 0]
+        )
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        '''Record one observation'''
+
+        key = tuple(labels[label] for label in self.labels)
+        with self._lock:
+            counts, _, _ = series = self._series[key]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def _label_str(self, key, extra=()):
+        return _format_labels(list(zip(self.labels, key)) + list(extra))
+
+    def snapshot(self):
+        '''Return the series as a list of [key, counts, sum, count]'''
+
+        with self._lock:
+            return [
+                [list(key), list(counts), total, count]
+                for key, (counts, total, count) in self._series.items()
+            ]
+
+    def render(self, snapshots=None):
+        '''Return the histogram in Prometheus text format
+
+        snapshots of several processes are summed up instead of showing
+        the series of this one.
+        '''
+
+        lines = [
+            f'# HELP {self.name} {self.description}',
+            f'# TYPE {self.name} histogram',
+        ]
+        if snapshots is None:
+            snapshots = [self.snapshot()]
+        merged = {}
+        for snapshot in snapshots:
+            for key, counts, total, count in snapshot:
+                key = tuple(key)
+                if key not in merged:
+                    merged[key] = [[0] * len(self.buckets), 0.0, 0]
+                series = merged[key]
+                series[0] = [a + b for a, b in zip(series[0], counts)]
+                series[1] += total
+                series[2] += count
+        series = sorted(
+            (key, counts, total, count)
+            for key, (counts, total, count) in merged.items()
+        )
+        for key, counts, total, count in series:
+            for bound, value in zip(self.buckets, counts):
+                labels = self._label_str(key, [('le', bound)])
+                lines.append(f'{self.name}_bucket{labels} {value}')
+            labels = self._label_str(key, [('le', '+Inf')])
+            lines.append(f'{self.name}_bucket{labels} {count}')
+            labels = self._label_str(key)
+            lines.append(f'{self.name}_sum{labels} {total}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return '\n'.join(lines)
+
+
+class CollectedMetric:
+    '''Metric read from a callback, reused for max_age seconds'''
+
+    def __init__(self, collect, max_age=0):
+        self.collect = collect
+        self.max_age = max_age
+        self._collected = None
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._collected = None
+
+    def values(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._collected is None or \
+                    now - self._collected[0] >= self.max_age:
+                self._collected = (now, self.collect())
+            return self._collected[1]
+
+
+class Gauge(CollectedMetric):
+    '''Values read from a callback when the metrics are scraped
+
+    collect returns a dict of label value tuples to numbers.
+    '''
+
+    def __init__(self, name, description, labels, collect, max_age=0):
+        super().__init__(collect, max_age)
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+
+    def render(self):
+        lines = [
+            f'# HELP {self.name} {self.description}',
+            f'# TYPE {self.name} gauge',
+        ]
+        for key, value in sorted(self.values().items()):
+            labels = _format_labels(zip(self.labels, key)) \
+                if self.labels else ''
+            lines.append(f'{self.name}{labels} {value}')
+        return '\n'.join(lines)
+
+
+class GaugeFamily(CollectedMetric):
+    '''Several gauges filled from one callback per scrape
+
+    gauges are (name, description, labels) tuples. collect returns a dict
+    of gauge name -> values like the collect callback of a Gauge.
+    '''
+
+    def __init__(self, gauges, collect, max_age=0):
+        super().__init__(collect, max_age)
+        self.gauges = tuple(gauges)
+
+    def render(self):
+        values = self.values()
+        return '\n'.join(
+            Gauge(name, description, labels, lambda: values[name]).render()
+            for name, description, labels in self.gauges
+        )
+
+
+REQUEST_LABELS = ('route', 'method')
+
+request_duration = Histogram(
+    'http_request_duration_seconds',
+    'Time spent handling a request.',
+    LATENCY_BUCKETS,
+    REQUEST_LABELS,
+)
+request_db_queries = Histogram(
+    'http_request_db_queries',
+    'Number of database queries run for a request.',
+    QUERY_COUNT_BUCKETS,
+    REQUEST_LABELS,
+)
+request_db_duration = Histogram(
+    'http_request_db_duration_seconds',
+    'Time spent in the database for a request.',
+    LATENCY_BUCKETS,
+    REQUEST_LABELS,
+)
+
+REGISTRY = [request_duration, request_db_queries, request_db_duration]
+
+
+def _metrics_dir():
+    return getattr(settings, 'METRICS_DIR', None)
+
+
+_flushed_at = None
+
+
+def flush_metrics():
+    '''Write the histograms of this process to METRICS_DIR
+
+    Each process keeps its own file, replaced atomically.
+    '''
+
+    global _flushed_at
+    directory = _metrics_dir()
+    if not directory:
+        return
+    snapshot = {
+        metric.name: metric.snapshot() for metric in REGISTRY
+        if isinstance(metric, Histogram)
+    }
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(tmp, os.path.join(directory, f'{os.getpid()}.json'))
+    _flushed_at = time.monotonic()
+
+
+def flush_metrics_if_due():
+    '''Flush at most every METRICS_FLUSH_SECONDS, after a request'''
+
+    interval = getattr(settings, 'METRICS_FLUSH_SECONDS', 5)
+    if _metrics_dir() and (_flushed_at is None or
+                           time.monotonic() - _flushed_at >= interval):
+        flush_metrics()
+
+
+def _read_snapshots(directory):
+    snapshots = defaultdict(list)
+    for name in os.listdir(directory):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for metric, series in snapshot.items():
+            snapshots[metric].append(series)
+    return snapshots
+
+
+def render_metrics():
+    '''Return every registered metric in Prometheus text format
+
+    Histograms live in the memory of each process. With METRICS_DIR set
+    the ones written there by every worker are summed up, otherwise only
+    this process is seen.
+    '''
+
+    directory = _metrics_dir()
+    if not directory:
+        return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
+    flush_metrics()
+    snapshots = _read_snapshots(directory)
+    return '\n'.join(
+        metric.render(snapshots[metric.name])
+        if isinstance(metric, Histogram) else metric.render()
+        for metric in REGISTRY
+    ) + '\n'
+
+
+def register(metric):
+    '''Add a metric defined elsewhere to the /metrics output'''
+
+    REGISTRY.append(metric)
+    return metric
+
+
+def clear_metrics():
+    for metric in REGISTRY:
+        metric.clear()
@@ -0,0 +1,147 @@
+import hashlib
+import logging
+import time
+from contextlib import ExitStack
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.db import connections
+from core import metrics
+from core.queries import QueryInspector
+from core.replicas import is_process_local, read_from_replicas, \
+    replica_aliases
+
+
+logger = logging.getLogger(__name__)
+
+
+class QueryTimer:
+    '''Database execute wrapper counting queries and the time they take'''
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+
+
+def get_route(request):
+    '''Return a low cardinality name for the url a request matched'''
+
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '<unmatched>'
+    return match.view_name
+
+
+class RequestMetricsMiddleware:
+    '''Record latency, query count and DB time for every request
+
+    The numbers are added to the histograms in core.metrics and sent back
+    to the client in a Server-Timing header.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = QueryTimer()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        labels = {'route': get_route(request), 'method': request.method}
+        metrics.request_duration.observe(duration, **labels)
+        metrics.request_db_queries.observe(timer.count, **labels)
+        metrics.request_db_duration.observe(timer.duration, **labels)
+        metrics.flush_metrics_if_due()
+
+        response['Server-Timing'] = ', '.join((
+            f'total;dur={duration * 1000:.1f}',
+            f'db;dur={timer.duration * 1000:.1f};desc="{timer.count} queries"',
+        ))
+        return response
+
+
+class QueryInspectionMiddleware:
+    '''Log repeated (N+1) and slow queries, meant for staging only'''
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_INSPECTION_ENABLED', False):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.duplicate_threshold = getattr(
+            settings, 'QUERY_INSPECTION_DUPLICATE_THRESHOLD', 3
+        )
+        self.slow_query_ms = getattr(
+            settings, 'QUERY_INSPECTION_SLOW_QUERY_MS', 100
+        )
+
+    def __call__(self, request):
+        inspector = QueryInspector(
+            duplicate_threshold=self.duplicate_threshold,
+            slow_query_ms=self.slow_query_ms,
+        )
+        with inspector.capture():
+            response = self.get_response(request)
+
+        report = inspector.report()
+        if report:
+            logger.warning(
+                'Query problems in %s %s (%d queries):\n%s',
+                request.method, request.path, len(inspector), report
+            )
+        return response
+
+
+class ReplicaRoutingMiddleware:
+    '''Serve safe requests from read replicas, see core.replicas
+
+    Clients are pinned to the primary for REPLICA_PIN_SECONDS after a
+    write, so they read their own writes while replicas catch up. Clients
+    are told apart by their credentials, before authentication runs. The
+    pins have to be seen by every worker, so the default cache must be
+    shared.
+    '''
+
+    SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, get_response):
+        if replica_aliases() and is_process_local(caches['default']):
+            raise ImproperlyConfigured(
+                'Read replicas need a default cache shared by all processes '
+                'for the read-your-writes pins.'
+            )
+        self.get_response = get_response
+
+    def pin_key(self, request):
+        credentials = request.META.get('HTTP_AUTHORIZATION') or \
+            request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+        if not credentials:
+            return None
+        digest = hashlib.sha256(credentials.encode()).hexdigest()
+        return f'replica-pin:{digest}'
+
+    def __call__(self, request):
+        if not replica_aliases():
+            return self.get_response(request)
+        key = self.pin_key(request)
+        if request.method not in self.SAFE_METHODS:
+            response = self.get_response(request)
+            if key:
+                cache.set(key, True,
+                          getattr(settings, 'REPLICA_PIN_SECONDS', 10))
+            return response
+        if key and cache.get(key):
+            return self.get_response(request)
+        with read_from_replicas():
+            return self.get_response(request)
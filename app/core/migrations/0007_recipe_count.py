@@ -0,0 +1,50 @@
+# Generated by Django 2.1.15 on 2026-10-18 21:41
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_recipe_counts(apps, schema_editor):
+    Recipe = apps.get_model('core', 'Recipe')
+    relations = (
+        (Recipe.tags.through, apps.get_model('core', 'Tag'), 'tag_id'),
+        (Recipe.ingredients.through, apps.get_model('core', 'Ingredient'),
+         'ingredient_id'),
+    )
+    for through, model, column in relations:
+        model.objects.update(recipe_count=Coalesce(Subquery(
+            through.objects.filter(**{column: OuterRef('pk')})
+            .order_by().values(column).annotate(total=Count('*'))
+            .values('total'),
+            output_field=IntegerField(),
+        ), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_recipe_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredient',
+            name='recipe_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='recipe_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='ingredient',
+            index=models.Index(fields=['user', 'recipe_count'], name='core_ingred_user_id_de1121_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(fields=['user', 'recipe_count'], name='core_tag_user_id_699afc_idx'),
+        ),
+        migrations.RunPython(populate_recipe_counts, migrations.RunPython.noop),
+    ]
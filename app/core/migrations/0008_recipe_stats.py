@@ -0,0 +1,78 @@
+# Generated by Django 2.1.15 on 2026-10-18 21:43
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from decimal import Decimal
+
+
+PRICE_BUCKETS = (0, 5, 10, 20, 50, 100, 200, 500)
+
+
+def populate_recipe_stats(apps, schema_editor):
+    Recipe = apps.get_model('core', 'Recipe')
+    RecipeStats = apps.get_model('core', 'RecipeStats')
+    RecipePriceBucket = apps.get_model('core', 'RecipePriceBucket')
+    rows = Recipe.objects.order_by().values('user_id').annotate(
+        recipe_count=models.Count('id'),
+        total_time=models.Sum('time_minutes'),
+        total_price=models.Sum('price'),
+    )
+    RecipeStats.objects.bulk_create([
+        RecipeStats(
+            user_id=row['user_id'],
+            recipe_count=row['recipe_count'],
+            total_time_minutes=row['total_time'] or 0,
+            total_price=row['total_price'] or 0,
+        )
+        for row in rows
+    ], batch_size=5000)
+    for index, lower in enumerate(PRICE_BUCKETS):
+        recipes = Recipe.objects.filter(price__gte=Decimal(lower))
+        if index + 1 < len(PRICE_BUCKETS):
+            recipes = recipes.filter(
+                price__lt=Decimal(PRICE_BUCKETS[index + 1])
+            )
+        RecipePriceBucket.objects.bulk_create([
+            RecipePriceBucket(user_id=row['user_id'], bucket=index,
+                              recipe_count=row['count'])
+            for row in recipes.order_by().values('user_id')
+            .annotate(count=models.Count('id'))
+        ], batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_recipe_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipePriceBucket',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.PositiveSmallIntegerField()),
+                ('recipe_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RecipeStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('recipe_count', models.PositiveIntegerField(default=0)),
+                ('total_time_minutes', models.BigIntegerField(default=0)),
+                ('total_price', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='recipepricebucket',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterUniqueTogether(
+            name='recipepricebucket',
+            unique_together={('user', 'bucket')},
+        ),
+        migrations.RunPython(populate_recipe_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 2.1.15 on 2026-10-18 21:50
+
+from django.db import migrations
+
+
+# Admin search uses istartswith, which Postgres runs as
+# UPPER(col::text) LIKE UPPER(%s). These indexes let it use a range scan.
+SEARCH_INDEXES = (
+    ('core_tag_name_upper_like', 'core_tag', 'name'),
+    ('core_ingredient_name_upper_like', 'core_ingredient', 'name'),
+    ('core_recipe_title_upper_like', 'core_recipe', 'title'),
+    ('core_user_email_upper_like', 'core_user', 'email'),
+    ('core_user_name_upper_like', 'core_user', 'name'),
+)
+
+
+def create_search_indexes(apps, schema_editor):
+    '''Build the indexes CONCURRENTLY so writes go on during the build
+
+    A failed build leaves an invalid index behind, which a rerun drops.
+    '''
+
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table, column in SEARCH_INDEXES:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+        schema_editor.execute(
+            f'CREATE INDEX CONCURRENTLY {name} ON {table} '
+            f'(UPPER({column}::text) text_pattern_ops)'
+        )
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _, _ in SEARCH_INDEXES:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY can't run in a transaction
+    atomic = False
+
+    dependencies = [
+        ('core', '0008_recipe_stats'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
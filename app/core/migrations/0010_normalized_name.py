@@ -0,0 +1,198 @@
+# Generated by Django 2.1.15 on 2026-10-18 22:05
+
+from django.db import migrations, models, transaction
+from django.db.models import Case, CharField, Count, IntegerField, \
+    OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce
+
+
+BATCH_SIZE = 1000
+
+TABLES = ('core_tag', 'core_ingredient')
+
+
+def normalize_name(name):
+    return ' '.join(name.split()).lower()
+
+
+def add_columns(apps, schema_editor):
+    '''Add normalized_name, keeping the '' default in the database
+
+    Code from before this migration inserts rows without the column while
+    the deploy is under way.
+    '''
+
+    if schema_editor.connection.vendor == 'postgresql':
+        for table in TABLES:
+            schema_editor.execute(
+                f'ALTER TABLE {table} ADD COLUMN normalized_name '
+                f"varchar(255) DEFAULT '' NOT NULL"
+            )
+        return
+    for name in ('Tag', 'Ingredient'):
+        field = models.CharField(default='', editable=False, max_length=255)
+        field.set_attributes_from_name('normalized_name')
+        schema_editor.add_field(apps.get_model('core', name), field)
+
+
+def drop_columns(apps, schema_editor):
+    for table in TABLES:
+        schema_editor.execute(
+            f'ALTER TABLE {table} DROP COLUMN normalized_name'
+        )
+
+
+def backfill(model):
+    '''Fill normalized_name with one UPDATE per batch of rows'''
+
+    last_pk = 0
+    while True:
+        rows = list(
+            model.objects.filter(pk__gt=last_pk, normalized_name='')
+            .order_by('pk').values_list('pk', 'name')[:BATCH_SIZE]
+        )
+        if not rows:
+            return
+        model.objects.filter(pk__in=[pk for pk, _name in rows]).update(
+            normalized_name=Case(
+                *[When(pk=pk, then=Value(normalize_name(name)))
+                  for pk, name in rows],
+                output_field=CharField(),
+            )
+        )
+        last_pk = rows[-1][0]
+
+
+def merge_duplicates(model, through, column):
+    '''Repoint links of duplicates to the oldest row and delete the rest'''
+
+    duplicated = model.objects.order_by() \
+        .values('user_id', 'normalized_name') \
+        .annotate(total=Count('id')).filter(total__gt=1)
+    for row in duplicated.iterator():
+        ids = list(
+            model.objects.filter(
+                user_id=row['user_id'],
+                normalized_name=row['normalized_name'],
+            ).order_by('pk').values_list('pk', flat=True)
+        )
+        target, dup_ids = ids[0], ids[1:]
+        with transaction.atomic():
+            already_linked = through.objects.filter(**{column: target}) \
+                .values('recipe_id')
+            through.objects.filter(**{f'{column}__in': dup_ids}) \
+                .exclude(recipe_id__in=already_linked) \
+                .update(**{column: target})
+            through.objects.filter(**{f'{column}__in': dup_ids}).delete()
+            model.objects.filter(pk__in=dup_ids).delete()
+            model.objects.filter(pk=target).update(
+                recipe_count=Coalesce(Subquery(
+                    through.objects.filter(**{column: OuterRef('pk')})
+                    .order_by().values(column).annotate(total=Count('*'))
+                    .values('total'),
+                    output_field=IntegerField(),
+                ), 0)
+            )
+
+
+def normalize_and_merge(apps, schema_editor):
+    Recipe = apps.get_model('core', 'Recipe')
+    relations = (
+        (apps.get_model('core', 'Tag'), Recipe.tags.through, 'tag_id'),
+        (apps.get_model('core', 'Ingredient'), Recipe.ingredients.through,
+         'ingredient_id'),
+    )
+    for model, through, column in relations:
+        backfill(model)
+        merge_duplicates(model, through, column)
+
+
+def create_unique_indexes(apps, schema_editor):
+    '''Make (user, normalized_name) unique without blocking writes
+
+    On Postgres the index is built CONCURRENTLY and skips empty names.
+    Rows the old code writes during the deploy get the '' default, they
+    neither break the build nor collide with each other. The
+    normalize_names command fixes them up once the new code runs. A
+    failed build leaves an invalid index behind, which a rerun drops.
+    '''
+
+    if schema_editor.connection.vendor != 'postgresql':
+        for name in ('Tag', 'Ingredient'):
+            schema_editor.alter_unique_together(
+                apps.get_model('core', name), set(),
+                {('user', 'normalized_name')},
+            )
+        return
+    for table in TABLES:
+        index = f'{table}_user_id_normalized_name_uniq'
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {index}')
+        schema_editor.execute(
+            f'CREATE UNIQUE INDEX CONCURRENTLY {index} ON {table} '
+            f"(user_id, normalized_name) WHERE normalized_name <> ''"
+        )
+
+
+def drop_unique_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        for name in ('Tag', 'Ingredient'):
+            schema_editor.alter_unique_together(
+                apps.get_model('core', name),
+                {('user', 'normalized_name')}, set(),
+            )
+        return
+    for table in TABLES:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS '
+                              f'{table}_user_id_normalized_name_uniq')
+
+
+class Migration(migrations.Migration):
+
+    # Backfill and merge commit in batches instead of one long
+    # transaction, and CREATE INDEX CONCURRENTLY can't run in one
+    atomic = False
+
+    dependencies = [
+        ('core', '0009_search_indexes'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(add_columns, drop_columns),
+            ],
+            state_operations=[
+                migrations.AddField(
+                    model_name='ingredient',
+                    name='normalized_name',
+                    field=models.CharField(default='', editable=False,
+                                           max_length=255),
+                    preserve_default=False,
+                ),
+                migrations.AddField(
+                    model_name='tag',
+                    name='normalized_name',
+                    field=models.CharField(default='', editable=False,
+                                           max_length=255),
+                    preserve_default=False,
+                ),
+            ],
+        ),
+        migrations.RunPython(normalize_and_merge, migrations.RunPython.noop),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(create_unique_indexes,
+                                     drop_unique_indexes),
+            ],
+            state_operations=[
+                migrations.AlterUniqueTogether(
+                    name='ingredient',
+                    unique_together={('user', 'normalized_name')},
+                ),
+                migrations.AlterUniqueTogether(
+                    name='tag',
+                    unique_together={('user', 'normalized_name')},
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 2.1.15 on 2026-10-18 23:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_normalized_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogIngredient',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('normalized_name', models.CharField(editable=False, max_length=255, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CatalogTag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('normalized_name', models.CharField(editable=False, max_length=255, unique=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='canonical',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.CatalogIngredient'),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='canonical',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.CatalogTag'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 2.1.15 on 2026-10-19 00:30
+
+from django.db import migrations, models
+
+
+# Every recipe query filters on deleted_at IS NULL. Partial indexes keep
+# the soft deleted rows out of the user lookups, and a second one lets
+# the purge find them without a scan.
+PARTIAL_INDEXES = (
+    ('core_recipe_user_live', 'core_recipe', '(user_id, id)',
+     'deleted_at IS NULL'),
+    ('core_recipe_deleted_at', 'core_recipe', '(deleted_at)',
+     'deleted_at IS NOT NULL'),
+)
+
+
+def create_partial_indexes(apps, schema_editor):
+    '''Build the indexes CONCURRENTLY so writes go on during the build
+
+    A failed build leaves an invalid index behind, which a rerun drops.
+    '''
+
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table, columns, condition in PARTIAL_INDEXES:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+        schema_editor.execute(
+            f'CREATE INDEX CONCURRENTLY {name} ON {table} {columns} '
+            f'WHERE {condition}'
+        )
+
+
+def drop_partial_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _, _, _ in PARTIAL_INDEXES:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY can't run in a transaction. Adding the
+    # nullable column is a catalog change, it needs none either.
+    atomic = False
+
+    dependencies = [
+        ('core', '0013_change'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='deleted_at',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_partial_indexes, drop_partial_indexes),
+    ]
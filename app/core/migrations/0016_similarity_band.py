@@ -0,0 +1,28 @@
+# Generated by Django 2.1.15 on 2026-10-19 01:30
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarityBand',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.BigIntegerField()),
+                ('recipe', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.Recipe')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='similarityband',
+            index=models.Index(fields=['user', 'bucket'], name='core_simila_user_id_1a286c_idx'),
+        ),
+    ]
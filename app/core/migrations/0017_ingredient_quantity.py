@@ -0,0 +1,28 @@
+# Generated by Django 2.1.15 on 2026-10-19 02:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_similarity_band'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngredientQuantity',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.DecimalField(decimal_places=3, max_digits=10)),
+                ('unit', models.CharField(choices=[('g', 'Gram'), ('kg', 'Kilogram'), ('mg', 'Milligram'), ('ml', 'Millilitre'), ('l', 'Litre'), ('tsp', 'Teaspoon'), ('tbsp', 'Tablespoon'), ('cup', 'Cup'), ('piece', 'Piece')], max_length=10)),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.Ingredient')),
+                ('recipe', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='quantities', to='core.Recipe')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='ingredientquantity',
+            unique_together={('recipe', 'ingredient')},
+        ),
+    ]
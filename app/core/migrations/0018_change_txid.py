@@ -0,0 +1,35 @@
+# Generated by Django 2.1.15 on 2026-10-19 02:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_ingredient_quantity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangePrune',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('txid', models.BigIntegerField()),
+                ('change_id', models.BigIntegerField()),
+                ('pruned_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='change',
+            name='core_change_user_id_dfd788_idx',
+        ),
+        migrations.AddField(
+            model_name='change',
+            name='txid',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='change',
+            index=models.Index(fields=['user', 'txid', 'id'], name='core_change_user_id_43f06b_idx'),
+        ),
+    ]
@@ -2,6 +2,7 @@ from django.db import models
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, \
                                         PermissionsMixin
 from django.conf import settings
+from django.utils import timezone
 import uuid
 import os
 
@@ -14,6 +15,12 @@ def recipe_image_file_path(instance, filename):
     return os.path.join('uploads/recipe/', filename)
 
 
+def normalize_name(name):
+    '''Return the form of a tag/ingredient name used to spot duplicates'''
+
+    return ' '.join(name.split()).lower()
+
+
 class UserManager(BaseUserManager):
 
     def create_user(self, email, password=None, **extra_fields):
@@ -48,6 +55,36 @@ class User(AbstractBaseUser, PermissionsMixin):
     USERNAME_FIELD = 'email'
 
 
+class CatalogTag(models.Model):
+    '''Tag name shared by all users, see core.catalog'''
+
+    name = models.CharField(max_length=255)
+    normalized_name = models.CharField(max_length=255, unique=True,
+                                       editable=False)
+
+    def save(self, *args, **kwargs):
+        self.normalized_name = normalize_name(self.name)
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return self.name
+
+
+class CatalogIngredient(models.Model):
+    '''Ingredient name shared by all users, see core.catalog'''
+
+    name = models.CharField(max_length=255)
+    normalized_name = models.CharField(max_length=255, unique=True,
+                                       editable=False)
+
+    def save(self, *args, **kwargs):
+        self.normalized_name = normalize_name(self.name)
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return self.name
+
+
 class Tag(models.Model):
     '''Tag to be used for a recipe'''
     name = models.CharField(max_length=255)
@@ -55,6 +92,28 @@ class Tag(models.Model):
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
     )
+    # Set from name on save, unique per user
+    normalized_name = models.CharField(max_length=255, editable=False)
+    # Shared catalog entry with the same normalized name, if any
+    canonical = models.ForeignKey(
+        'CatalogTag',
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='+',
+    )
+    # Maintained by core.counts, see reconcile_recipe_counts
+    recipe_count = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        unique_together = ('user', 'normalized_name')
+        indexes = [
+            models.Index(fields=['user', 'recipe_count']),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.normalized_name = normalize_name(self.name)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.name
@@ -68,11 +127,44 @@ class Ingredient(models.Model):
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
     )
+    # Set from name on save, unique per user
+    normalized_name = models.CharField(max_length=255, editable=False)
+    # Shared catalog entry with the same normalized name, if any
+    canonical = models.ForeignKey(
+        'CatalogIngredient',
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='+',
+    )
+    # Maintained by core.counts, see reconcile_recipe_counts
+    recipe_count = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        unique_together = ('user', 'normalized_name')
+        indexes = [
+            models.Index(fields=['user', 'recipe_count']),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.normalized_name = normalize_name(self.name)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.name
 
 
+class VersionConflict(Exception):
+    '''Raised when saving a recipe that was changed since it was read'''
+
+
+class LiveRecipeManager(models.Manager):
+    '''Hides soft deleted recipes, see core.bulk.soft_delete_recipe'''
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
 class Recipe(models.Model):
     '''Recipe object'''
 
@@ -87,6 +179,235 @@ class Recipe(models.Model):
     ingredients = models.ManyToManyField('Ingredient')
     tags = models.ManyToManyField('Tag')
     image = models.ImageField(null=True, upload_to=recipe_image_file_path)
+    # Bumped by every save, see _do_update
+    version = models.PositiveIntegerField(default=1, editable=False)
+    # Set when deleted through the API, purged later by purge_recipes
+    deleted_at = models.DateTimeField(null=True, editable=False)
+
+    objects = LiveRecipeManager()
+    all_objects = models.Manager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Partition key of the stored row, see _do_update
+        instance._stored_user_id = instance.__dict__.get('user_id')
+        return instance
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields,
+                   forced_update):
+        '''Update only if the stored version is still the one read
+
+        Checking and bumping the version is a single conditional UPDATE,
+        so no row lock is taken. A concurrent save in between makes it
+        match no rows and raises VersionConflict. The UPDATE carries the
+        owner, so a partitioned table only looks in one partition.
+        '''
+
+        field = self._meta.get_field('version')
+        values = [value for value in values if value[0] is not field]
+        values.append((field, None, self.version + 1))
+        scoped = base_qs.filter(version=self.version)
+        stored_user_id = getattr(self, '_stored_user_id', None)
+        if stored_user_id is not None:
+            scoped = scoped.filter(user_id=stored_user_id)
+        updated = super()._do_update(
+            scoped, using, pk_val, values, update_fields, forced_update,
+        )
+        if updated:
+            self.version += 1
+            self._stored_user_id = self.user_id
+        elif base_qs.filter(pk=pk_val).exists():
+            raise VersionConflict(
+                f'Recipe {pk_val} is no longer at version {self.version}'
+            )
+        return updated
 
     def __str__(self):
         return self.title
+
+
+class IngredientQuantity(models.Model):
+    '''How much of a linked ingredient a recipe needs, see core.quantities
+
+    Kept beside the ingredients relation rather than as its through model,
+    which Django 2.1 could not add() to or remove() from.
+    '''
+
+    GRAM = 'g'
+    KILOGRAM = 'kg'
+    MILLIGRAM = 'mg'
+    MILLILITRE = 'ml'
+    LITRE = 'l'
+    TEASPOON = 'tsp'
+    TABLESPOON = 'tbsp'
+    CUP = 'cup'
+    PIECE = 'piece'
+    UNIT_CHOICES = (
+        (GRAM, 'Gram'),
+        (KILOGRAM, 'Kilogram'),
+        (MILLIGRAM, 'Milligram'),
+        (MILLILITRE, 'Millilitre'),
+        (LITRE, 'Litre'),
+        (TEASPOON, 'Teaspoon'),
+        (TABLESPOON, 'Tablespoon'),
+        (CUP, 'Cup'),
+        (PIECE, 'Piece'),
+    )
+
+    # No database constraint, it would stop the recipe table from being
+    # partitioned. core.bulk deletes quantities together with recipes.
+    recipe = models.ForeignKey(
+        'Recipe',
+        on_delete=models.CASCADE,
+        db_constraint=False,
+        related_name='quantities',
+    )
+    ingredient = models.ForeignKey(
+        'Ingredient',
+        on_delete=models.CASCADE,
+        related_name='+',
+    )
+    quantity = models.DecimalField(max_digits=10, decimal_places=3)
+    unit = models.CharField(max_length=10, choices=UNIT_CHOICES)
+
+    class Meta:
+        unique_together = ('recipe', 'ingredient')
+
+    def __str__(self):
+        return f'{self.quantity} {self.unit}'
+
+
+class RecipeStats(models.Model):
+    '''Running per user recipe totals, maintained by core.stats'''
+
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+    )
+    recipe_count = models.PositiveIntegerField(default=0)
+    total_time_minutes = models.BigIntegerField(default=0)
+    total_price = models.DecimalField(
+        max_digits=14, decimal_places=2, default=0
+    )
+
+
+class RecipePriceBucket(models.Model):
+    '''Number of a user's recipes in one price range of core.stats'''
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+    )
+    bucket = models.PositiveSmallIntegerField()
+    recipe_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'bucket')
+
+
+class SimilarityBand(models.Model):
+    '''One LSH band of a recipe's MinHash signature, see core.similarity
+
+    Recipes sharing a bucket are candidates for being similar.
+    '''
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+    )
+    # No database constraint, it would stop the recipe table from being
+    # partitioned. core.bulk deletes bands together with recipes.
+    recipe = models.ForeignKey(
+        'Recipe',
+        on_delete=models.CASCADE,
+        db_constraint=False,
+        related_name='+',
+    )
+    bucket = models.BigIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'bucket']),
+        ]
+
+
+class Change(models.Model):
+    '''Entry of a user's change feed, written by core.changes'''
+
+    RECIPE = 'recipe'
+    TAG = 'tag'
+    INGREDIENT = 'ingredient'
+    KIND_CHOICES = (
+        (RECIPE, 'Recipe'),
+        (TAG, 'Tag'),
+        (INGREDIENT, 'Ingredient'),
+    )
+
+    # The feed is read in (txid, id) order. Ids are taken at insert time,
+    # so a transaction can commit after others with higher ids. The id of
+    # the writing transaction tells which rows are final, see read_changes.
+    id = models.BigAutoField(primary_key=True)
+    txid = models.BigIntegerField(default=0, editable=False)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+    )
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.PositiveIntegerField()
+    deleted = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Makes the feed of a user a range scan
+            models.Index(fields=['user', 'txid', 'id']),
+        ]
+
+
+class ChangePrune(models.Model):
+    '''Newest change deleted by prune_changes, a single row'''
+
+    txid = models.BigIntegerField()
+    change_id = models.BigIntegerField()
+    pruned_at = models.DateTimeField(auto_now=True)
+
+
+class Job(models.Model):
+    '''Unit of background work, see core.jobs'''
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    id = models.BigAutoField(primary_key=True)
+    name = models.CharField(max_length=100)
+    # JSON encoded keyword arguments of the task
+    payload = models.TextField(default='{}')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES,
+                              default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    locked_by = models.CharField(max_length=100, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Workers pick the due jobs of a status in run_at order
+            models.Index(fields=['status', 'run_at']),
+        ]
+
+    def __str__(self):
+        return f'{self.name} #{self.pk}'
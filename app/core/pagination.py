@@ -0,0 +1,39 @@
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+class EstimatedCountPaginator(Paginator):
+    '''Paginator using the planner's row estimate for huge tables
+
+    COUNT(*) has to scan the whole table on Postgres. When the queryset is
+    not filtered and pg_class.reltuples says the table holds more than
+    ESTIMATE_THRESHOLD rows, that estimate is used instead. Filtered
+    querysets and other databases get an exact count.
+    '''
+
+    ESTIMATE_THRESHOLD = 100000
+
+    @cached_property
+    def count(self):
+        estimate = self.estimated_count()
+        if estimate is not None and estimate > self.ESTIMATE_THRESHOLD:
+            return estimate
+        return super().count
+
+    def estimated_count(self):
+        '''Return the row estimate of an unfiltered queryset, if known'''
+
+        query = getattr(self.object_list, 'query', None)
+        if query is None or query.where:
+            return None
+        connection = connections[self.object_list.db]
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE relname = %s',
+                [query.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        return row[0] if row else None
@@ -0,0 +1,154 @@
+from django.db import connection, transaction
+from core.models import Recipe, IngredientQuantity
+
+
+# Partitioned models and their partition key. Recipes are spread by owner,
+# so every query of the API touches a single partition. The through tables
+# and quantities have no user column and are spread by recipe instead.
+# Lookups by recipe still hit one partition, but the links of one user
+# end up in every partition, so these tables don't get the per-user
+# locality of core_recipe. Giving them a user column needs custom through
+# models, which Django 2.1 can't add() or remove() on.
+PARTITIONED = (
+    (Recipe, 'user_id'),
+    (Recipe.tags.through, 'recipe_id'),
+    (Recipe.ingredients.through, 'recipe_id'),
+    (IngredientQuantity, 'recipe_id'),
+)
+
+MIN_POSTGRES_VERSION = 110000
+
+
+class PartitioningError(Exception):
+    pass
+
+
+def is_supported():
+    return connection.vendor == 'postgresql' and \
+        connection.pg_version >= MIN_POSTGRES_VERSION
+
+
+def partitioned_tables():
+    return [(model._meta.db_table, key) for model, key in PARTITIONED]
+
+
+def is_partitioned(cursor, table):
+    cursor.execute('SELECT relkind FROM pg_class WHERE oid = %s::regclass',
+                   [table])
+    return cursor.fetchone()[0] == 'p'
+
+
+def read_definition(cursor, table, skip_references):
+    '''Return the indexes, constraints and id sequence of a table
+
+    Primary keys and foreign keys to tables in skip_references are left
+    out, they can't be carried over to a partitioned table.
+    '''
+
+    cursor.execute('''
+        SELECT pg_get_indexdef(i.indexrelid) FROM pg_index i
+        WHERE i.indrelid = %s::regclass AND NOT i.indisprimary
+        AND NOT EXISTS (
+            SELECT 1 FROM pg_constraint c WHERE c.conindid = i.indexrelid
+        )
+        ORDER BY i.indexrelid
+    ''', [table])
+    indexes = [row[0] for row in cursor.fetchall()]
+    cursor.execute('''
+        SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+        WHERE conrelid = %s::regclass AND (
+            contype = 'u' OR contype = 'f'
+            AND confrelid::regclass::text <> ALL(%s)
+        )
+        ORDER BY conname
+    ''', [table, list(skip_references)])
+    constraints = cursor.fetchall()
+    cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+    sequence = cursor.fetchone()[0]
+    return {'indexes': indexes, 'constraints': constraints,
+            'sequence': sequence}
+
+
+def build_statements(tables, partitions):
+    '''Return the SQL turning tables into hash partitioned ones
+
+    tables is a list of (table, partition key, definition) with the
+    definitions returned by read_definition. Rows are copied before the
+    primary key and indexes are built, which is faster than maintaining
+    them row by row. The primary key becomes (id, key), as Postgres needs
+    the partition key in every unique index.
+    '''
+
+    names = [table for table, _key, _definition in tables]
+    statements = [
+        f'LOCK TABLE {", ".join(names)} IN ACCESS EXCLUSIVE MODE'
+    ]
+    for table, key, definition in tables:
+        old = f'{table}_unpartitioned'
+        statements += [
+            f'ALTER TABLE {table} RENAME TO {old}',
+            f'CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS '
+            f'INCLUDING CONSTRAINTS) PARTITION BY HASH ({key})',
+        ]
+        statements += [
+            f'CREATE TABLE {table}_p{remainder} PARTITION OF {table} '
+            f'FOR VALUES WITH (MODULUS {partitions}, '
+            f'REMAINDER {remainder})'
+            for remainder in range(partitions)
+        ]
+        statements += [
+            f'INSERT INTO {table} SELECT * FROM {old}',
+            f'ALTER SEQUENCE {definition["sequence"]} OWNED BY {table}.id',
+        ]
+    # Through tables first, they reference the old recipe table
+    statements += [
+        f'DROP TABLE {table}_unpartitioned' for table in reversed(names)
+    ]
+    for table, key, definition in tables:
+        statements.append(f'ALTER TABLE {table} ADD PRIMARY KEY (id, {key})')
+        statements += definition['indexes']
+        statements += [
+            f'ALTER TABLE {table} ADD CONSTRAINT {name} {constraint}'
+            for name, constraint in definition['constraints']
+        ]
+        statements.append(f'ANALYZE {table}')
+    return statements
+
+
+def partition_statements(partitions):
+    '''Read the current tables and return the SQL to partition them'''
+
+    if not is_supported():
+        raise PartitioningError('Hash partitioning needs PostgreSQL 11+')
+    tables = partitioned_tables()
+    names = [table for table, _key in tables]
+    with connection.cursor() as cursor:
+        done = [table for table in names if is_partitioned(cursor, table)]
+        if done:
+            raise PartitioningError(
+                f'Already partitioned: {", ".join(done)}'
+            )
+        definitions = [
+            (table, key, read_definition(cursor, table, names))
+            for table, key in tables
+        ]
+    return build_statements(definitions, partitions)
+
+
+def partition_tables(partitions):
+    '''Convert the recipe tables to hash partitioned ones in one go
+
+    The tables are locked while their rows are copied, so run it in a
+    maintenance window. Foreign keys from the through tables to recipes
+    are dropped, Postgres can't reference a partitioned table by id alone.
+    Recipe deletes remove the links themselves, see core.bulk.
+    '''
+
+    statements = partition_statements(partitions)
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Deferred foreign key checks of earlier writes in the transaction
+        # would block ALTER TABLE, run them now
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        for statement in statements:
+            cursor.execute(statement)
+    return statements
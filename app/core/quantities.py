@@ -0,0 +1,88 @@
+from decimal import Decimal, InvalidOperation
+from django.db.models import CharField, Case, DecimalField, F, Value, When
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+from core.models import Recipe, IngredientQuantity
+
+
+MASS = 'mass'
+VOLUME = 'volume'
+COUNT = 'count'
+
+# unit -> (dimension, size in the base unit of the dimension)
+UNITS = {
+    IngredientQuantity.MILLIGRAM: (MASS, Decimal('0.001')),
+    IngredientQuantity.GRAM: (MASS, Decimal(1)),
+    IngredientQuantity.KILOGRAM: (MASS, Decimal(1000)),
+    IngredientQuantity.MILLILITRE: (VOLUME, Decimal(1)),
+    IngredientQuantity.TEASPOON: (VOLUME, Decimal(5)),
+    IngredientQuantity.TABLESPOON: (VOLUME, Decimal(15)),
+    IngredientQuantity.CUP: (VOLUME, Decimal(240)),
+    IngredientQuantity.LITRE: (VOLUME, Decimal(1000)),
+    IngredientQuantity.PIECE: (COUNT, Decimal(1)),
+}
+
+# dimension -> base unit, then larger units used from their size on
+DISPLAY_UNITS = {
+    MASS: (IngredientQuantity.GRAM, IngredientQuantity.KILOGRAM),
+    VOLUME: (IngredientQuantity.MILLILITRE, IngredientQuantity.LITRE),
+    COUNT: (IngredientQuantity.PIECE,),
+}
+
+QUANTITY_PLACES = Decimal('0.001')
+
+
+def dimension_expression():
+    '''SQL CASE mapping the unit column to its dimension'''
+
+    return Case(
+        *[When(unit=unit, then=Value(dimension))
+          for unit, (dimension, _size) in UNITS.items()],
+        output_field=CharField(),
+    )
+
+
+def base_quantity_expression():
+    '''SQL expression of the quantity in the base unit of its dimension'''
+
+    return F('quantity') * Case(
+        *[When(unit=unit, then=Value(size))
+          for unit, (_dimension, size) in UNITS.items()],
+        output_field=DecimalField(max_digits=10, decimal_places=3),
+    )
+
+
+def display(total, dimension):
+    '''Return (quantity, unit) of a base unit total in the largest unit
+
+    1500 g becomes 1.5 kg, 240 ml stays 240 ml. Raises ValueError if the
+    quantity has too many digits to round to QUANTITY_PLACES.
+    '''
+
+    quantity, unit = total, DISPLAY_UNITS[dimension][0]
+    for larger in DISPLAY_UNITS[dimension][1:]:
+        size = UNITS[larger][1]
+        if total >= size:
+            quantity, unit = total / size, larger
+    try:
+        return quantity.quantize(QUANTITY_PLACES), unit
+    except InvalidOperation:
+        raise ValueError(f'{total} is too large to display')
+
+
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def drop_unlinked_quantities(sender, instance, action, reverse, pk_set,
+                             **kwargs):
+    '''Delete quantities of ingredients a recipe no longer uses'''
+
+    if action not in ('post_remove', 'post_clear'):
+        return
+    if reverse:
+        quantities = IngredientQuantity.objects.filter(ingredient=instance)
+        if action == 'post_remove':
+            quantities = quantities.filter(recipe_id__in=pk_set)
+    else:
+        quantities = IngredientQuantity.objects.filter(recipe=instance)
+        if action == 'post_remove':
+            quantities = quantities.filter(ingredient_id__in=pk_set)
+    quantities.delete()
@@ -0,0 +1,83 @@
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from django.db import connections
+
+
+IN_LIST_RE = re.compile(r'\(\s*%s(\s*,\s*%s)*\s*\)')
+STRING_RE = re.compile(r"'(?:[^']|'')*'")
+NUMBER_RE = re.compile(r'\b\d+(\.\d+)?\b')
+SPACE_RE = re.compile(r'\s+')
+IGNORED_PREFIXES = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+
+def normalize_sql(sql):
+    '''Reduce a query to its structure so that repeats can be spotted'''
+
+    sql = STRING_RE.sub('?', sql)
+    sql = NUMBER_RE.sub('?', sql)
+    sql = IN_LIST_RE.sub('(...)', sql)
+    return SPACE_RE.sub(' ', sql).strip()
+
+
+class QueryInspector:
+    '''Execute wrapper collecting the queries run while it is installed'''
+
+    def __init__(self, duplicate_threshold=2, slow_query_ms=100):
+        self.duplicate_threshold = duplicate_threshold
+        self.slow_query_ms = slow_query_ms
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = (time.perf_counter() - start) * 1000
+            self.queries.append((sql, duration))
+
+    def __len__(self):
+        return len(self.queries)
+
+    @contextmanager
+    def capture(self, using=None):
+        '''Install the inspector on one or all database connections'''
+
+        aliases = [using] if using else list(connections)
+        with ExitStack() as stack:
+            for alias in aliases:
+                stack.enter_context(
+                    connections[alias].execute_wrapper(self)
+                )
+            yield self
+
+    def duplicates(self):
+        '''Return (normalized sql, count) for queries repeated too often'''
+
+        counts = Counter(
+            normalize_sql(sql) for sql, _ in self.queries
+            if not sql.upper().startswith(IGNORED_PREFIXES)
+        )
+        return [
+            (sql, count) for sql, count in counts.most_common()
+            if count >= self.duplicate_threshold
+        ]
+
+    def slow_queries(self):
+        '''Return (sql, milliseconds) for queries over the threshold'''
+
+        return [
+            (sql, duration) for sql, duration in self.queries
+            if duration >= self.slow_query_ms
+        ]
+
+    def report(self):
+        '''Return a human readable summary of the problems found'''
+
+        lines = []
+        for sql, count in self.duplicates():
+            lines.append(f'{count}x repeated query: {sql}')
+        for sql, duration in self.slow_queries():
+            lines.append(f'slow query ({duration:.1f}ms): {sql}')
+        return '\n'.join(lines)
@@ -0,0 +1,166 @@
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from core.metrics import GAUGE_MAX_AGE, Gauge, register
+
+
+logger = logging.getLogger(__name__)
+
+# Per thread routing state, see read_from_replicas()
+_local = threading.local()
+
+# Alias -> (checked at, lag in seconds) of the last lag check
+_lag_checks = {}
+
+# Seconds behind the primary, 0 while the replica has replayed everything
+# it received. Only the WAL it received is compared, a replica that lost
+# its connection to the primary has to be noticed by monitoring.
+POSTGRES_LAG_SQL = '''
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+'''
+
+
+# Models always read from the primary. Credentials are looked up before a
+# client could be pinned, a token created a moment ago must be found.
+PRIMARY_MODELS = ('authtoken.token', 'sessions.session')
+
+# App label of the model DatabaseCache routes its queries with
+CACHE_APP_LABEL = 'django_cache'
+
+
+def replica_aliases():
+    return getattr(settings, 'REPLICA_DATABASES', [])
+
+
+def is_process_local(cache):
+    '''Return whether a cache backend isn't shared with other processes'''
+
+    return isinstance(cache, (LocMemCache, DummyCache))
+
+
+def reads_from_primary(model):
+    '''Return whether reads of a model always go to the primary'''
+
+    meta = model._meta
+    if meta.app_label == CACHE_APP_LABEL:
+        # Pins and counters are written right before they are read
+        return True
+    return meta.label_lower in PRIMARY_MODELS or \
+        meta.label_lower == settings.AUTH_USER_MODEL.lower()
+
+
+@contextmanager
+def read_from_replicas():
+    '''Send reads in the block to a replica, until the first write
+
+    Outside of it everything goes to the primary, so management commands
+    and jobs never see stale data.
+    '''
+
+    previous = getattr(_local, 'replica_reads', False)
+    _local.replica_reads = True
+    try:
+        yield
+    finally:
+        _local.replica_reads = previous
+
+
+def measure_lag(alias):
+    '''Return how many seconds a replica is behind, None if unreachable'''
+
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        # Local stand-ins share the primary's data
+        return 0.0
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(POSTGRES_LAG_SQL)
+            lag = cursor.fetchone()[0]
+    except DatabaseError:
+        logger.warning('Replica %s is unreachable', alias, exc_info=True)
+        return None
+    return float(lag or 0)
+
+
+def replica_lag(alias):
+    '''Return the lag of a replica, measured at most once per interval'''
+
+    interval = getattr(settings, 'REPLICA_LAG_CHECK_SECONDS', 1)
+    now = time.monotonic()
+    checked_at, lag = _lag_checks.get(alias, (None, None))
+    if checked_at is None or now - checked_at >= interval:
+        lag = measure_lag(alias)
+        _lag_checks[alias] = (now, lag)
+    return lag
+
+
+def clear_lag_checks():
+    _lag_checks.clear()
+
+
+def healthy_replicas():
+    '''Return the replicas that are reachable and close enough behind'''
+
+    max_lag = getattr(settings, 'REPLICA_MAX_LAG_SECONDS', 5)
+    healthy = []
+    for alias in replica_aliases():
+        lag = replica_lag(alias)
+        if lag is not None and lag <= max_lag:
+            healthy.append(alias)
+    return healthy
+
+
+class ReplicaRouter:
+    '''Route reads inside read_from_replicas() to a healthy replica
+
+    The primary is used when no replica is healthy. Asking for the write
+    database ends replica reads for the rest of the block, so a request
+    reads its own writes. Credentials and the database cache are always
+    read from the primary.
+    '''
+
+    def db_for_read(self, model, **hints):
+        if not getattr(_local, 'replica_reads', False) or \
+                reads_from_primary(model):
+            return None
+        healthy = healthy_replicas()
+        if not healthy:
+            return None
+        return random.choice(healthy)
+
+    def db_for_write(self, model, **hints):
+        # Cache writes don't change what the request reads
+        if model._meta.app_label != CACHE_APP_LABEL:
+            _local.replica_reads = False
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas are copies of the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in replica_aliases()
+
+
+def _collect_lag():
+    lags = {}
+    for alias in replica_aliases():
+        lag = replica_lag(alias)
+        if lag is not None:
+            lags[(alias,)] = lag
+    return lags
+
+
+register(Gauge('database_replica_lag_seconds',
+               'Seconds a read replica is behind the primary.', ('alias',),
+               _collect_lag, max_age=GAUGE_MAX_AGE))
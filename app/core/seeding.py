@@ -0,0 +1,232 @@
+import bisect
+import itertools
+import math
+import random
+from decimal import Decimal
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from core.catalog import canonical_id
+from core.changes import KINDS, record_changes
+from core.counts import reconcile_recipe_counts
+from core.models import Tag, Ingredient, Recipe, normalize_name
+from core.similarity import refresh_bands
+from core.stats import refresh_recipe_stats
+
+
+TAG_WORDS = (
+    'Vegan', 'Vegetarian', 'Dessert', 'Breakfast', 'Lunch', 'Dinner',
+    'Quick', 'Spicy', 'Healthy', 'Snack', 'Gluten free', 'Curry',
+)
+INGREDIENT_WORDS = (
+    'Salt', 'Pepper', 'Flour', 'Sugar', 'Butter', 'Eggs', 'Milk', 'Garlic',
+    'Onion', 'Tomato', 'Ginger', 'Paneer', 'Rice', 'Lemon', 'Cinnamon',
+)
+TITLE_WORDS = (
+    'Chicken', 'Paneer', 'Masala', 'Tikka', 'Curry', 'Soup', 'Salad',
+    'Biryani', 'Pasta', 'Cake', 'Bread', 'Roast', 'Stew', 'Korma',
+)
+
+
+def _names(rng, words, count):
+    '''Return count distinct names built from the word list'''
+
+    names = list(words[:count])
+    while len(names) < count:
+        names.append(f'{rng.choice(words)} {len(names)}')
+    return names
+
+
+def zipf_cum_weights(count, exponent):
+    '''Return cumulative Zipf weights for ranks 1..count
+
+    An exponent of 0 gives a uniform distribution.
+    '''
+
+    return list(itertools.accumulate(
+        1 / rank ** exponent for rank in range(1, count + 1)
+    ))
+
+
+def zipf_sample(rng, cum_weights, k):
+    '''Pick k distinct indexes with probability following cum_weights'''
+
+    k = min(k, len(cum_weights))
+    if not k:
+        return set()
+    total = cum_weights[-1]
+    picked = set()
+    while len(picked) < k:
+        picked.add(bisect.bisect(cum_weights, rng.random() * total))
+    return picked
+
+
+class DatasetGenerator:
+    '''Generate users with recipes, tags and ingredients using bulk inserts
+
+    Users are written in batches so memory stays flat however many are
+    requested. The password is hashed once and shared by every user, and
+    the same seed always produces the same dataset.
+
+    ``recipes`` is the mean library size. With ``library_skew`` set,
+    library sizes follow a log-normal distribution (a few users with huge
+    libraries, many with small ones) instead of all being equal. Tags and
+    ingredients are assigned to recipes following a Zipf distribution
+    with ``zipf_exponent``.
+    '''
+
+    def __init__(self, recipes=20, tags=10, ingredients=20,
+                 tags_per_recipe=3, ingredients_per_recipe=5,
+                 zipf_exponent=0.0, library_skew=0.0,
+                 password='password123', password_hash=None, seed=0,
+                 email_domain='bench.example.com', batch_size=1000):
+        self.recipes = recipes
+        self.tags = tags
+        self.ingredients = ingredients
+        self.tags_per_recipe = tags_per_recipe
+        self.ingredients_per_recipe = ingredients_per_recipe
+        self.library_skew = library_skew
+        self.password_hash = password_hash or make_password(password)
+        self.email_domain = email_domain
+        self.batch_size = batch_size
+        self.rng = random.Random(seed)
+        self.tag_weights = zipf_cum_weights(tags, zipf_exponent)
+        self.ingredient_weights = zipf_cum_weights(ingredients, zipf_exponent)
+        self.tag_names = _names(self.rng, TAG_WORDS, tags)
+        self.ingredient_names = _names(self.rng, INGREDIENT_WORDS, ingredients)
+
+    def library_size(self):
+        '''Return the number of recipes for the next user'''
+
+        if not self.library_skew:
+            return self.recipes
+        sigma = self.library_skew
+        # Mean of lognormvariate(mu, sigma) is exp(mu + sigma^2 / 2)
+        mu = math.log(max(self.recipes, 1)) - sigma ** 2 / 2
+        return int(round(self.rng.lognormvariate(mu, sigma)))
+
+    def generate(self, users, start=0):
+        '''Create users in batches, yielding the number created so far'''
+
+        done = 0
+        while done < users:
+            count = min(self.batch_size, users - done)
+            with transaction.atomic():
+                self.generate_batch(start + done, count)
+            done += count
+            yield done
+
+    def generate_batch(self, start, count):
+        '''Create count users numbered from start and their data'''
+
+        User = get_user_model()
+        emails = [
+            f'user{i}@{self.email_domain}' for i in range(start, start + count)
+        ]
+        User.objects.bulk_create([
+            User(email=email, name=f'User {i}', password=self.password_hash)
+            for i, email in enumerate(emails, start)
+        ])
+        # Only some backends set primary keys on bulk created objects
+        user_ids = list(
+            User.objects.filter(email__in=emails).values_list('id', flat=True)
+        )
+
+        # What the set_canonical signal does, from the in-process catalog
+        for model, names in ((Tag, self.tag_names),
+                             (Ingredient, self.ingredient_names)):
+            normalized = {name: normalize_name(name) for name in names}
+            canonical = {
+                name: canonical_id(model, value)
+                for name, value in normalized.items()
+            }
+            model.objects.bulk_create([
+                model(user_id=user_id, name=name,
+                      normalized_name=normalized[name],
+                      canonical_id=canonical[name])
+                for user_id in user_ids for name in names
+            ], batch_size=5000)
+        Recipe.objects.bulk_create(
+            (
+                Recipe(
+                    user_id=user_id,
+                    title=f'{self.rng.choice(TITLE_WORDS)} '
+                          f'{self.rng.choice(TITLE_WORDS)}',
+                    time_minutes=self.rng.randint(5, 180),
+                    price=Decimal(self.rng.randint(100, 50000)) / 100,
+                )
+                for user_id in user_ids for _ in range(self.library_size())
+            ),
+            batch_size=5000,
+        )
+
+        tag_ids = _ids_by_user(Tag, user_ids)
+        ingredient_ids = _ids_by_user(Ingredient, user_ids)
+        tag_links = []
+        ingredient_links = []
+        recipes = []
+        recipe_rows = Recipe.objects.filter(user_id__in=user_ids) \
+            .values_list('id', 'user_id')
+        for recipe_id, user_id in recipe_rows.iterator():
+            recipes.append((user_id, recipe_id))
+            user_tags = tag_ids[user_id]
+            for index in zipf_sample(self.rng, self.tag_weights,
+                                     self.tags_per_recipe):
+                tag_links.append(Recipe.tags.through(
+                    recipe_id=recipe_id, tag_id=user_tags[index]
+                ))
+            user_ingredients = ingredient_ids[user_id]
+            for index in zipf_sample(self.rng, self.ingredient_weights,
+                                     self.ingredients_per_recipe):
+                ingredient_links.append(Recipe.ingredients.through(
+                    recipe_id=recipe_id,
+                    ingredient_id=user_ingredients[index],
+                ))
+        Recipe.tags.through.objects.bulk_create(tag_links, batch_size=5000)
+        Recipe.ingredients.through.objects.bulk_create(
+            ingredient_links, batch_size=5000
+        )
+        # bulk_create skips the signals that maintain counts and stats,
+        # the change feed and the similarity bands
+        reconcile_recipe_counts(user_ids)
+        refresh_recipe_stats(user_ids)
+        for model, ids in ((Tag, tag_ids), (Ingredient, ingredient_ids)):
+            record_changes(KINDS[model], [
+                (user_id, pk) for user_id, pks in ids.items() for pk in pks
+            ])
+        record_changes(KINDS[Recipe], recipes)
+        for start in range(0, len(recipes), self.batch_size):
+            refresh_bands([
+                pk for _user_id, pk in recipes[start:start + self.batch_size]
+            ])
+
+
+def _ids_by_user(model, user_ids):
+    '''Return {user_id: [ids ordered by id]} for the rows of the users'''
+
+    result = {user_id: [] for user_id in user_ids}
+    rows = model.objects.filter(user_id__in=user_ids) \
+        .order_by('id').values_list('user_id', 'id')
+    for user_id, pk in rows.iterator():
+        result[user_id].append(pk)
+    return result
+
+
+def generate_dataset(users=10, recipes=20, tags=10, ingredients=20,
+                     tags_per_recipe=3, ingredients_per_recipe=5,
+                     password='password123', seed=0,
+                     email_domain='bench.example.com'):
+    '''Create a small uniform dataset and return the created users'''
+
+    generator = DatasetGenerator(
+        recipes=recipes, tags=tags, ingredients=ingredients,
+        tags_per_recipe=tags_per_recipe,
+        ingredients_per_recipe=ingredients_per_recipe,
+        password=password, seed=seed, email_domain=email_domain,
+    )
+    for _ in generator.generate(users):
+        pass
+    return list(
+        get_user_model().objects
+        .filter(email__endswith=f'@{email_domain}').order_by('id')
+    )
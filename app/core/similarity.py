@@ -0,0 +1,193 @@
+import math
+import random
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.signals import m2m_changed, pre_delete
+from django.dispatch import receiver
+from core.bulk import recipes_bulk_changed
+from core.changes import current_batch
+from core.jobs import task
+from core.models import Tag, Ingredient, Recipe, SimilarityBand
+
+
+# A signature has NUM_BANDS * ROWS_PER_BAND MinHash values. Recipes that
+# agree on all rows of any band share a bucket and become candidates, for
+# a Jaccard similarity s that happens with 1 - (1 - s^2)^16, 0.78 at 0.3.
+NUM_BANDS = 16
+ROWS_PER_BAND = 2
+# Candidates sharing the most buckets that are scored exactly
+MAX_CANDIDATES = 200
+
+_PRIME = (1 << 61) - 1
+_BUCKET_RANGE = 1 << 58
+# Fixed seed, stored buckets must stay comparable between processes
+_random = random.Random(20261019)
+_HASHES = [
+    (_random.randrange(1, _PRIME), _random.randrange(_PRIME))
+    for _ in range(NUM_BANDS * ROWS_PER_BAND)
+]
+
+# through model, column, feature parity. Tag and ingredient ids are mapped
+# to even and odd numbers so they never collide.
+FEATURE_RELATIONS = (
+    (Recipe.tags.through, 'tag_id', 0),
+    (Recipe.ingredients.through, 'ingredient_id', 1),
+)
+
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b)
+
+
+def cosine(a, b):
+    return len(a & b) / math.sqrt(len(a) * len(b))
+
+
+METRICS = {'jaccard': jaccard, 'cosine': cosine}
+
+
+def recipe_features(recipe):
+    '''Return the feature set of a recipe with prefetched relations'''
+
+    return {tag.pk * 2 for tag in recipe.tags.all()} | \
+        {ingredient.pk * 2 + 1 for ingredient in recipe.ingredients.all()}
+
+
+def load_features(recipe_ids):
+    '''Return recipe id -> feature set, read from the through tables'''
+
+    features = {pk: set() for pk in recipe_ids}
+    for through, column, parity in FEATURE_RELATIONS:
+        rows = through.objects.filter(recipe_id__in=recipe_ids) \
+            .values_list('recipe_id', column)
+        for recipe_id, related_id in rows:
+            features[recipe_id].add(related_id * 2 + parity)
+    return features
+
+
+def signature(features):
+    '''Return the MinHash signature of a non empty feature set'''
+
+    return [min((a * x + b) % _PRIME for x in features) for a, b in _HASHES]
+
+
+def buckets(features):
+    '''Return the LSH bucket of every band, the band is the lowest bits'''
+
+    if not features:
+        return []
+    values = signature(features)
+    result = []
+    for band in range(NUM_BANDS):
+        combined = 0
+        for value in values[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]:
+            combined = (combined * 1000003 + value) % _PRIME
+        result.append(combined % _BUCKET_RANGE * NUM_BANDS + band)
+    return result
+
+
+def refresh_bands(recipe_ids):
+    '''Recompute the stored bands of recipes from their current links
+
+    Bands of recipes that are gone or soft deleted are only removed.
+    Returns the number of recipes refreshed.
+    '''
+
+    recipe_ids = list(recipe_ids)
+    owners = dict(
+        Recipe.objects.filter(pk__in=recipe_ids).values_list('pk', 'user_id')
+    )
+    features = load_features(list(owners))
+    with transaction.atomic():
+        SimilarityBand.objects.filter(recipe_id__in=recipe_ids).delete()
+        SimilarityBand.objects.bulk_create([
+            SimilarityBand(user_id=user_id, recipe_id=pk, bucket=bucket)
+            for pk, user_id in owners.items()
+            for bucket in buckets(features[pk])
+        ], batch_size=5000)
+    return len(owners)
+
+
+def similar_recipes(recipe, limit=10, metric='jaccard'):
+    '''Return (recipe id, score) of the owner's recipes most like recipe
+
+    Candidates come from the stored buckets and are scored exactly, so
+    the result only misses recipes whose bands were never shared. The
+    recipe itself is compared by its current tags and ingredients.
+    '''
+
+    features = recipe_features(recipe)
+    if not features:
+        return []
+    # Soft deleted recipes lose their bands, unless a refresh raced it
+    deleted = Recipe.all_objects \
+        .filter(user_id=recipe.user_id, deleted_at__isnull=False) \
+        .values('pk')
+    candidates = list(
+        SimilarityBand.objects
+        .filter(user_id=recipe.user_id, bucket__in=buckets(features))
+        .exclude(recipe_id=recipe.pk)
+        .exclude(recipe_id__in=deleted)
+        .values('recipe_id').annotate(matches=Count('*'))
+        .order_by('-matches', 'recipe_id')
+        .values_list('recipe_id', flat=True)[:MAX_CANDIDATES]
+    )
+    score = METRICS[metric]
+    scores = [
+        (pk, score(features, other))
+        for pk, other in load_features(candidates).items() if other
+    ]
+    scores.sort(key=lambda item: (-item[1], item[0]))
+    return [(pk, value) for pk, value in scores[:limit] if value > 0]
+
+
+@task('core.refresh_similarity')
+def refresh_similarity(recipe_ids):
+    refresh_bands(recipe_ids)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def queue_band_refresh(sender, instance, action, reverse, pk_set, **kwargs):
+    '''Recompute the bands of relinked recipes in a background job'''
+
+    if not reverse:
+        if action == 'post_clear' or \
+                action in ('post_add', 'post_remove') and pk_set:
+            batch = current_batch()
+            if batch is not None:
+                batch.relinked.add(instance.pk)
+            else:
+                refresh_similarity.delay(recipe_ids=[instance.pk])
+        return
+
+    # instance is a tag or ingredient and the recipes are on the other side
+    if action == 'pre_clear':
+        instance.__dict__['_bands_pending'] = list(
+            instance.recipe_set.values_list('pk', flat=True)
+        )
+    elif action == 'post_clear':
+        pending = instance.__dict__.pop('_bands_pending', [])
+        if pending:
+            refresh_similarity.delay(recipe_ids=pending)
+    elif action in ('post_add', 'post_remove') and pk_set:
+        refresh_similarity.delay(recipe_ids=sorted(pk_set))
+
+
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+def queue_band_refresh_on_delete(sender, instance, **kwargs):
+    '''Deleting a tag or ingredient drops its links without m2m signals
+
+    The job reads the links once the delete has committed.
+    '''
+
+    recipe_ids = list(instance.recipe_set.values_list('pk', flat=True))
+    if recipe_ids:
+        refresh_similarity.delay(recipe_ids=recipe_ids)
+
+
+@receiver(recipes_bulk_changed)
+def queue_bulk_band_refresh(sender, recipe_ids=(), **kwargs):
+    if recipe_ids:
+        refresh_similarity.delay(recipe_ids=list(recipe_ids))
@@ -0,0 +1,221 @@
+from decimal import Decimal
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from core.models import Recipe, RecipeStats, RecipePriceBucket
+
+
+# Lower bounds of the price distribution buckets, the last is open ended
+PRICE_BUCKETS = (
+    Decimal(0), Decimal(5), Decimal(10), Decimal(20), Decimal(50),
+    Decimal(100), Decimal(200), Decimal(500),
+)
+
+
+def price_bucket(price):
+    '''Return the index of the bucket a price falls in'''
+
+    index = 0
+    for i, lower in enumerate(PRICE_BUCKETS):
+        if price >= lower:
+            index = i
+    return index
+
+
+def _bucket_filter(index):
+    query = Q(price__gte=PRICE_BUCKETS[index])
+    if index + 1 < len(PRICE_BUCKETS):
+        query &= Q(price__lt=PRICE_BUCKETS[index + 1])
+    return query
+
+
+def _format(recipe_count, total_time, total_price, bucket_counts):
+    if recipe_count:
+        average_time = round(total_time / recipe_count, 2)
+        average_price = round(Decimal(total_price) / recipe_count, 2)
+    else:
+        average_time = average_price = None
+    distribution = []
+    for index, lower in enumerate(PRICE_BUCKETS):
+        upper = PRICE_BUCKETS[index + 1] \
+            if index + 1 < len(PRICE_BUCKETS) else None
+        distribution.append({
+            'min': lower,
+            'max': upper,
+            'count': bucket_counts.get(index, 0),
+        })
+    return {
+        'recipe_count': recipe_count,
+        'average_time_minutes': average_time,
+        'average_price': average_price,
+        'price_distribution': distribution,
+    }
+
+
+def _aggregates():
+    aggregates = {
+        'recipe_count': Count('id'),
+        'total_time': Sum('time_minutes'),
+        'total_price': Sum('price'),
+    }
+    for index in range(len(PRICE_BUCKETS)):
+        aggregates[f'bucket_{index}'] = Count(
+            'id', filter=_bucket_filter(index)
+        )
+    return aggregates
+
+
+def _bucket_counts(row):
+    return {
+        index: row[f'bucket_{index}'] for index in range(len(PRICE_BUCKETS))
+    }
+
+
+def compute_recipe_stats(user_id):
+    '''Compute a user's stats with a single aggregate over their recipes'''
+
+    row = Recipe.objects.filter(user_id=user_id).aggregate(**_aggregates())
+    return _format(row['recipe_count'], row['total_time'] or 0,
+                   row['total_price'] or 0, _bucket_counts(row))
+
+
+def read_recipe_stats(user_id):
+    '''Read a user's stats from the summary tables in constant time'''
+
+    summary = RecipeStats.objects.filter(user_id=user_id).first()
+    if summary is None:
+        return _format(0, 0, 0, {})
+    buckets = dict(
+        RecipePriceBucket.objects.filter(user_id=user_id)
+        .values_list('bucket', 'recipe_count')
+    )
+    return _format(summary.recipe_count, summary.total_time_minutes,
+                   summary.total_price, buckets)
+
+
+def get_recipe_stats(user_id):
+    '''Return stats from the summary tables, or live when they are off'''
+
+    if getattr(settings, 'RECIPE_STATS_SUMMARY', True):
+        return read_recipe_stats(user_id)
+    return compute_recipe_stats(user_id)
+
+
+def apply_delta(user_id, count, time_minutes, price, buckets, create=True):
+    '''Add a change to the summary tables with atomic F() updates
+
+    buckets maps bucket index to the change of its recipe count. Missing
+    summary rows are only created when create is set.
+    '''
+
+    if create:
+        RecipeStats.objects.get_or_create(user_id=user_id)
+    RecipeStats.objects.filter(user_id=user_id).update(
+        recipe_count=F('recipe_count') + count,
+        total_time_minutes=F('total_time_minutes') + time_minutes,
+        total_price=F('total_price') + price,
+    )
+    for bucket, delta in buckets.items():
+        if not delta:
+            continue
+        if create:
+            RecipePriceBucket.objects.get_or_create(user_id=user_id,
+                                                    bucket=bucket)
+        RecipePriceBucket.objects.filter(
+            user_id=user_id, bucket=bucket
+        ).update(recipe_count=F('recipe_count') + delta)
+
+
+def refresh_recipe_stats(user_ids=None):
+    '''Rebuild the summary tables with one grouped aggregate
+
+    Returns the number of users refreshed.
+    '''
+
+    recipes = Recipe.objects.all()
+    if user_ids is not None:
+        recipes = recipes.filter(user_id__in=user_ids)
+    rows = recipes.order_by().values('user_id').annotate(**_aggregates())
+
+    with transaction.atomic():
+        stale = RecipeStats.objects.all()
+        buckets = RecipePriceBucket.objects.all()
+        if user_ids is not None:
+            stale = stale.filter(user_id__in=user_ids)
+            buckets = buckets.filter(user_id__in=user_ids)
+        stale.delete()
+        buckets.delete()
+
+        summaries = []
+        bucket_rows = []
+        for row in rows.iterator():
+            summaries.append(RecipeStats(
+                user_id=row['user_id'],
+                recipe_count=row['recipe_count'],
+                total_time_minutes=row['total_time'] or 0,
+                total_price=row['total_price'] or 0,
+            ))
+            for index, count in _bucket_counts(row).items():
+                if count:
+                    bucket_rows.append(RecipePriceBucket(
+                        user_id=row['user_id'], bucket=index,
+                        recipe_count=count,
+                    ))
+        RecipeStats.objects.bulk_create(summaries, batch_size=5000)
+        RecipePriceBucket.objects.bulk_create(bucket_rows, batch_size=5000)
+    return len(summaries)
+
+
+@receiver(pre_save, sender=Recipe)
+def remember_old_values(sender, instance, update_fields=None, **kwargs):
+    '''Keep the stored time and price to compute the update delta'''
+
+    instance._stats_old = None
+    if instance.pk is None:
+        return
+    if update_fields is not None and \
+            not {'time_minutes', 'price'} & set(update_fields):
+        return
+    instance._stats_old = Recipe.objects \
+        .filter(user_id=instance.user_id, pk=instance.pk) \
+        .values_list('time_minutes', 'price').first()
+
+
+@receiver(post_save, sender=Recipe)
+def update_stats_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    price = Decimal(str(instance.price))
+    if created:
+        apply_delta(instance.user_id, 1, instance.time_minutes, price,
+                    {price_bucket(price): 1})
+        return
+
+    old = getattr(instance, '_stats_old', None)
+    if old is None:
+        return
+    old_time, old_price = old
+    buckets = {price_bucket(old_price): -1}
+    new_bucket = price_bucket(price)
+    buckets[new_bucket] = buckets.get(new_bucket, 0) + 1
+    if old_time != instance.time_minutes or old_price != price:
+        apply_delta(instance.user_id, 0, instance.time_minutes - old_time,
+                    price - old_price, buckets)
+
+
+def release_stats(recipe):
+    '''Take a recipe out of its owner's summary'''
+
+    # The user may be going away too, so never recreate their summary
+    price = Decimal(str(recipe.price))
+    apply_delta(recipe.user_id, -1, -recipe.time_minutes, -price,
+                {price_bucket(price): -1}, create=False)
+
+
+@receiver(post_delete, sender=Recipe)
+def update_stats_on_delete(sender, instance, **kwargs):
+    # Soft deleted recipes were released already
+    if instance.deleted_at is None:
+        release_stats(instance)
@@ -0,0 +1,25 @@
+from django.conf import settings
+from core import bulk, thumbnails
+from core.jobs import task
+from core.models import Recipe
+
+
+@task('core.generate_thumbnails')
+def generate_thumbnails(recipe_id, user_id=None):
+    '''Create the list thumbnail of a new recipe image ahead of time'''
+
+    recipes = Recipe.objects.filter(pk=recipe_id)
+    # Jobs queued by older releases have no user_id
+    if user_id is not None:
+        recipes = recipes.filter(user_id=user_id)
+    recipe = recipes.first()
+    if recipe is None or not recipe.image:
+        return
+    thumbnails.get_thumbnail(
+        recipe.image.name, getattr(settings, 'THUMBNAIL_LIST_SIZE', 256)
+    )
+
+
+@task('core.delete_users', max_attempts=5)
+def delete_users(user_ids):
+    bulk.delete_users(user_ids)
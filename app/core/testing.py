@@ -0,0 +1,53 @@
+from contextlib import contextmanager
+from core.queries import QueryInspector
+
+
+class QueryAssertionsMixin:
+    '''TestCase mixin with query budget and N+1 assertions'''
+
+    @contextmanager
+    def assertMaxQueries(self, num, allow_duplicates=False,
+                         duplicate_threshold=2, using=None):
+        '''Fail if the block runs more than num queries or repeats one'''
+
+        inspector = QueryInspector(duplicate_threshold=duplicate_threshold)
+        with inspector.capture(using=using):
+            yield inspector
+
+        executed = '\n'.join(sql for sql, _ in inspector.queries)
+        self.assertLessEqual(
+            len(inspector), num,
+            f'{len(inspector)} queries executed, {num} expected at most:\n'
+            f'{executed}'
+        )
+        if not allow_duplicates:
+            duplicates = inspector.duplicates()
+            self.assertFalse(
+                duplicates,
+                'Structurally identical queries repeated (N+1?):\n' +
+                '\n'.join(f'{count}x {sql}' for sql, count in duplicates)
+            )
+
+    @contextmanager
+    def assertPartitionKey(self, table, column, using=None):
+        '''Fail if the block queries table without filtering on column
+
+        Inserts are not checked, they always carry every column.
+        '''
+
+        inspector = QueryInspector()
+        with inspector.capture(using=using):
+            yield inspector
+
+        quoted = f'"{table}"'
+        unscoped = [
+            sql for sql, _ in inspector.queries
+            if quoted in sql and not sql.startswith('INSERT')
+            # Subqueries refer to the table by alias, e.g. U0."user_id"
+            and f'."{column}"' not in sql.partition(' WHERE ')[2]
+        ]
+        self.assertFalse(
+            unscoped,
+            f'Queries of {table} without {column} in WHERE:\n' +
+            '\n'.join(unscoped)
+        )
@@ -1,6 +1,8 @@
 from django.test import TestCase, Client
 from django.contrib.auth import get_user_model
 from django.urls import reverse
+from core import bulk, models
+from core.pagination import EstimatedCountPaginator
 
 
 class AdminSiteTests(TestCase):
@@ -37,3 +39,91 @@ class AdminSiteTests(TestCase):
         url = reverse('admin:core_user_add')
         res = self.client.get(url)
         self.assertEqual(res.status_code, 200)
+
+    def test_recipe_models_listed(self):
+        '''Test that tag, ingredient and recipe changelists work'''
+        tag = models.Tag.objects.create(user=self.user, name='Vegan')
+        models.Ingredient.objects.create(user=self.user, name='Salt')
+        recipe = models.Recipe.objects.create(
+            user=self.user, title='Poha', time_minutes=10, price=5.00
+        )
+        recipe.tags.add(tag)
+        for name in ('tag', 'ingredient', 'recipe'):
+            res = self.client.get(reverse(f'admin:core_{name}_changelist'))
+            self.assertEqual(res.status_code, 200)
+        res = self.client.get(
+            reverse('admin:core_tag_changelist'), {'q': 'veg'}
+        )
+        self.assertContains(res, 'Vegan')
+
+    def test_recipe_change_page(self):
+        '''Test that the recipe edit page works'''
+        recipe = models.Recipe.objects.create(
+            user=self.user, title='Poha', time_minutes=10, price=5.00
+        )
+        url = reverse('admin:core_recipe_change', args=[recipe.id])
+        res = self.client.get(url)
+        self.assertEqual(res.status_code, 200)
+
+    def test_estimated_paginator_exact_for_small_tables(self):
+        '''Test that the paginator counts exactly without an estimate'''
+        paginator = EstimatedCountPaginator(
+            models.User.objects.order_by('id'), 10
+        )
+        self.assertEqual(paginator.count, 2)
+
+    def test_deleted_recipes_listed(self):
+        '''Test that soft deleted recipes can be found and restored'''
+        live = models.Recipe.objects.create(
+            user=self.user, title='Poha', time_minutes=10, price=5.00
+        )
+        deleted = models.Recipe.objects.create(
+            user=self.user, title='Upma', time_minutes=10, price=5.00
+        )
+        bulk.soft_delete_recipe(deleted)
+        url = reverse('admin:core_recipe_changelist')
+
+        res = self.client.get(url, {'deleted': 'yes'})
+        self.assertContains(res, 'Upma')
+        self.assertNotContains(res, 'Poha')
+        res = self.client.get(url)
+        self.assertFalse(res.context['cl'].root_queryset.query.where)
+        res = self.client.get(
+            reverse('admin:core_recipe_change', args=[deleted.id])
+        )
+        self.assertNotContains(res, 'name="_save"')
+
+        self.client.post(url, {
+            'action': 'restore_selected_recipes',
+            '_selected_action': [deleted.id, live.id],
+        })
+        self.assertEqual(models.Recipe.objects.count(), 2)
+
+    def test_collector_delete_action_removed(self):
+        '''Test that only the set based delete actions are offered'''
+        for name in ('user', 'tag', 'ingredient', 'recipe'):
+            res = self.client.get(reverse(f'admin:core_{name}_changelist'))
+            # Without any action there is no action form at all
+            form = res.context['action_form']
+            choices = form.fields['action'].choices if form else []
+            self.assertNotIn('delete_selected',
+                             [action for action, _label in choices])
+
+    def test_recipe_autocomplete_limited_to_owner(self):
+        '''Test that a recipe's tags are picked from its owner's only'''
+        mine = models.Tag.objects.create(user=self.user, name='Vegan')
+        models.Tag.objects.create(user=self.admin_user, name='Vegetarian')
+        recipe = models.Recipe.objects.create(
+            user=self.user, title='Poha', time_minutes=10, price=5.00
+        )
+        url = reverse('admin:core_tag_autocomplete')
+
+        res = self.client.get(
+            reverse('admin:core_recipe_change', args=[recipe.id])
+        )
+        self.assertContains(res, f'{url}?user={self.user.id}')
+        res = self.client.get(url, {'term': 'veg', 'user': self.user.id})
+        self.assertEqual([item['id'] for item in res.json()['results']],
+                         [str(mine.id)])
+        res = self.client.get(url, {'term': 'veg'})
+        self.assertEqual(len(res.json()['results']), 2)
@@ -0,0 +1,126 @@
+import asyncio
+from io import BytesIO
+from django.core.wsgi import get_wsgi_application
+from django.test import SimpleTestCase, TestCase
+from core.asgi import AsgiHandler, build_environ
+
+
+def run(application, scope, messages):
+    '''Call an ASGI application, returns the messages it sent'''
+
+    sent = []
+    incoming = list(messages)
+
+    async def receive():
+        if incoming:
+            return incoming.pop(0)
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(application(scope, receive, send))
+    finally:
+        loop.close()
+    return sent
+
+
+def http_scope(path, method='GET', headers=(), query_string=b''):
+    return {
+        'type': 'http',
+        'method': method,
+        'path': path,
+        'query_string': query_string,
+        'headers': list(headers),
+        'server': ('testserver', 80),
+    }
+
+
+def echo_app(environ, start_response):
+    body = environ['wsgi.input'].read(int(environ['CONTENT_LENGTH']))
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [b'echo:', body]
+
+
+class AsgiHandlerTests(SimpleTestCase):
+
+    def setUp(self):
+        self.application = AsgiHandler(echo_app, max_threads=2)
+
+    def tearDown(self):
+        self.application.pool.shutdown()
+
+    def test_body_read_and_response_streamed(self):
+        '''Test that a chunked body reaches the WSGI app in one piece'''
+
+        sent = run(self.application, http_scope('/', method='POST'), [
+            {'type': 'http.request', 'body': b'ab', 'more_body': True},
+            {'type': 'http.request', 'body': b'cd'},
+        ])
+
+        self.assertEqual(sent[0]['type'], 'http.response.start')
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn((b'content-type', b'text/plain'), sent[0]['headers'])
+        body = b''.join(message.get('body', b'') for message in sent[1:])
+        self.assertEqual(body, b'echo:abcd')
+        self.assertFalse(sent[-1].get('more_body', False))
+
+    def test_disconnect_before_body(self):
+        '''Test that nothing is run for clients that left early'''
+
+        sent = run(self.application, http_scope('/', method='POST'), [
+            {'type': 'http.request', 'body': b'ab', 'more_body': True},
+        ])
+        self.assertEqual(sent, [])
+
+    def test_lifespan(self):
+        sent = run(self.application, {'type': 'lifespan'}, [
+            {'type': 'lifespan.startup'},
+            {'type': 'lifespan.shutdown'},
+        ])
+        self.assertEqual([message['type'] for message in sent], [
+            'lifespan.startup.complete', 'lifespan.shutdown.complete',
+        ])
+
+    def test_build_environ(self):
+        scope = http_scope('/api/recipe/', query_string=b'tags=1', headers=[
+            (b'content-type', b'application/json'),
+            (b'accept', b'text/html'),
+            (b'accept', b'application/json'),
+        ])
+        scope['client'] = ('10.0.0.1', 5000)
+        environ = build_environ(scope, BytesIO(b''))
+
+        self.assertEqual(environ['PATH_INFO'], '/api/recipe/')
+        self.assertEqual(environ['QUERY_STRING'], 'tags=1')
+        self.assertEqual(environ['CONTENT_TYPE'], 'application/json')
+        self.assertEqual(environ['HTTP_ACCEPT'],
+                         'text/html,application/json')
+        self.assertEqual(environ['REMOTE_ADDR'], '10.0.0.1')
+        self.assertEqual(environ['CONTENT_LENGTH'], '0')
+
+    def test_build_environ_cookies(self):
+        scope = http_scope('/', headers=[
+            (b'cookie', b'a=1'),
+            (b'cookie', b'b=2'),
+        ])
+        environ = build_environ(scope, BytesIO(b''))
+
+        self.assertEqual(environ['HTTP_COOKIE'], 'a=1; b=2')
+
+
+class AsgiDjangoTests(TestCase):
+
+    def test_django_request(self):
+        '''Test that Django answers through the ASGI handler'''
+
+        application = AsgiHandler(get_wsgi_application(), max_threads=1)
+        try:
+            sent = run(application, http_scope('/api/recipe/tags/'), [
+                {'type': 'http.request'},
+            ])
+        finally:
+            application.pool.shutdown()
+        self.assertEqual(sent[0]['status'], 401)
@@ -0,0 +1,30 @@
+from io import StringIO
+from django.core.management import call_command
+from django.test import TestCase
+from core.benchmarks import percentile
+from core.models import Recipe
+
+
+class BenchmarkTests(TestCase):
+
+    def test_percentile(self):
+        '''Test nearest rank percentiles'''
+
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([], 95), 0.0)
+
+    def test_benchmark_command(self):
+        '''Test that the benchmark reports every scenario and cleans up'''
+
+        out = StringIO()
+        call_command(
+            'benchmark', users=2, recipes=3, tags=3, ingredients=3,
+            iterations=2, scenarios='list,filter,detail,create,token',
+            stdout=out,
+        )
+        output = out.getvalue()
+        for name in ('list', 'filter', 'detail', 'create', 'token'):
+            self.assertIn(name, output)
+        self.assertFalse(Recipe.objects.exists())
@@ -0,0 +1,222 @@
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, Client
+from django.urls import reverse
+from django.utils import timezone
+from core import bulk, jobs
+from core.counts import reconcile_recipe_counts
+from core.models import Tag, Ingredient, Recipe, RecipeStats, Change, \
+    SimilarityBand
+
+
+def sample_recipe(user, title='Poha'):
+    return Recipe.objects.create(
+        user=user, title=title, time_minutes=10, price=5.00
+    )
+
+
+class BulkOperationTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'bulk@gmail.com',
+            'password123'
+        )
+        self.other = get_user_model().objects.create_user(
+            'other@gmail.com',
+            'password123'
+        )
+        self.tag = Tag.objects.create(user=self.user, name='Vegan')
+        self.recipe = sample_recipe(self.user)
+        self.recipe.tags.add(self.tag)
+        self.recipe.ingredients.add(
+            Ingredient.objects.create(user=self.user, name='Salt')
+        )
+        self.other_recipe = sample_recipe(self.other)
+
+    def test_delete_user_recipes(self):
+        '''Test batched deletion of a user's recipes'''
+
+        sample_recipe(self.user, title='Upma')
+        deleted = bulk.delete_user_recipes([self.user.id], batch_size=1)
+        self.assertEqual(deleted, 2)
+        self.assertFalse(Recipe.objects.filter(user=self.user).exists())
+        self.assertFalse(Recipe.tags.through.objects.exists())
+        self.assertTrue(Recipe.objects.filter(user=self.other).exists())
+        self.tag.refresh_from_db()
+        self.assertEqual(self.tag.recipe_count, 0)
+        self.assertFalse(RecipeStats.objects.filter(user=self.user).exists())
+
+    def test_delete_users(self):
+        '''Test deleting users with all their data'''
+
+        bulk.delete_users([self.user.id])
+        self.assertFalse(
+            get_user_model().objects.filter(pk=self.user.id).exists()
+        )
+        self.assertFalse(Tag.objects.filter(user_id=self.user.id).exists())
+        self.assertTrue(Recipe.objects.filter(user=self.other).exists())
+
+    def test_soft_delete_recipe(self):
+        '''Test that soft deletion hides a recipe and releases its counts'''
+
+        self.assertTrue(bulk.soft_delete_recipe(self.recipe))
+        self.assertFalse(bulk.soft_delete_recipe(self.recipe))
+
+        self.assertFalse(Recipe.objects.filter(pk=self.recipe.pk).exists())
+        self.assertTrue(Recipe.all_objects.filter(pk=self.recipe.pk).exists())
+        self.assertTrue(
+            Recipe.tags.through.objects.filter(recipe=self.recipe).exists()
+        )
+        self.tag.refresh_from_db()
+        self.assertEqual(self.tag.recipe_count, 0)
+        self.assertEqual(RecipeStats.objects.get(user=self.user).recipe_count,
+                         0)
+        self.assertEqual(reconcile_recipe_counts(), 0)
+
+    def test_restore_recipes(self):
+        '''Test that restoring undoes the bookkeeping of a soft delete'''
+
+        bulk.soft_delete_recipe(self.recipe)
+        jobs.Worker().run(burst=True)
+        self.assertFalse(
+            SimilarityBand.objects.filter(recipe_id=self.recipe.pk).exists()
+        )
+
+        restored = bulk.restore_recipes(Recipe.all_objects.all())
+        jobs.Worker().run(burst=True)
+
+        self.assertEqual(restored, 1)
+        self.assertTrue(Recipe.objects.filter(pk=self.recipe.pk).exists())
+        self.tag.refresh_from_db()
+        self.assertEqual(self.tag.recipe_count, 1)
+        self.assertEqual(RecipeStats.objects.get(user=self.user).recipe_count,
+                         1)
+        self.assertTrue(
+            SimilarityBand.objects.filter(recipe_id=self.recipe.pk).exists()
+        )
+        change = Change.objects.filter(object_id=self.recipe.pk) \
+            .latest('id')
+        self.assertFalse(change.deleted)
+        self.assertEqual(bulk.restore_recipes(Recipe.all_objects.all()), 0)
+
+    def test_purge_recipes(self):
+        '''Test that only recipes deleted before the cutoff are purged'''
+
+        bulk.soft_delete_recipe(self.recipe)
+        recent = sample_recipe(self.user)
+        bulk.soft_delete_recipe(recent)
+        Recipe.all_objects.filter(pk=self.recipe.pk).update(
+            deleted_at=timezone.now() - timedelta(days=2)
+        )
+
+        out = StringIO()
+        call_command('purge_recipes', '--days', '1', stdout=out)
+
+        self.assertIn('Purged 1 recipes', out.getvalue())
+        self.assertFalse(
+            Recipe.all_objects.filter(pk=self.recipe.pk).exists()
+        )
+        self.assertFalse(Recipe.tags.through.objects.exists())
+        self.assertTrue(Recipe.all_objects.filter(pk=recent.pk).exists())
+        self.assertEqual(RecipeStats.objects.get(user=self.user).recipe_count,
+                         0)
+
+    @patch('core.bulk.default_storage')
+    @patch('core.bulk.transaction.on_commit', side_effect=lambda f: f())
+    def test_purge_deletes_images(self, mock_on_commit, mock_storage):
+        '''Test that image files of purged recipes are removed'''
+
+        self.recipe.image = 'uploads/recipe/poha.jpg'
+        self.recipe.save()
+        bulk.soft_delete_recipe(self.recipe)
+
+        bulk.purge_recipes(timezone.now())
+
+        mock_storage.delete.assert_called_once_with('uploads/recipe/poha.jpg')
+
+    def test_delete_users_with_soft_deleted_recipes(self):
+        '''Test that soft deleted recipes do not block deleting users'''
+
+        bulk.soft_delete_recipe(self.recipe)
+        bulk.delete_users([self.user.id])
+        self.assertFalse(
+            Recipe.all_objects.filter(user_id=self.user.id).exists()
+        )
+
+    def test_merge_tags(self):
+        '''Test merging tags into one, keeping every recipe link'''
+
+        dup = Tag.objects.create(user=self.user, name='Plant based')
+        recipe2 = sample_recipe(self.user, title='Upma')
+        recipe2.tags.add(dup)
+        self.recipe.tags.add(dup)
+
+        merged = bulk.merge_into(self.tag, [dup])
+
+        self.assertEqual(merged, 1)
+        self.assertFalse(Tag.objects.filter(pk=dup.pk).exists())
+        self.assertEqual(list(recipe2.tags.all()), [self.tag])
+        self.assertEqual(list(self.recipe.tags.all()), [self.tag])
+        self.tag.refresh_from_db()
+        self.assertEqual(self.tag.recipe_count, 2)
+
+    def test_merge_other_users_rejected(self):
+        '''Test that rows of different users cannot be merged'''
+
+        other_tag = Tag.objects.create(user=self.other, name='Vegan')
+        with self.assertRaises(ValueError):
+            bulk.merge_into(self.tag, [other_tag])
+
+    def test_bulk_cleanup_command(self):
+        '''Test the command merging ingredients'''
+
+        salt = Ingredient.objects.get(name='Salt')
+        dup = Ingredient.objects.create(user=self.user, name='Sea salt')
+        out = StringIO()
+        call_command('bulk_cleanup', 'merge-ingredients', salt.id, dup.id,
+                     stdout=out)
+        self.assertIn('Merged 1 rows', out.getvalue())
+        self.assertFalse(Ingredient.objects.filter(pk=dup.pk).exists())
+
+    def test_normalize_names(self):
+        '''Test that rows without normalized_name are fixed or merged'''
+
+        # As written by code from before migration 0010
+        duplicate = Tag.objects.create(user=self.user, name='Vegan food')
+        self.other_recipe.tags.add(
+            Tag.objects.create(user=self.other, name='Lunch')
+        )
+        recipe = sample_recipe(self.user, title='Upma')
+        recipe.tags.add(duplicate)
+        Tag.objects.filter(pk=duplicate.pk).update(name=' VEGAN ',
+                                                   normalized_name='')
+        Tag.objects.filter(user=self.other).update(normalized_name='')
+
+        out = StringIO()
+        call_command('normalize_names', stdout=out)
+
+        self.assertIn('Normalized 2 tags', out.getvalue())
+        self.assertFalse(Tag.objects.filter(pk=duplicate.pk).exists())
+        self.assertEqual(list(recipe.tags.all()), [self.tag])
+        self.assertEqual(Tag.objects.get(user=self.other).normalized_name,
+                         'lunch')
+        self.assertEqual(bulk.normalize_names(Tag), 0)
+
+    def test_admin_delete_recipes_action(self):
+        '''Test the admin action deleting users' recipes'''
+
+        admin_user = get_user_model().objects.create_superuser(
+            'admin@gmail.com',
+            'admin123'
+        )
+        client = Client()
+        client.force_login(admin_user)
+        client.post(reverse('admin:core_user_changelist'), {
+            'action': 'delete_recipes',
+            '_selected_action': [self.user.id],
+        })
+        self.assertFalse(Recipe.objects.filter(user=self.user).exists())
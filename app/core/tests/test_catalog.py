@@ -0,0 +1,130 @@
+from io import StringIO
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+from core import catalog
+from core.models import Tag, Ingredient, CatalogTag, CatalogIngredient
+
+
+class CatalogTests(TestCase):
+
+    def setUp(self):
+        catalog.clear_catalog_cache()
+        self.user = get_user_model().objects.create_user(
+            'catalog@gmail.com',
+            'password123'
+        )
+        self.other = get_user_model().objects.create_user(
+            'other@gmail.com',
+            'password123'
+        )
+
+    def tearDown(self):
+        catalog.clear_catalog_cache()
+
+    def test_new_rows_linked_without_queries(self):
+        '''Test that saving a tag looks the catalog up in memory'''
+
+        entry = CatalogTag.objects.create(name='Vegan')
+        catalog.CATALOGS[Tag].entries()
+        tag = Tag(user=self.user, name=' VEGAN')
+        with CaptureQueriesContext(connection) as queries:
+            tag.save()
+        self.assertEqual(tag.canonical_id, entry.id)
+        self.assertFalse([
+            query for query in queries.captured_queries
+            if CatalogTag._meta.db_table in query['sql']
+        ])
+
+        lunch = Tag.objects.create(user=self.user, name='Lunch')
+        self.assertIsNone(lunch.canonical_id)
+
+    def test_catalog_change_reloads_cache(self):
+        '''Test that catalog changes are seen by the next lookup'''
+
+        self.assertIsNone(catalog.canonical_id(Ingredient, 'salt'))
+        entry = CatalogIngredient.objects.create(name='Salt')
+        self.assertEqual(catalog.canonical_id(Ingredient, 'salt'), entry.id)
+        entry.delete()
+        self.assertIsNone(catalog.canonical_id(Ingredient, 'salt'))
+
+    def test_other_process_change_seen_after_interval(self):
+        '''Test that a bumped shared version triggers a reload'''
+
+        cached = catalog.CATALOGS[Tag]
+        self.assertEqual(cached.entries(), {})
+        # Written behind the back of this process's copy
+        CatalogTag.objects.bulk_create([
+            CatalogTag(name='Dinner', normalized_name='dinner')
+        ])
+        catalog.cache.incr(cached.version_key)
+        self.assertEqual(cached.entries(), {})
+        with override_settings(CATALOG_CACHE_CHECK_SECONDS=0):
+            self.assertIn('dinner', cached.entries())
+
+    def test_canonical_name_served_from_memory(self):
+        '''Test that listed rows carry their catalog name without a query'''
+
+        entry = CatalogIngredient.objects.create(name='Sea salt')
+        Ingredient.objects.create(user=self.user, name='sea  SALT')
+        Ingredient.objects.create(user=self.user, name='Saffron')
+        catalog.CATALOGS[Ingredient].entries()
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        with CaptureQueriesContext(connection) as queries:
+            res = client.get(reverse('recipe:ingredient-list'))
+
+        self.assertEqual(
+            {item['name']: item['canonical_name'] for item in res.data},
+            {'sea  SALT': entry.name, 'Saffron': None},
+        )
+        self.assertFalse([
+            query for query in queries.captured_queries
+            if CatalogIngredient._meta.db_table in query['sql']
+        ])
+
+    @override_settings(CATALOG_ENABLED=False)
+    def test_disabled(self):
+        '''Test that nothing is linked when the catalog is off'''
+
+        CatalogTag.objects.create(name='Vegan')
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        self.assertIsNone(tag.canonical_id)
+
+    def test_promote_and_link(self):
+        '''Test that names shared by enough users enter the catalog'''
+
+        for user in (self.user, self.other):
+            Ingredient.objects.create(user=user, name='Flour')
+        Ingredient.objects.create(user=self.user, name='Saffron')
+        catalog.clear_catalog_cache()
+
+        self.assertEqual(catalog.promote(Ingredient, 2), 1)
+        self.assertEqual(catalog.promote(Ingredient, 2), 0)
+        entry = CatalogIngredient.objects.get()
+        self.assertEqual(entry.normalized_name, 'flour')
+        self.assertEqual(catalog.link_to_catalog(Ingredient), 3)
+
+        linked = Ingredient.objects.filter(canonical=entry)
+        self.assertEqual(linked.count(), 2)
+        self.assertFalse(
+            Ingredient.objects.filter(name='Saffron', canonical__isnull=False)
+            .exists()
+        )
+
+    def test_sync_catalog_command(self):
+        '''Test the command promotes and links both tables'''
+
+        for user in (self.user, self.other):
+            Tag.objects.create(user=user, name='Dessert')
+        out = StringIO()
+        call_command('sync_catalog', '--promote-min-users', '2', stdout=out)
+        self.assertIn('Added 1 tags', out.getvalue())
+        self.assertEqual(
+            Tag.objects.filter(canonical__name='Dessert').count(), 2
+        )
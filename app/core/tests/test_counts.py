@@ -0,0 +1,79 @@
+from io import StringIO
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from core.models import Tag, Ingredient, Recipe
+
+
+def sample_recipe(user, title='Poha'):
+    return Recipe.objects.create(
+        user=user, title=title, time_minutes=10, price=5.00
+    )
+
+
+class RecipeCountTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'counts@gmail.com',
+            'password123'
+        )
+        self.tag1 = Tag.objects.create(user=self.user, name='Vegan')
+        self.tag2 = Tag.objects.create(user=self.user, name='Lunch')
+        self.recipe = sample_recipe(self.user)
+
+    def assertCounts(self, model, **expected):
+        for name, count in expected.items():
+            obj = getattr(self, name)
+            obj.refresh_from_db()
+            self.assertEqual(obj.recipe_count, count, name)
+
+    def test_add_and_remove(self):
+        '''Test that add/remove adjust counts, ignoring no-op changes'''
+
+        self.recipe.tags.add(self.tag1, self.tag2)
+        self.recipe.tags.add(self.tag1)
+        self.assertCounts(Tag, tag1=1, tag2=1)
+        self.recipe.tags.remove(self.tag1)
+        self.recipe.tags.remove(self.tag1)
+        self.assertCounts(Tag, tag1=0, tag2=1)
+
+    def test_clear_and_set(self):
+        '''Test that clear and set adjust counts'''
+
+        self.recipe.tags.set([self.tag1, self.tag2])
+        self.recipe.tags.set([self.tag2])
+        self.assertCounts(Tag, tag1=0, tag2=1)
+        self.recipe.tags.clear()
+        self.assertCounts(Tag, tag1=0, tag2=0)
+
+    def test_reverse_relation(self):
+        '''Test changes made from the tag side'''
+
+        other = sample_recipe(self.user, title='Upma')
+        self.tag1.recipe_set.add(self.recipe, other)
+        self.assertCounts(Tag, tag1=2)
+        self.tag1.recipe_set.clear()
+        self.assertCounts(Tag, tag1=0)
+
+    def test_recipe_delete(self):
+        '''Test that deleting a recipe releases its counts'''
+
+        ingredient = Ingredient.objects.create(user=self.user, name='Salt')
+        self.recipe.tags.add(self.tag1)
+        self.recipe.ingredients.add(ingredient)
+        self.recipe.delete()
+        ingredient.refresh_from_db()
+        self.assertCounts(Tag, tag1=0)
+        self.assertEqual(ingredient.recipe_count, 0)
+
+    def test_reconcile_command(self):
+        '''Test that the reconcile command fixes drifted counts'''
+
+        self.recipe.tags.add(self.tag1)
+        Tag.objects.filter(pk=self.tag1.pk).update(recipe_count=7)
+        Tag.objects.filter(pk=self.tag2.pk).update(recipe_count=3)
+        out = StringIO()
+        call_command('reconcile_recipe_counts', stdout=out)
+        self.assertIn('Fixed 2 counts', out.getvalue())
+        self.assertCounts(Tag, tag1=1, tag2=0)
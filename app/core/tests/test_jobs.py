@@ -0,0 +1,190 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, Client
+from django.urls import reverse
+from django.utils import timezone
+from core import jobs
+from core.metrics import clear_metrics, render_metrics
+from core.models import Job
+
+
+calls = []
+
+
+@jobs.task('tests.record')
+def record(value):
+    calls.append(value)
+
+
+@jobs.task('tests.explode', max_attempts=2)
+def explode():
+    raise RuntimeError('boom')
+
+
+class JobQueueTests(TestCase):
+
+    def setUp(self):
+        calls.clear()
+        clear_metrics()
+
+    def test_run_queued_jobs(self):
+        '''Test that due jobs run once and are marked done'''
+
+        record.delay(value=1)
+        later = record.delay(run_at=timezone.now() + timedelta(hours=1),
+                             value=2)
+
+        processed = jobs.Worker().run(burst=True)
+
+        self.assertEqual(processed, 1)
+        self.assertEqual(calls, [1])
+        self.assertEqual(Job.objects.filter(status=Job.DONE).count(), 1)
+        later.refresh_from_db()
+        self.assertEqual(later.status, Job.QUEUED)
+
+    def test_claim_marks_running(self):
+        '''Test that a claimed job is not handed out twice'''
+
+        job = record.delay(value=1)
+        claimed = jobs.claim('worker-1', limit=5)
+
+        self.assertEqual([j.pk for j in claimed], [job.pk])
+        self.assertEqual(claimed[0].status, Job.RUNNING)
+        self.assertEqual(claimed[0].attempts, 1)
+        self.assertEqual(jobs.claim('worker-2'), [])
+
+    def test_failed_job_retried_then_failed(self):
+        '''Test backoff between attempts and failure after the last one'''
+
+        job = explode.delay()
+        jobs.Worker().run(burst=True)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn('RuntimeError: boom', job.last_error)
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        jobs.Worker().run(burst=True)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.attempts, 2)
+
+    def test_unknown_task_fails(self):
+        job = jobs.enqueue('tests.missing', max_attempts=1)
+        jobs.Worker().run(burst=True)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn('Unknown task', job.last_error)
+
+    def test_requeue_stalled(self):
+        '''Test that jobs of a dead worker are run again'''
+
+        job = record.delay(value=3)
+        jobs.claim('dead-worker')
+        Job.objects.filter(pk=job.pk).update(
+            locked_at=timezone.now() - timedelta(hours=1)
+        )
+
+        self.assertEqual(jobs.requeue_stalled(timeout=60), 1)
+        jobs.Worker().run(burst=True)
+        self.assertEqual(calls, [3])
+
+    def test_heartbeat_keeps_job(self):
+        '''Test that jobs with a recent heartbeat are not requeued'''
+
+        job = record.delay(value=3)
+        jobs.claim('busy-worker')
+        Job.objects.filter(pk=job.pk).update(
+            locked_at=timezone.now() - timedelta(hours=1)
+        )
+
+        self.assertEqual(jobs.heartbeat('other-worker', [job.pk]), 0)
+        self.assertEqual(jobs.heartbeat('busy-worker', [job.pk]), 1)
+        self.assertEqual(jobs.requeue_stalled(timeout=60), 0)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.RUNNING)
+
+    def test_stale_worker_outcome_dropped(self):
+        '''Test that a worker finishing a reclaimed job leaves it alone'''
+
+        job = record.delay(value=5)
+        stale = jobs.claim('slow-worker')[0]
+        Job.objects.filter(pk=job.pk).update(
+            locked_at=timezone.now() - timedelta(hours=1)
+        )
+        jobs.requeue_stalled(timeout=60)
+        jobs.claim('new-worker')
+
+        self.assertTrue(jobs.run_job(stale))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.RUNNING)
+        self.assertEqual(job.locked_by, 'new-worker')
+        self.assertEqual(job.attempts, 2)
+        self.assertIsNone(job.finished_at)
+
+    def test_poll_loop_requeues_stalled(self):
+        '''Test that a running worker picks up jobs of a dead worker'''
+
+        job = record.delay(value=4)
+        jobs.claim('dead-worker')
+        Job.objects.filter(pk=job.pk).update(
+            locked_at=timezone.now() - timedelta(hours=1)
+        )
+
+        with self.settings(JOBS_TIMEOUT=60):
+            jobs.Worker(heartbeat_interval=0).work(burst=True)
+
+        self.assertEqual(calls, [4])
+
+    def test_metrics_read_queue_once(self):
+        '''Test that scrapes share one reading of the queue stats'''
+
+        with mock.patch('core.jobs.queue_stats',
+                        wraps=jobs.queue_stats) as stats:
+            render_metrics()
+            output = render_metrics()
+
+        self.assertEqual(stats.call_count, 1)
+        self.assertIn('jobs_oldest_due_seconds', output)
+
+    def test_queue_depth_visible(self):
+        '''Test queue depth in the stats command and in /metrics'''
+
+        record.delay(value=1)
+        record.delay(value=2)
+        out = StringIO()
+        call_command('run_jobs', '--stats', stdout=out)
+        self.assertIn('queued: 2', out.getvalue())
+        self.assertIn('jobs{status="queued"} 2', render_metrics())
+
+    def test_run_jobs_command(self):
+        record.delay(value=1)
+        out = StringIO()
+        call_command('run_jobs', '--burst', stdout=out)
+        self.assertIn('Ran 1 jobs', out.getvalue())
+        self.assertEqual(calls, [1])
+
+    def test_admin_delete_users_queued(self):
+        '''Test that deleting users with their data runs in a job'''
+
+        user = get_user_model().objects.create_user(
+            'jobs@gmail.com', 'password123'
+        )
+        admin_user = get_user_model().objects.create_superuser(
+            'admin@gmail.com', 'admin123'
+        )
+        client = Client()
+        client.force_login(admin_user)
+        client.post(reverse('admin:core_user_changelist'), {
+            'action': 'delete_with_data',
+            '_selected_action': [user.id],
+        })
+        self.assertTrue(get_user_model().objects.filter(pk=user.pk).exists())
+
+        jobs.Worker().run(burst=True)
+        self.assertFalse(
+            get_user_model().objects.filter(pk=user.pk).exists()
+        )
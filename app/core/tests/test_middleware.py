@@ -0,0 +1,84 @@
+import os
+import tempfile
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from core import metrics
+
+
+TAGS_URL = reverse('recipe:tag-list')
+METRICS_URL = reverse('metrics')
+
+
+class RequestMetricsMiddlewareTests(TestCase):
+
+    def setUp(self):
+        metrics.clear_metrics()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'metrics@gmail.com',
+            'password123'
+        )
+        self.client.force_authenticate(self.user)
+
+    def test_server_timing_header(self):
+        '''Test that responses carry a Server-Timing header'''
+
+        res = self.client.get(TAGS_URL)
+        self.assertIn('total;dur=', res['Server-Timing'])
+        self.assertIn('db;dur=', res['Server-Timing'])
+
+    def test_metrics_recorded_per_route(self):
+        '''Test that request metrics are exposed per route'''
+
+        self.client.get(TAGS_URL)
+        res = self.client.get(METRICS_URL)
+        body = res.content.decode()
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(
+            'http_request_duration_seconds_count'
+            '{route="recipe:tag-list",method="GET"} 1',
+            body
+        )
+        self.assertIn('http_request_db_queries_bucket', body)
+
+    def test_metrics_of_workers_summed(self):
+        '''Test that a scrape sees the requests of every worker'''
+
+        with tempfile.TemporaryDirectory() as directory, \
+                self.settings(METRICS_DIR=directory):
+            self.client.get(TAGS_URL)
+            metrics.flush_metrics()
+            # Another worker wrote its file with the same request
+            os.rename(os.path.join(directory, f'{os.getpid()}.json'),
+                      os.path.join(directory, 'other.json'))
+            self.client.get(TAGS_URL)
+            body = self.client.get(METRICS_URL).content.decode()
+
+        self.assertIn(
+            'http_request_duration_seconds_count'
+            '{route="recipe:tag-list",method="GET"} 3',
+            body
+        )
+
+    @override_settings(METRICS_ALLOWED_IPS=['10.0.0.1'])
+    def test_metrics_forbidden_for_other_clients(self):
+        '''Test that only allowed addresses can scrape metrics'''
+
+        res = self.client.get(METRICS_URL)
+        self.assertEqual(res.status_code, 403)
+
+
+class HistogramTests(TestCase):
+
+    def test_observations_are_cumulative(self):
+        '''Test that bucket counts include all smaller observations'''
+
+        hist = metrics.Histogram('test_hist', 'Test.', (1, 5), ('route',))
+        hist.observe(0.5, route='a')
+        hist.observe(3, route='a')
+        output = hist.render()
+        self.assertIn('test_hist_bucket{route="a",le="1"} 1', output)
+        self.assertIn('test_hist_bucket{route="a",le="5"} 2', output)
+        self.assertIn('test_hist_count{route="a"} 2', output)
@@ -1,3 +1,4 @@
+from django.db import IntegrityError, transaction
 from django.test import TestCase
 from django.contrib.auth import get_user_model
 from core import models
@@ -55,6 +56,15 @@ class ModelTests(TestCase):
         )
         self.assertEqual(str(tag), tag.name)
 
+    def test_tag_normalized_name_unique(self):
+        '''Test that names differing in case and spaces clash per user'''
+
+        user = sample_user()
+        tag = models.Tag.objects.create(user=user, name='  Gluten  Free')
+        self.assertEqual(tag.normalized_name, 'gluten free')
+        with self.assertRaises(IntegrityError):
+            models.Tag.objects.create(user=user, name='GLUTEN FREE')
+
     def test_ingredient_str(self):
         '''Test the ingredient string representation'''
 
@@ -75,6 +85,27 @@ class ModelTests(TestCase):
         )
         self.assertEqual(str(recipe), recipe.title)
 
+    def test_recipe_stale_save_conflicts(self):
+        '''Test that saving an outdated copy of a recipe is refused'''
+
+        recipe = models.Recipe.objects.create(
+            user=sample_user(),
+            title='Dal',
+            time_minutes=5,
+            price=5.00,
+        )
+        stale = models.Recipe.objects.get(pk=recipe.pk)
+        recipe.title = 'Dal Tadka'
+        recipe.save()
+        self.assertEqual(recipe.version, 2)
+
+        stale.title = 'Dal Makhani'
+        with self.assertRaises(models.VersionConflict), \
+                transaction.atomic():
+            stale.save()
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.title, 'Dal Tadka')
+
     @patch('uuid.uuid4')
     def test_recipe_filename_uuid(self, mock_uuid):
         '''Test that image is saved correctly'''
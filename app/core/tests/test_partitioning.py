@@ -0,0 +1,164 @@
+from io import StringIO
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from core import bulk, partitioning
+from core.models import Recipe, Tag, Ingredient, IngredientQuantity
+
+
+class BuildStatementsTests(SimpleTestCase):
+
+    def setUp(self):
+        self.tables = [
+            ('core_recipe', 'user_id', {
+                'indexes': [
+                    'CREATE INDEX core_recipe_user_id ON core_recipe '
+                    'USING btree (user_id)',
+                ],
+                'constraints': [
+                    ('core_recipe_user_id_fk',
+                     'FOREIGN KEY (user_id) REFERENCES core_user(id)'),
+                ],
+                'sequence': 'core_recipe_id_seq',
+            }),
+            ('core_recipe_tags', 'recipe_id', {
+                'indexes': [],
+                'constraints': [
+                    ('core_recipe_tags_uniq', 'UNIQUE (recipe_id, tag_id)'),
+                ],
+                'sequence': 'core_recipe_tags_id_seq',
+            }),
+        ]
+
+    def test_partitions_created(self):
+        '''Test that each table gets its hash partitions'''
+
+        statements = partitioning.build_statements(self.tables, 4)
+
+        self.assertIn(
+            'CREATE TABLE core_recipe (LIKE core_recipe_unpartitioned '
+            'INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+            'PARTITION BY HASH (user_id)', statements
+        )
+        partitions = [s for s in statements
+                      if s.startswith('CREATE TABLE core_recipe_p')]
+        self.assertEqual(len(partitions), 4)
+        self.assertIn('FOR VALUES WITH (MODULUS 4, REMAINDER 3)',
+                      partitions[-1])
+        self.assertIn('ALTER TABLE core_recipe_tags ADD PRIMARY KEY '
+                      '(id, recipe_id)', statements)
+
+    def test_order(self):
+        '''Test rows are copied before keys, and old tables dropped first'''
+
+        statements = partitioning.build_statements(self.tables, 2)
+
+        self.assertTrue(statements[0].startswith('LOCK TABLE'))
+        copy = statements.index(
+            'INSERT INTO core_recipe SELECT * FROM core_recipe_unpartitioned'
+        )
+        drop_through = statements.index(
+            'DROP TABLE core_recipe_tags_unpartitioned'
+        )
+        drop_recipe = statements.index('DROP TABLE core_recipe_unpartitioned')
+        index = statements.index(self.tables[0][2]['indexes'][0])
+        self.assertLess(copy, drop_through)
+        self.assertLess(drop_through, drop_recipe)
+        self.assertLess(drop_recipe, index)
+        self.assertIn('ALTER SEQUENCE core_recipe_id_seq OWNED BY '
+                      'core_recipe.id', statements[copy + 1])
+        self.assertIn(
+            'ALTER TABLE core_recipe_tags ADD CONSTRAINT '
+            'core_recipe_tags_uniq UNIQUE (recipe_id, tag_id)', statements
+        )
+
+
+class PartitionCommandTests(TestCase):
+
+    def test_needs_postgres(self):
+        if partitioning.is_supported():
+            self.skipTest('Partitioning is supported here')
+        with self.assertRaisesMessage(CommandError, 'PostgreSQL 11'):
+            call_command('partition_recipes', '--sql')
+
+    def test_partition_count_checked(self):
+        with self.assertRaisesMessage(CommandError, 'at least 2'):
+            call_command('partition_recipes', '--partitions', '1')
+
+
+class PartitionTablesTests(TestCase):
+    '''Runs the conversion against the test database
+
+    The DDL runs inside the test transaction, so the tables are back to
+    normal once the test rolls back.
+    '''
+
+    def setUp(self):
+        if not partitioning.is_supported():
+            self.skipTest('Needs PostgreSQL 11+')
+        self.user = get_user_model().objects.create_user(
+            'partition@gmail.com', 'password123'
+        )
+        self.tag = Tag.objects.create(user=self.user, name='Vegan')
+        self.ingredient = Ingredient.objects.create(user=self.user,
+                                                    name='Flour')
+        self.recipe = Recipe.objects.create(user=self.user, title='Bread',
+                                            time_minutes=60, price=3)
+        self.recipe.tags.add(self.tag)
+        self.recipe.ingredients.add(self.ingredient)
+        IngredientQuantity.objects.create(
+            recipe=self.recipe, ingredient=self.ingredient, quantity=500,
+            unit='g',
+        )
+
+    def partition(self):
+        call_command('partition_recipes', '--partitions', '4',
+                     stdout=StringIO())
+
+    def test_rows_kept(self):
+        '''Test that the tables are partitioned with their rows'''
+
+        self.partition()
+
+        with connection.cursor() as cursor:
+            for table, _key in partitioning.partitioned_tables():
+                self.assertTrue(partitioning.is_partitioned(cursor, table))
+        recipe = Recipe.objects.get(pk=self.recipe.pk)
+        self.assertEqual(list(recipe.tags.all()), [self.tag])
+        self.assertEqual(list(recipe.ingredients.all()), [self.ingredient])
+        self.assertEqual(recipe.quantities.get().unit, 'g')
+
+    def test_writes_after_partitioning(self):
+        '''Test that the ORM and core.bulk work on partitioned tables'''
+
+        self.partition()
+
+        soup = Recipe.objects.create(user=self.user, title='Soup',
+                                     time_minutes=5, price=1)
+        soup.tags.add(self.tag)
+        self.assertGreater(soup.pk, self.recipe.pk)
+        soup.tags.remove(self.tag)
+        self.assertEqual(bulk.delete_recipes(
+            Recipe.objects.filter(pk__in=[soup.pk, self.recipe.pk])
+        ), 2)
+        self.assertFalse(Recipe.tags.through.objects.exists())
+        self.assertFalse(IngredientQuantity.objects.exists())
+
+    def test_user_queries_pruned(self):
+        '''Test that filtering on the owner scans a single partition'''
+
+        self.partition()
+
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN SELECT * FROM core_recipe '
+                           'WHERE user_id = %s', [self.user.pk])
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+        self.assertEqual(plan.count('core_recipe_p'), 1)
+
+    def test_runs_once(self):
+        self.partition()
+
+        with self.assertRaisesMessage(CommandError, 'Already partitioned'):
+            self.partition()
@@ -0,0 +1,82 @@
+import logging
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from core.models import Tag
+from core.queries import QueryInspector, normalize_sql
+from core.testing import QueryAssertionsMixin
+
+
+TAGS_URL = reverse('recipe:tag-list')
+
+
+class QueryInspectorTests(QueryAssertionsMixin, TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'queries@gmail.com',
+            'password123'
+        )
+
+    def test_normalize_sql(self):
+        '''Test that literals and IN lists are normalized away'''
+
+        self.assertEqual(
+            normalize_sql("SELECT * FROM t WHERE a = 'x' AND b IN (%s, %s)"),
+            normalize_sql("SELECT * FROM t WHERE a = 'y' AND b IN (%s)"),
+        )
+
+    def test_repeated_queries_detected(self):
+        '''Test that structurally identical queries are flagged'''
+
+        inspector = QueryInspector()
+        with inspector.capture():
+            for name in ('Vegan', 'Dessert', 'Lunch'):
+                Tag.objects.filter(name=name).exists()
+        duplicates = inspector.duplicates()
+        self.assertEqual(len(duplicates), 1)
+        self.assertEqual(duplicates[0][1], 3)
+
+    def test_slow_queries_detected(self):
+        '''Test that queries over the time threshold are flagged'''
+
+        inspector = QueryInspector(slow_query_ms=0)
+        with inspector.capture():
+            Tag.objects.count()
+        self.assertEqual(len(inspector.slow_queries()), 1)
+
+    def test_assert_max_queries_fails_on_repeats(self):
+        '''Test that assertMaxQueries fails on an N+1 pattern'''
+
+        with self.assertRaises(AssertionError):
+            with self.assertMaxQueries(10):
+                for name in ('Vegan', 'Dessert'):
+                    Tag.objects.filter(name=name).exists()
+
+    def test_assert_max_queries_fails_over_budget(self):
+        '''Test that assertMaxQueries fails when over the budget'''
+
+        with self.assertRaises(AssertionError):
+            with self.assertMaxQueries(1, allow_duplicates=True):
+                Tag.objects.count()
+                Tag.objects.count()
+
+
+class QueryInspectionMiddlewareTests(TestCase):
+
+    @override_settings(
+        QUERY_INSPECTION_ENABLED=True,
+        QUERY_INSPECTION_SLOW_QUERY_MS=0,
+    )
+    def test_problems_logged(self):
+        '''Test that the middleware logs query problems'''
+
+        client = APIClient()
+        user = get_user_model().objects.create_user(
+            'staging@gmail.com',
+            'password123'
+        )
+        client.force_authenticate(user)
+        with self.assertLogs('core.middleware', level=logging.WARNING):
+            client.get(TAGS_URL)
@@ -0,0 +1,115 @@
+from unittest.mock import patch
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase, RequestFactory, override_settings
+from rest_framework.authtoken.models import Token
+from core import replicas
+from core.middleware import ReplicaRoutingMiddleware
+from core.models import Recipe
+
+
+@override_settings(REPLICA_DATABASES=['replica'], REPLICA_MAX_LAG_SECONDS=5,
+                   REPLICA_LAG_CHECK_SECONDS=60, REPLICA_PIN_SECONDS=10)
+class ReplicaRoutingTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        replicas.clear_lag_checks()
+        patcher = patch('core.replicas.measure_lag', return_value=0.0)
+        self.measure_lag = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(replicas.clear_lag_checks)
+        self.factory = RequestFactory()
+
+    def route(self, request):
+        '''Return the database reads went to while serving the request'''
+
+        seen = {}
+
+        def get_response(request):
+            seen['db'] = Recipe.objects.all().db
+            return 'response'
+
+        ReplicaRoutingMiddleware(get_response)(request)
+        return seen['db']
+
+    def test_reads_outside_requests_use_primary(self):
+        self.assertEqual(Recipe.objects.all().db, 'default')
+
+    def test_safe_request_reads_from_replica(self):
+        request = self.factory.get('/api/recipe/recipes/',
+                                   HTTP_AUTHORIZATION='Token abc')
+        self.assertEqual(self.route(request), 'replica')
+
+    def test_write_switches_to_primary(self):
+        '''Test that reads after a write in a block see the write'''
+
+        with replicas.read_from_replicas():
+            self.assertEqual(Recipe.objects.all().db, 'replica')
+            Recipe.objects.select_for_update().db
+            self.assertEqual(Recipe.objects.all().db, 'default')
+        self.assertEqual(Recipe.objects.all().db, 'default')
+
+    def test_client_pinned_after_write(self):
+        '''Test that a client reads from the primary after writing'''
+
+        self.route(self.factory.post('/api/recipe/recipes/',
+                                     HTTP_AUTHORIZATION='Token abc'))
+
+        own = self.factory.get('/api/recipe/recipes/',
+                               HTTP_AUTHORIZATION='Token abc')
+        other = self.factory.get('/api/recipe/recipes/',
+                                 HTTP_AUTHORIZATION='Token xyz')
+        self.assertEqual(self.route(own), 'default')
+        self.assertEqual(self.route(other), 'replica')
+
+    def test_lagging_replica_skipped(self):
+        '''Test that reads fall back to the primary when replicas lag'''
+
+        self.measure_lag.return_value = 30.0
+        self.assertEqual(self.route(self.factory.get('/')), 'default')
+
+    def test_unreachable_replica_skipped(self):
+        self.measure_lag.return_value = None
+        self.assertEqual(self.route(self.factory.get('/')), 'default')
+
+    def test_lag_checked_once_per_interval(self):
+        with replicas.read_from_replicas():
+            Recipe.objects.all().db
+            Recipe.objects.all().db
+        self.assertEqual(self.measure_lag.call_count, 1)
+
+    def test_anonymous_write_then_read(self):
+        '''Test that a token created a moment ago is found on the primary'''
+
+        with replicas.read_from_replicas():
+            self.assertEqual(Token.objects.all().db, 'default')
+            self.assertEqual(get_user_model().objects.all().db, 'default')
+            self.assertEqual(Recipe.objects.all().db, 'replica')
+
+    def test_cache_keeps_replica_reads(self):
+        '''Test that cache queries go to the primary and end nothing'''
+
+        with replicas.read_from_replicas():
+            cache.set('key', 'value')
+            self.assertEqual(cache.get('key'), 'value')
+            self.assertEqual(Recipe.objects.all().db, 'replica')
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }})
+    def test_local_cache_refused(self):
+        '''Test that pins in a per process cache are not accepted'''
+
+        with self.assertRaises(ImproperlyConfigured):
+            ReplicaRoutingMiddleware(lambda request: 'response')
+
+    @override_settings(REPLICA_DATABASES=[])
+    def test_no_replicas(self):
+        self.assertEqual(self.route(self.factory.get('/')), 'default')
+
+    def test_migrations_skip_replicas(self):
+        router = replicas.ReplicaRouter()
+        self.assertFalse(router.allow_migrate('replica', 'core'))
+        self.assertTrue(router.allow_migrate('default', 'core'))
@@ -0,0 +1,77 @@
+import random
+from io import StringIO
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from core.catalog import clear_catalog_cache
+from core.models import Change, CatalogTag, SimilarityBand, Tag, Recipe
+from core.seeding import zipf_cum_weights, zipf_sample
+
+
+class SeedDataTests(TestCase):
+
+    def test_zipf_sample_prefers_low_ranks(self):
+        '''Test that Zipf sampling favours the most popular items'''
+
+        rng = random.Random(0)
+        weights = zipf_cum_weights(20, 1.5)
+        hits = [0] * 20
+        for _ in range(1000):
+            for index in zipf_sample(rng, weights, 1):
+                hits[index] += 1
+        self.assertGreater(hits[0], hits[10] * 5)
+
+    def test_seed_data_command(self):
+        '''Test seeding users with recipes, tags and ingredients'''
+
+        call_command(
+            'seed_data', users=5, recipes=4, tags=3, ingredients=5,
+            batch_size=2, library_skew=0, stdout=StringIO(),
+        )
+        users = get_user_model().objects.filter(
+            email__endswith='@seed.example.com'
+        )
+        self.assertEqual(users.count(), 5)
+        self.assertEqual(Tag.objects.count(), 15)
+        self.assertEqual(Recipe.objects.count(), 20)
+        self.assertTrue(users.first().check_password('password123'))
+        recipe = Recipe.objects.first()
+        self.assertEqual(recipe.tags.count(), 3)
+        self.assertEqual(recipe.tags.first().user_id, recipe.user_id)
+
+    def test_seed_data_side_effects(self):
+        '''Test that seeding fills what the skipped signals maintain'''
+
+        CatalogTag.objects.create(name='Vegan')
+        clear_catalog_cache()
+        self.addCleanup(clear_catalog_cache)
+        call_command(
+            'seed_data', users=2, recipes=3, tags=2, ingredients=2,
+            library_skew=0, stdout=StringIO(),
+        )
+
+        self.assertEqual(Change.objects.filter(kind=Change.TAG).count(), 4)
+        self.assertEqual(
+            Change.objects.filter(kind=Change.INGREDIENT).count(), 4
+        )
+        self.assertEqual(
+            Change.objects.filter(kind=Change.RECIPE).count(), 6
+        )
+        self.assertEqual(
+            Tag.objects.filter(canonical__name='Vegan').count(), 2
+        )
+        self.assertEqual(
+            Tag.objects.filter(canonical__isnull=True).count(), 2
+        )
+        self.assertEqual(
+            SimilarityBand.objects.values('recipe_id').distinct().count(), 6
+        )
+
+    def test_seed_data_appends(self):
+        '''Test that running the command twice adds new users'''
+
+        for _ in range(2):
+            call_command(
+                'seed_data', users=2, recipes=1, stdout=StringIO()
+            )
+        self.assertEqual(get_user_model().objects.count(), 4)
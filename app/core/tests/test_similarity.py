@@ -0,0 +1,114 @@
+import json
+from io import StringIO
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from core import bulk, jobs, similarity
+from core.models import Tag, Ingredient, Recipe, SimilarityBand, Job
+
+
+class SimilarityTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'similar@gmail.com', 'password123'
+        )
+        self.tags = [Tag.objects.create(user=self.user, name=f'Tag {i}')
+                     for i in range(4)]
+        self.ingredients = [
+            Ingredient.objects.create(user=self.user, name=f'Ingredient {i}')
+            for i in range(6)
+        ]
+
+    def recipe(self, tags=(), ingredients=()):
+        recipe = Recipe.objects.create(user=self.user, title='Soup',
+                                       time_minutes=10, price=5)
+        recipe.tags.add(*[self.tags[i] for i in tags])
+        recipe.ingredients.add(*[self.ingredients[i] for i in ingredients])
+        return recipe
+
+    def test_buckets_deterministic(self):
+        '''Test that equal sets share every bucket and disjoint ones none'''
+
+        first = similarity.buckets({2, 4, 7})
+        self.assertEqual(len(first), similarity.NUM_BANDS)
+        self.assertEqual(first, similarity.buckets({7, 4, 2}))
+        self.assertFalse(set(first) & set(similarity.buckets({10, 13})))
+        self.assertEqual(similarity.buckets(set()), [])
+
+    def test_similar_recipes_ranked(self):
+        '''Test that candidates are found by bucket and scored exactly'''
+
+        source = self.recipe(tags=[0], ingredients=[0, 1, 2])
+        close = self.recipe(tags=[0], ingredients=[0, 1, 2, 3])
+        far = self.recipe(tags=[1], ingredients=[4, 5])
+        similarity.refresh_bands([source.pk, close.pk, far.pk])
+        source = Recipe.objects.prefetch_related('tags', 'ingredients') \
+            .get(pk=source.pk)
+
+        result = similarity.similar_recipes(source)
+
+        self.assertEqual(result, [(close.pk, 0.8)])
+        cosine = similarity.similar_recipes(source, metric='cosine')
+        self.assertAlmostEqual(cosine[0][1], 4 / (4 * 5) ** 0.5)
+
+    def test_links_queue_refresh(self):
+        '''Test that relinking a recipe refreshes its bands in a job'''
+
+        recipe = self.recipe(tags=[0, 1])
+        self.assertFalse(SimilarityBand.objects.exists())
+        self.assertTrue(Job.objects.filter(
+            name='core.refresh_similarity'
+        ).exists())
+
+        jobs.Worker().run(burst=True)
+        self.assertEqual(
+            SimilarityBand.objects.filter(recipe=recipe).count(),
+            similarity.NUM_BANDS,
+        )
+
+    def test_deleted_recipes_lose_bands(self):
+        recipe = self.recipe(ingredients=[0])
+        similarity.refresh_bands([recipe.pk])
+        bulk.delete_recipes(Recipe.objects.filter(pk=recipe.pk))
+        self.assertFalse(SimilarityBand.objects.exists())
+
+    def test_soft_deleted_recipes_lose_bands(self):
+        recipe = self.recipe(ingredients=[0])
+        similarity.refresh_bands([recipe.pk])
+        bulk.soft_delete_recipe(recipe)
+        self.assertFalse(SimilarityBand.objects.exists())
+
+    def test_bulk_relinks_queue_refresh(self):
+        '''Test that merges and tag deletes refresh the relinked recipes'''
+
+        self.recipe(tags=[0])
+        second = self.recipe(tags=[1], ingredients=[2])
+        jobs.Worker().run(burst=True)
+
+        bulk.merge_into(self.tags[0], [self.tags[1]])
+        self.ingredients[2].delete()
+        payloads = Job.objects.filter(
+            name='core.refresh_similarity', status=Job.QUEUED
+        ).values_list('payload', flat=True)
+        self.assertEqual(
+            sorted(json.loads(payload)['recipe_ids'] for payload in payloads),
+            [[second.pk], [second.pk]],
+        )
+
+        jobs.Worker().run(burst=True)
+        self.assertEqual(
+            set(SimilarityBand.objects.filter(recipe=second)
+                .values_list('bucket', flat=True)),
+            set(similarity.buckets({self.tags[0].pk * 2})),
+        )
+
+    def test_refresh_command(self):
+        for _ in range(3):
+            self.recipe(tags=[0], ingredients=[1])
+        self.recipe()
+        out = StringIO()
+        call_command('refresh_similarity', '--batch-size', '2', stdout=out)
+        self.assertIn('Refreshed 4 recipes', out.getvalue())
+        self.assertEqual(SimilarityBand.objects.count(),
+                         3 * similarity.NUM_BANDS)
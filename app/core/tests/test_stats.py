@@ -0,0 +1,72 @@
+from decimal import Decimal
+from io import StringIO
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from core import stats
+from core.models import Recipe, RecipeStats
+
+
+def sample_recipe(user, time_minutes=10, price='4.50'):
+    return Recipe.objects.create(
+        user=user, title='Poha', time_minutes=time_minutes,
+        price=Decimal(price)
+    )
+
+
+class RecipeStatsTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'stats@gmail.com',
+            'password123'
+        )
+
+    def assertSummaryMatchesLive(self):
+        self.assertEqual(
+            stats.read_recipe_stats(self.user.id),
+            stats.compute_recipe_stats(self.user.id),
+        )
+
+    def test_price_bucket(self):
+        '''Test mapping prices to distribution buckets'''
+
+        self.assertEqual(stats.price_bucket(Decimal('0.50')), 0)
+        self.assertEqual(stats.price_bucket(Decimal('5')), 1)
+        self.assertEqual(stats.price_bucket(Decimal('999')), 7)
+
+    def test_summary_follows_create_update_delete(self):
+        '''Test that the summary tables track recipe changes'''
+
+        recipe = sample_recipe(self.user)
+        sample_recipe(self.user, time_minutes=30, price='60.00')
+        self.assertSummaryMatchesLive()
+
+        recipe.price = Decimal('150.00')
+        recipe.time_minutes = 50
+        recipe.save()
+        self.assertSummaryMatchesLive()
+
+        recipe.delete()
+        self.assertSummaryMatchesLive()
+        result = stats.read_recipe_stats(self.user.id)
+        self.assertEqual(result['recipe_count'], 1)
+        self.assertEqual(result['average_time_minutes'], 30)
+        self.assertEqual(result['average_price'], Decimal('60.00'))
+
+    def test_user_delete(self):
+        '''Test that deleting a user with recipes removes the summary'''
+
+        sample_recipe(self.user)
+        self.user.delete()
+        self.assertFalse(RecipeStats.objects.exists())
+
+    def test_refresh_command(self):
+        '''Test rebuilding the summary after bulk changes'''
+
+        sample_recipe(self.user)
+        Recipe.objects.update(price=Decimal('300.00'))
+        out = StringIO()
+        call_command('refresh_recipe_stats', stdout=out)
+        self.assertIn('Refreshed stats of 1 users', out.getvalue())
+        self.assertSummaryMatchesLive()
@@ -0,0 +1,167 @@
+import threading
+from unittest import skipUnless
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from core import throttling
+
+
+TAGS_URL = reverse('recipe:tag-list')
+SHOPPING_URL = reverse('recipe:recipe-shopping-list')
+
+RATES = {
+    'read': '2/min',
+    'write': '1/min',
+    'upload': '1/min',
+    'bulk': '1/min',
+}
+
+
+class CounterStoreTests(TestCase):
+
+    def test_bucket_refills_over_time(self):
+        '''Test that an empty bucket refills with elapsed time'''
+
+        store = throttling.LocalMemoryCounterStore()
+        self.assertIsNone(store.consume('k', 2, 60, now=0))
+        self.assertIsNone(store.consume('k', 2, 60, now=0))
+        self.assertAlmostEqual(store.consume('k', 2, 60, now=0), 30)
+        self.assertIsNone(store.consume('k', 2, 60, now=30))
+
+    def test_idle_buckets_expire(self):
+        '''Test that buckets are forgotten once their ttl passed'''
+
+        store = throttling.LocalMemoryCounterStore()
+        store.sweep_interval = 0
+        store.set('idle', (0, 0), 0)
+        self.assertIsNone(store.get('idle'))
+        store.set('busy', (1, 0), 60)
+        self.assertEqual(list(store._buckets), ['busy'])
+        self.assertEqual(store.get('busy'), (1, 0))
+
+    def test_cache_store_shared_by_workers(self):
+        '''Test that workers count against the same limit'''
+
+        worker1 = throttling.CacheCounterStore()
+        worker2 = throttling.CacheCounterStore()
+        self.assertIsNone(worker1.consume('k', 2, 60, now=0))
+        self.assertIsNone(worker2.consume('k', 2, 60, now=0))
+        self.assertAlmostEqual(worker1.consume('k', 2, 60, now=0), 60)
+        # Half of the previous window still counts
+        self.assertAlmostEqual(worker2.consume('k', 2, 60, now=60), 30)
+        self.assertIsNone(worker2.consume('k', 2, 60, now=90))
+
+    def test_cache_store_clear_seen_by_workers(self):
+        '''Test that clearing the cache store only drops its buckets'''
+
+        worker1 = throttling.CacheCounterStore()
+        worker2 = throttling.CacheCounterStore()
+        cache.set('unrelated', 1)
+        worker1.consume('k', 1, 60, now=0)
+        worker2.clear()
+
+        self.assertIsNone(worker1.consume('k', 1, 60, now=0))
+        self.assertEqual(cache.get('unrelated'), 1)
+
+    def test_parse_rate(self):
+        '''Test parsing of rate strings'''
+
+        self.assertEqual(throttling.parse_rate('10/min'), (10, 60))
+        self.assertEqual(throttling.parse_rate(None), (None, None))
+
+
+@skipUnless(connection.vendor == 'postgresql', 'needs row locks')
+class CacheCounterStoreConcurrencyTests(TransactionTestCase):
+
+    def test_concurrent_requests_counted_once(self):
+        '''Test that concurrent workers don't overwrite each other's counts'''
+
+        allowed = []
+
+        def request():
+            try:
+                store = throttling.CacheCounterStore()
+                if store.consume('k', 5, 3600, now=0) is None:
+                    allowed.append(1)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=request) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(allowed), 5)
+
+
+class ThrottleAPITests(TestCase):
+
+    def setUp(self):
+        throttling.get_counter_store().clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'throttle@gmail.com',
+            'password123'
+        )
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self):
+        throttling.get_counter_store().clear()
+
+    @override_settings(REST_FRAMEWORK={'DEFAULT_THROTTLE_RATES': RATES})
+    def test_read_scope_throttled_with_retry_after(self):
+        '''Test that exceeding the read rate returns 429 and Retry-After'''
+
+        self.client.get(TAGS_URL)
+        self.client.get(TAGS_URL)
+        res = self.client.get(TAGS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', res)
+
+    @override_settings(REST_FRAMEWORK={'DEFAULT_THROTTLE_RATES': RATES})
+    def test_scopes_are_separate(self):
+        '''Test that write requests do not use up the read bucket'''
+
+        self.client.post(TAGS_URL, {'name': 'Vegan'})
+        res_write = self.client.post(TAGS_URL, {'name': 'Dessert'})
+        res_read = self.client.get(TAGS_URL)
+
+        self.assertEqual(
+            res_write.status_code,
+            status.HTTP_429_TOO_MANY_REQUESTS
+        )
+        self.assertEqual(res_read.status_code, status.HTTP_200_OK)
+
+    @override_settings(REST_FRAMEWORK={
+        'DEFAULT_THROTTLE_RATES': {'endpoint_read': '1/min'},
+    })
+    def test_endpoint_throttle_shared_between_users(self):
+        '''Test that the endpoint throttle counts all users together'''
+
+        user2 = get_user_model().objects.create_user(
+            'other@gmail.com',
+            'password123'
+        )
+        self.client.get(TAGS_URL)
+        self.client.force_authenticate(user2)
+        res = self.client.get(TAGS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    @override_settings(REST_FRAMEWORK={'DEFAULT_THROTTLE_RATES': RATES})
+    def test_bulk_scope(self):
+        '''Test that endpoints reading many recipes use the bulk bucket'''
+
+        self.client.get(SHOPPING_URL, {'recipes': '1'})
+        res_bulk = self.client.get(SHOPPING_URL, {'recipes': '1'})
+        res_read = self.client.get(TAGS_URL)
+
+        self.assertEqual(res_bulk.status_code,
+                         status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(res_read.status_code, status.HTTP_200_OK)
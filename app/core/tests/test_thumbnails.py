@@ -0,0 +1,156 @@
+import os
+import shutil
+import tempfile
+from unittest.mock import patch
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+from core import jobs, thumbnails
+from core.models import Job
+
+
+def thumbnail_url(name, size=64):
+    return reverse('thumbnail', kwargs={'size': size, 'name': name})
+
+
+class ThumbnailTests(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.thumb_root = tempfile.mkdtemp()
+        self.settings = override_settings(
+            MEDIA_ROOT=self.media_root,
+            THUMBNAIL_ROOT=self.thumb_root,
+            THUMBNAIL_SIZES=(64, 128),
+        )
+        self.settings.enable()
+        self.name = 'uploads/recipe/poha.jpg'
+        os.makedirs(os.path.join(self.media_root, 'uploads/recipe'))
+        Image.new('RGB', (400, 200)).save(
+            os.path.join(self.media_root, self.name), format='JPEG'
+        )
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.media_root)
+        shutil.rmtree(self.thumb_root)
+
+    def test_thumbnail_generated_once(self):
+        '''Test that the resized image is written to the cache and reused'''
+
+        res = self.client.get(thumbnail_url(self.name))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res['Content-Type'], 'image/jpeg')
+        self.assertIn('max-age=31536000', res['Cache-Control'])
+        path = thumbnails.thumbnail_path(self.name, 64)
+        with Image.open(path) as image:
+            self.assertEqual(image.size, (64, 32))
+        b''.join(res.streaming_content)
+        res.close()
+
+        mtime = os.stat(path).st_mtime_ns
+        os.utime(path, ns=(0, 0))
+        res = self.client.get(thumbnail_url(self.name))
+        res.close()
+        self.assertNotEqual(os.stat(path).st_mtime_ns, 0)
+        self.assertGreaterEqual(os.stat(path).st_mtime_ns, mtime)
+
+    def test_cache_hit_not_opened(self):
+        '''Test that hits take the content type from the file name'''
+
+        self.client.get(thumbnail_url(self.name)).close()
+        with patch('core.thumbnails.Image.open') as image_open:
+            res = self.client.get(thumbnail_url(self.name))
+            res.close()
+        image_open.assert_not_called()
+        self.assertEqual(res['Content-Type'], 'image/jpeg')
+
+    def test_evicted_after_touch(self):
+        '''Test that a thumbnail evicted during a hit is generated again'''
+
+        self.client.get(thumbnail_url(self.name)).close()
+        path = thumbnails.thumbnail_path(self.name, 64)
+        utime = os.utime
+
+        def touch_and_evict(target, *args, **kwargs):
+            utime(target, *args, **kwargs)
+            os.unlink(target)
+
+        with patch('core.thumbnails.os.utime', side_effect=touch_and_evict):
+            res = self.client.get(thumbnail_url(self.name))
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(b''.join(res.streaming_content))
+        res.close()
+        self.assertTrue(os.path.exists(path))
+
+    def test_format_from_name(self):
+        '''Test that thumbnails keep known formats and fall back to JPEG'''
+
+        self.assertEqual(thumbnails.thumbnail_format('a/b.PNG'), 'PNG')
+        self.assertEqual(thumbnails.thumbnail_format('a/b.jpeg'), 'JPEG')
+        self.assertEqual(thumbnails.thumbnail_format('a/b.bmp'), 'JPEG')
+
+    def test_not_modified(self):
+        '''Test that a matching If-None-Match gets 304 without a body'''
+
+        res = self.client.get(thumbnail_url(self.name))
+        res.close()
+        res = self.client.get(thumbnail_url(self.name),
+                              HTTP_IF_NONE_MATCH=res['ETag'])
+        self.assertEqual(res.status_code, 304)
+        self.assertIn('ETag', res)
+
+    def test_invalid_requests(self):
+        '''Test unknown sizes, missing files and path traversal'''
+
+        for url in (
+            thumbnail_url(self.name, size=100),
+            thumbnail_url('uploads/recipe/missing.jpg'),
+            thumbnail_url('../etc/passwd'),
+        ):
+            self.assertEqual(self.client.get(url).status_code, 404, url)
+
+    @override_settings(THUMBNAIL_ACCEL_REDIRECT='/protected-thumbs/')
+    def test_accel_redirect(self):
+        '''Test that nginx is asked to send the file when configured'''
+
+        res = self.client.get(thumbnail_url(self.name, size=128))
+        self.assertEqual(res['X-Accel-Redirect'],
+                         '/protected-thumbs/128/' + self.name)
+        self.assertEqual(res.content, b'')
+
+    def test_evict_least_recently_used(self):
+        '''Test that the oldest thumbnails go first when over the cap'''
+
+        old = thumbnails.generate(self.name, 64)
+        new = thumbnails.generate(self.name, 128)
+        os.utime(old, (1, 1))
+
+        self.assertEqual(thumbnails.evict(os.path.getsize(new)), 1)
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
+
+    def test_eviction_queued_when_full(self):
+        '''Test that requests only count bytes and a job evicts'''
+
+        old = thumbnails.generate(self.name, 64)
+        os.utime(old, (1, 1))
+        thumbnails.evict()
+        limit = os.path.getsize(old) + 1
+
+        with override_settings(THUMBNAIL_CACHE_MAX_BYTES=limit), \
+                patch('core.thumbnails.os.walk') as walk:
+            new = thumbnails.generate(self.name, 128)
+            thumbnails.generate(self.name, 128)
+        walk.assert_not_called()
+        self.assertTrue(os.path.exists(old))
+        self.assertEqual(
+            Job.objects.filter(name='core.evict_thumbnails').count(), 1
+        )
+
+        with override_settings(
+                THUMBNAIL_CACHE_MAX_BYTES=os.path.getsize(new)):
+            jobs.Worker().run(burst=True)
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
@@ -0,0 +1,249 @@
+import threading
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.db import BaseDatabaseCache
+from django.db import connections, router, transaction
+from django.utils.module_loading import import_string
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+
+DEFAULT_COUNTER_STORE = 'core.throttling.LocalMemoryCounterStore'
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def parse_rate(rate):
+    '''Turn a rate string like "100/min" into (requests, seconds)'''
+
+    if rate is None:
+        return None, None
+    num, period = rate.split('/')
+    duration = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}[period[0]]
+    return int(num), duration
+
+
+def get_counter_store():
+    '''Return the process wide counter store configured in settings'''
+
+    path = getattr(settings, 'THROTTLE_COUNTER_STORE', DEFAULT_COUNTER_STORE)
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = import_string(path)()
+        return _stores[path]
+
+
+class BaseCounterStore:
+    '''Keeps token bucket state as (tokens, last refill time) per key
+
+    Stores that can't lock around get and set override consume().
+    '''
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, state, ttl):
+        raise NotImplementedError
+
+    def lock(self):
+        raise NotImplementedError
+
+    def consume(self, key, capacity, duration, now):
+        '''Take one token from the bucket, return seconds to wait if empty'''
+
+        refill_rate = capacity / duration
+        with self.lock():
+            tokens, last = self.get(key) or (capacity, now)
+            tokens = min(capacity, tokens + (now - last) * refill_rate)
+            if tokens >= 1:
+                self.set(key, (tokens - 1, now), duration)
+                return None
+            self.set(key, (tokens, now), duration)
+            return (1 - tokens) / refill_rate
+
+
+class LocalMemoryCounterStore(BaseCounterStore):
+    '''Counter store for a single process, buckets live in a dict
+
+    Buckets idle for longer than their ttl are full again anyway, they
+    are dropped at most every sweep_interval seconds.
+    '''
+
+    sweep_interval = 60
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._swept = time.monotonic()
+
+    def get(self, key):
+        state, expires = self._buckets.get(key, (None, None))
+        if expires is not None and expires <= time.monotonic():
+            return None
+        return state
+
+    def set(self, key, state, ttl):
+        now = time.monotonic()
+        if now - self._swept >= self.sweep_interval:
+            self._buckets = {
+                bucket: value for bucket, value in self._buckets.items()
+                if value[1] > now
+            }
+            self._swept = now
+        self._buckets[key] = (state, now + ttl)
+
+    def lock(self):
+        return self._lock
+
+    def clear(self):
+        self._buckets.clear()
+
+
+class CacheCounterStore(BaseCounterStore):
+    '''Counter store shared by all workers through a Django cache backend
+
+    Not every backend can make a read and a write of a bucket atomic, so
+    the bucket is approximated with request counters per window of the
+    rate's duration, changed with atomic increments. The count of the
+    previous window is weighted by how much of it still overlaps the
+    last duration. Rejected requests give their increment back.
+    '''
+
+    key_prefix = 'throttle'
+
+    def __init__(self):
+        alias = getattr(settings, 'THROTTLE_CACHE_ALIAS', 'default')
+        self.cache = caches[alias]
+
+    @property
+    def generation_key(self):
+        return f'{self.key_prefix}:generation'
+
+    def make_key(self, generation, key, window):
+        return f'{self.key_prefix}:{generation}:{key}:{window}'
+
+    def incr(self, key, delta=1, timeout=None):
+        '''Add delta to a counter starting at 0, visible to all workers
+
+        The database cache increments with a get and a set, the row is
+        locked around them where the database supports it.
+        '''
+
+        self.cache.add(key, 0, timeout)
+        if not isinstance(self.cache, BaseDatabaseCache):
+            return self.cache.incr(key, delta)
+        db = router.db_for_write(self.cache.cache_model_class)
+        connection = connections[db]
+        with transaction.atomic(using=db):
+            if connection.features.has_select_for_update:
+                table = connection.ops.quote_name(self.cache._table)
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        f'SELECT cache_key FROM {table} '
+                        f'WHERE cache_key = %s FOR UPDATE',
+                        [self.cache.make_key(key)],
+                    )
+            return self.cache.incr(key, delta)
+
+    def consume(self, key, capacity, duration, now):
+        '''Count one request, return seconds to wait if over the rate'''
+
+        window, elapsed = divmod(now, duration)
+        generation = self.cache.get(self.generation_key, 0)
+        current = self.make_key(generation, key, int(window))
+        # Read as the previous window until the end of the next one
+        count = self.incr(current, timeout=duration * 2)
+        previous = self.cache.get(
+            self.make_key(generation, key, int(window) - 1), 0
+        )
+        weight = 1 - elapsed / duration
+        if previous * weight + count <= capacity:
+            return None
+        self.incr(current, -1, timeout=duration * 2)
+        if previous and count <= capacity:
+            # The previous window weighs less and less until it fits
+            return duration * (1 - (capacity - count) / previous) - elapsed
+        return duration - elapsed
+
+    def clear(self):
+        '''Start this store over with full buckets, for tests
+
+        The cache can't list keys, so buckets move to a new key generation
+        kept in the cache, seen by all workers. The old ones expire with
+        their ttl, other entries of the cache are left alone.
+        '''
+
+        self.incr(self.generation_key)
+
+
+class TokenBucketThrottle(BaseThrottle):
+    '''Base token bucket throttle with read/write/upload/bulk scopes
+
+    Views can map actions to a scope with a ``throttle_scopes`` dict,
+    e.g. ``{'upload_image': 'upload'}``. Everything else is ``read`` for
+    safe methods and ``write`` otherwise.
+    '''
+
+    scope_prefix = ''
+
+    def __init__(self):
+        self.wait_time = None
+
+    def get_scope(self, request, view):
+        '''Return the throttle scope for this request'''
+
+        action = getattr(view, 'action', None)
+        scopes = getattr(view, 'throttle_scopes', {})
+        if action in scopes:
+            return scopes[action]
+        if request.method in SAFE_METHODS:
+            return 'read'
+        return 'write'
+
+    def get_rate(self, scope):
+        '''Return the configured rate for a scope'''
+
+        rates = api_settings.DEFAULT_THROTTLE_RATES
+        return rates.get(self.scope_prefix + scope)
+
+    def get_cache_key(self, request, view, scope):
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        scope = self.get_scope(request, view)
+        capacity, duration = parse_rate(self.get_rate(scope))
+        if capacity is None:
+            return True
+
+        key = self.get_cache_key(request, view, scope)
+        self.wait_time = get_counter_store().consume(
+            key, capacity, duration, time.time()
+        )
+        return self.wait_time is None
+
+    def wait(self):
+        return self.wait_time
+
+
+class UserTokenBucketThrottle(TokenBucketThrottle):
+    '''Throttle each user (or client IP when anonymous) per scope'''
+
+    def get_cache_key(self, request, view, scope):
+        if request.user and request.user.is_authenticated:
+            ident = f'user:{request.user.pk}'
+        else:
+            ident = f'ip:{self.get_ident(request)}'
+        return f'{scope}:{ident}'
+
+
+class EndpointTokenBucketThrottle(TokenBucketThrottle):
+    '''Throttle the total traffic an endpoint takes from all clients'''
+
+    scope_prefix = 'endpoint_'
+
+    def get_cache_key(self, request, view, scope):
+        endpoint = getattr(view, 'basename', None) or type(view).__name__
+        return f'endpoint:{scope}:{endpoint}'
@@ -0,0 +1,166 @@
+import hashlib
+import os
+import tempfile
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from PIL import Image
+from core.jobs import task
+
+
+# Pillow format -> content type of the thumbnails written
+CONTENT_TYPES = {
+    'JPEG': 'image/jpeg',
+    'PNG': 'image/png',
+    'GIF': 'image/gif',
+    'WEBP': 'image/webp',
+}
+
+# Shared cache keys of the running size of the thumbnail cache, and of
+# the flag that an eviction job is queued
+SIZE_KEY = 'thumbnails:bytes'
+EVICTING_KEY = 'thumbnails:evicting'
+EVICTING_TIMEOUT = 600
+
+
+def thumbnail_root():
+    return getattr(settings, 'THUMBNAIL_ROOT',
+                   os.path.join(settings.MEDIA_ROOT, 'thumbs'))
+
+
+def allowed_sizes():
+    return getattr(settings, 'THUMBNAIL_SIZES', (64, 128, 256, 512))
+
+
+def thumbnail_path(name, size):
+    '''Return where the thumbnail of a media file is cached on disk'''
+
+    return os.path.join(thumbnail_root(), str(size), os.path.normpath(name))
+
+
+def thumbnail_format(name):
+    '''Return the Pillow format a media file's thumbnails are written in
+
+    It only depends on the file name, so cache hits know the content type
+    without opening the thumbnail.
+    '''
+
+    extension = os.path.splitext(name)[1].lower()
+    image_format = Image.registered_extensions().get(extension)
+    return image_format if image_format in CONTENT_TYPES else 'JPEG'
+
+
+def source_etag(name, size):
+    '''Return an ETag that changes whenever the source file is replaced'''
+
+    path = default_storage.path(name)
+    stat = os.stat(path)
+    raw = f'{name}:{size}:{stat.st_mtime_ns}:{stat.st_size}'
+    return '"' + hashlib.md5(raw.encode()).hexdigest() + '"'
+
+
+def generate(name, size):
+    '''Resize a media image to fit size x size and store it in the cache
+
+    The file is written next to its final place and renamed, so
+    concurrent requests never see half written thumbnails.
+    '''
+
+    target = thumbnail_path(name, size)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with default_storage.open(name) as source:
+        image = Image.open(source)
+        image_format = thumbnail_format(name)
+        if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        image.thumbnail((size, size), Image.LANCZOS)
+        fd, temp = tempfile.mkstemp(dir=os.path.dirname(target))
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                image.save(out, format=image_format)
+            os.replace(temp, target)
+        except BaseException:
+            os.unlink(temp)
+            raise
+    track_size(os.path.getsize(target))
+    return target
+
+
+def max_bytes():
+    return getattr(settings, 'THUMBNAIL_CACHE_MAX_BYTES', 512 * 1024 * 1024)
+
+
+def track_size(added):
+    '''Add a new file to the running size, queue evict_thumbnails if full
+
+    The size is only an estimate between evictions, e.g. regenerated files
+    count twice. Each eviction job recounts the files on disk.
+    '''
+
+    try:
+        total = cache.incr(SIZE_KEY, added)
+    except ValueError:
+        # Not counted yet, the job counts the files
+        total = None
+    if total is not None and total <= max_bytes():
+        return
+    if cache.add(EVICTING_KEY, True, EVICTING_TIMEOUT):
+        evict_thumbnails.delay()
+
+
+def get_thumbnail(name, size):
+    '''Return (path, content type) of a thumbnail, generating it once
+
+    Hits touch the file, so its mtime tells evict() when it was last used.
+    The file may still be evicted before the caller opens it.
+    '''
+
+    path = thumbnail_path(name, size)
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        path = generate(name, size)
+    return path, CONTENT_TYPES[thumbnail_format(name)]
+
+
+def evict(limit=None):
+    '''Delete least recently used thumbnails until the cache fits
+
+    Walks the whole cache, so it runs in the evict_thumbnails job rather
+    than in requests. Stores the remaining size for track_size() and
+    returns the number of files deleted.
+    '''
+
+    if limit is None:
+        limit = max_bytes()
+    files = []
+    total = 0
+    for directory, _dirs, names in os.walk(thumbnail_root()):
+        for filename in names:
+            path = os.path.join(directory, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+    deleted = 0
+    for _mtime, file_size, path in sorted(files):
+        if total <= limit:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        total -= file_size
+        deleted += 1
+    cache.set(SIZE_KEY, total, None)
+    return deleted
+
+
+@task('core.evict_thumbnails')
+def evict_thumbnails():
+    try:
+        evict()
+    finally:
+        cache.delete(EVICTING_KEY)
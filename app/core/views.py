@@ -0,0 +1,71 @@
+import os
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse, \
+    HttpResponseForbidden, HttpResponseNotModified
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+from django.views.decorators.http import require_safe
+from core import thumbnails
+from core.metrics import render_metrics
+
+
+def metrics_view(request):
+    '''Expose request metrics in Prometheus text format'''
+
+    allowed = getattr(settings, 'METRICS_ALLOWED_IPS', None)
+    if allowed is not None and request.META.get('REMOTE_ADDR') not in allowed:
+        return HttpResponseForbidden()
+
+    return HttpResponse(
+        render_metrics(),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
+
+
+@require_safe
+def thumbnail_view(request, size, name):
+    '''Serve a resized copy of a media image, generated on first use
+
+    Media files never change under the same name, so thumbnails are
+    cacheable for good. With THUMBNAIL_ACCEL_REDIRECT set, the file itself
+    is sent by nginx through X-Accel-Redirect.
+    '''
+
+    if size not in thumbnails.allowed_sizes():
+        raise Http404('Unsupported thumbnail size')
+    try:
+        if not default_storage.exists(name):
+            raise Http404('No such image')
+        etag = thumbnails.source_etag(name, size)
+    except SuspiciousFileOperation:
+        raise Http404('No such image')
+
+    if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        response = HttpResponseNotModified()
+    else:
+        try:
+            path, content_type = thumbnails.get_thumbnail(name, size)
+        except OSError:
+            raise Http404('Not an image')
+        accel = getattr(settings, 'THUMBNAIL_ACCEL_REDIRECT', None)
+        if accel:
+            response = HttpResponse(content_type=content_type)
+            response['X-Accel-Redirect'] = accel + os.path.relpath(
+                path, thumbnails.thumbnail_root()
+            )
+        else:
+            try:
+                thumbnail = open(path, 'rb')
+            except FileNotFoundError:
+                # Evicted since get_thumbnail() touched it
+                try:
+                    thumbnail = open(thumbnails.generate(name, size), 'rb')
+                except OSError:
+                    raise Http404('Not an image')
+            response = FileResponse(thumbnail, content_type=content_type)
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=31536000,
+                        immutable=True)
+    return response
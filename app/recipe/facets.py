@@ -0,0 +1,119 @@
+import hashlib
+import uuid
+from django.core.cache import cache
+from django.db.models import Count
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from core.bulk import recipes_bulk_changed
+from core.changes import current_batch
+from core.models import Tag, Ingredient, Recipe
+
+
+FACETS_TIMEOUT = 300
+
+
+def _version_key(user_id):
+    return f'recipe-facets-version:{user_id}'
+
+
+def _new_version():
+    return uuid.uuid4().hex
+
+
+def get_version(user_id):
+    '''Return the user's facet cache version, replaced on every change'''
+
+    return cache.get_or_set(_version_key(user_id), _new_version, None)
+
+
+def invalidate(user_id):
+    '''Drop every cached facet result of a user
+
+    The version lives in the cache shared by all processes. A new random
+    one takes a single write, where incrementing it reads it first.
+    '''
+
+    cache.set(_version_key(user_id), _new_version(), None)
+
+
+def cache_key(user_id, params):
+    '''Return the cache key for a user and filter signature'''
+
+    signature = '&'.join(
+        f'{key}={params[key]}' for key in sorted(params)
+    )
+    digest = hashlib.md5(signature.encode()).hexdigest()
+    return f'recipe-facets:{user_id}:{get_version(user_id)}:{digest}'
+
+
+def _counts(through, column, name_field, recipe_ids):
+    '''Count through rows per related object in one grouped query'''
+
+    rows = through.objects.filter(recipe_id__in=recipe_ids) \
+        .values(column, name_field) \
+        .annotate(count=Count('*')) \
+        .order_by('-count', name_field)
+    return [
+        {'id': row[column], 'name': row[name_field], 'count': row['count']}
+        for row in rows
+    ]
+
+
+def compute_facets(recipes):
+    '''Return tag and ingredient counts over a filtered recipe queryset'''
+
+    recipe_ids = recipes.order_by().values('id')
+    return {
+        'count': recipes.order_by().values('id').distinct().count(),
+        'tags': _counts(
+            Recipe.tags.through, 'tag_id', 'tag__name', recipe_ids
+        ),
+        'ingredients': _counts(
+            Recipe.ingredients.through, 'ingredient_id', 'ingredient__name',
+            recipe_ids
+        ),
+    }
+
+
+def get_facets(user_id, params, recipes):
+    '''Return cached facets for the filter signature, computing on a miss'''
+
+    key = cache_key(user_id, params)
+    facets = cache.get(key)
+    if facets is None:
+        facets = compute_facets(recipes)
+        cache.set(key, facets, FACETS_TIMEOUT)
+    return facets
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_on_change(sender, instance, **kwargs):
+    _invalidate_later(instance.user_id)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def invalidate_on_relation_change(sender, instance, action, **kwargs):
+    if action.startswith('post_'):
+        _invalidate_later(instance.user_id)
+
+
+def _invalidate_later(user_id):
+    '''Invalidate now, or once at the end of a batch of recipe changes'''
+
+    batch = current_batch()
+    if batch is not None:
+        batch.user_ids.add(user_id)
+    else:
+        invalidate(user_id)
+
+
+@receiver(recipes_bulk_changed)
+def invalidate_on_bulk_change(sender, user_ids, **kwargs):
+    for user_id in user_ids:
+        invalidate(user_id)
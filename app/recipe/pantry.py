@@ -0,0 +1,23 @@
+from django.db.models import Count, F, Q
+from core.models import Recipe
+
+
+def match_pantry(user_id, ingredient_ids, max_missing=None):
+    '''Return the user's recipes ranked by how much of them a pantry covers
+
+    One grouped aggregate over the ingredient through table counts the
+    ingredients of each recipe and those in the pantry. Recipes are
+    annotated with ingredient_count, matched and missing, fewest missing
+    first. Recipes using nothing from the pantry are left out.
+    '''
+
+    recipes = Recipe.objects.filter(user_id=user_id).annotate(
+        ingredient_count=Count('ingredients'),
+        matched=Count('ingredients',
+                      filter=Q(ingredients__id__in=ingredient_ids)),
+    ).annotate(
+        missing=F('ingredient_count') - F('matched'),
+    ).filter(matched__gt=0)
+    if max_missing is not None:
+        recipes = recipes.filter(missing__lte=max_missing)
+    return recipes.order_by('missing', '-matched', 'id')
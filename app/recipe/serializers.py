@@ -1,44 +1,407 @@
+import re
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.urls import reverse
+from django.utils.translation import gettext_lazy as _
 from rest_framework import serializers
-from core.models import Tag, Ingredient, Recipe
+from rest_framework.fields import empty
+from rest_framework.utils import html
+from core.catalog import canonical_id, canonical_name
+from core.changes import batch_recipe_changes
+from core.models import Tag, Ingredient, Recipe, IngredientQuantity, \
+    normalize_name
+from core.quantities import QUANTITY_PLACES
 
 
-class TagSerializer(serializers.ModelSerializer):
+# Largest value of an AutoField column
+MAX_ID = 2147483647
+
+ID_PATTERN = re.compile(r'[0-9]+')
+
+
+def parse_id(value):
+    '''Return a string of ASCII digits as an int, None for anything else
+
+    str.isdigit() also accepts characters like '²' that int() rejects.
+    '''
+
+    if not ID_PATTERN.fullmatch(value):
+        return None
+    return int(value)
+
+
+def parse_ids(value):
+    '''Return the ids of a comma separated string, ValueError if malformed'''
+
+    ids = [parse_id(item.strip()) for item in value.split(',')]
+    if any(pk is None or pk > MAX_ID for pk in ids):
+        raise ValueError(f'Malformed id list {value!r}')
+    return ids
+
+
+class CatalogLinkedSerializer(serializers.ModelSerializer):
+    '''Adds the name of the shared catalog entry a row is linked to'''
+
+    canonical_name = serializers.SerializerMethodField()
+
+    def get_canonical_name(self, obj):
+        return canonical_name(type(obj), obj.canonical_id)
+
+
+class TagSerializer(CatalogLinkedSerializer):
     '''serializer for tag objects'''
 
     class Meta:
         model = Tag
-        fields = ('id', 'name')
-        read_only_fields = ('id',)
+        fields = ('id', 'name', 'canonical', 'canonical_name',
+                  'recipe_count')
+        read_only_fields = ('id', 'canonical', 'recipe_count')
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(CatalogLinkedSerializer):
     '''serializer for Ingredient objects'''
 
     class Meta:
         model = Ingredient
-        fields = ('id', 'name')
-        read_only_fields = ('id',)
+        fields = ('id', 'name', 'canonical', 'canonical_name',
+                  'recipe_count')
+        read_only_fields = ('id', 'canonical', 'recipe_count')
+
+
+class IngredientQuantitySerializer(serializers.ModelSerializer):
+    '''Amount of one of a recipe's ingredients
+
+    Quantities are multiplied by the scale in the context, if any.
+    '''
+
+    ingredient = serializers.IntegerField(source='ingredient_id')
+
+    class Meta:
+        model = IngredientQuantity
+        fields = ('ingredient', 'quantity', 'unit')
+        extra_kwargs = {'quantity': {'min_value': Decimal('0.001')}}
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        scale = self.context.get('scale')
+        if scale is not None:
+            try:
+                quantity = (instance.quantity * scale).quantize(
+                    QUANTITY_PLACES
+                )
+            except InvalidOperation:
+                raise serializers.ValidationError(
+                    {'scale': _('Scaled quantities are too large.')}
+                )
+            data['quantity'] = str(quantity)
+        return data
+
+
+class RelatedRefs:
+    '''Validated tags/ingredients: existing objects plus names to resolve'''
+
+    def __init__(self, objects, names):
+        self.objects = objects
+        self.names = names
+
+    def __bool__(self):
+        return bool(self.objects or self.names)
+
+
+class IdOrNameRelatedField(serializers.Field):
+    '''List of related objects of the user, given by id or by name
+
+    Ids may be ints or digit strings (form data), anything else is a name.
+    Ids are checked with one query, names are resolved on save.
+    '''
+
+    default_error_messages = {
+        'not_a_list': _('Expected a list of ids or names.'),
+        'does_not_exist': _(
+            'Invalid pk "{pk_value}" - object does not exist.'
+        ),
+        'incorrect_type': _('Expected an id or a name, received {data_type}.'),
+        'blank': _('Names may not be blank.'),
+        'max_length': _(
+            'Names may not have more than {max_length} characters.'
+        ),
+    }
+
+    def __init__(self, model, **kwargs):
+        self.model = model
+        kwargs.setdefault('required', False)
+        super().__init__(**kwargs)
+
+    def get_value(self, dictionary):
+        if html.is_html_input(dictionary):
+            if self.field_name not in dictionary:
+                if getattr(self.root, 'partial', False):
+                    return empty
+                return []
+            return dictionary.getlist(self.field_name)
+        return dictionary.get(self.field_name, empty)
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list')
+
+        max_length = self.model._meta.get_field('name').max_length
+        ids = []
+        names = []
+        for item in data:
+            if isinstance(item, bool):
+                self.fail('incorrect_type', data_type='bool')
+            if isinstance(item, str) and parse_id(item) is not None:
+                item = parse_id(item)
+            if isinstance(item, int):
+                ids.append(item)
+            elif isinstance(item, str):
+                if not item.strip():
+                    self.fail('blank')
+                # Lowercasing can make a name longer, e.g. 'İ'
+                if max(len(item.strip()),
+                       len(normalize_name(item))) > max_length:
+                    self.fail('max_length', max_length=max_length)
+                names.append(item.strip())
+            else:
+                self.fail('incorrect_type', data_type=type(item).__name__)
+
+        objects = []
+        if ids:
+            found = self.model.objects.filter(
+                pk__in=[pk for pk in ids if 0 < pk <= MAX_ID]
+            )
+            request = self.context.get('request')
+            if request is not None:
+                found = found.filter(user=request.user)
+            found = found.in_bulk()
+            for pk in ids:
+                if pk not in found:
+                    self.fail('does_not_exist', pk_value=pk)
+            objects = [found[pk] for pk in dict.fromkeys(ids)]
+        return RelatedRefs(objects, names)
+
+    def to_representation(self, value):
+        return [obj.pk for obj in value.all()]
+
+
+def resolve_names(model, user, names):
+    '''Return objects of the user for names, bulk creating missing ones
+
+    One query finds existing rows by normalized name and one bulk insert
+    creates the rest.
+    '''
+
+    wanted = {}
+    for name in names:
+        wanted.setdefault(normalize_name(name), name)
+    if not wanted:
+        return []
+
+    def existing(keys):
+        return {
+            obj.normalized_name: obj for obj in model.objects.filter(
+                user=user, normalized_name__in=keys
+            )
+        }
+
+    found = existing(list(wanted))
+    missing = [key for key in wanted if key not in found]
+    if missing:
+        created = []
+        try:
+            with transaction.atomic():
+                created = model.objects.bulk_create([
+                    model(user=user, name=wanted[key], normalized_name=key,
+                          canonical_id=canonical_id(model, key))
+                    for key in missing
+                ])
+        except IntegrityError:
+            # Someone else created some of them meanwhile
+            for key in missing:
+                model.objects.get_or_create(
+                    user=user, normalized_name=key,
+                    defaults={'name': wanted[key],
+                              'canonical_id': canonical_id(model, key)},
+                )
+        if created and all(obj.pk for obj in created):
+            found.update((obj.normalized_name, obj) for obj in created)
+        else:
+            # Not every backend returns primary keys from bulk_create
+            found.update(existing(missing))
+    return [found[key] for key in wanted]
 
 
 class RecipeSerializer(serializers.ModelSerializer):
     '''serializer for recipe'''
 
-    ingredients = serializers.PrimaryKeyRelatedField(
-        many=True,
-        queryset=Ingredient.objects.all()
-    )
-    tags = serializers.PrimaryKeyRelatedField(
-        many=True,
-        queryset=Tag.objects.all()
-    )
+    ingredients = IdOrNameRelatedField(Ingredient)
+    tags = IdOrNameRelatedField(Tag)
+    # Replaces all quantities, ingredients given are linked if they aren't
+    quantities = IngredientQuantitySerializer(many=True, required=False)
+    thumbnail = serializers.SerializerMethodField()
+    # Incremental changes, only the given links are touched
+    ingredients_add = IdOrNameRelatedField(Ingredient, write_only=True)
+    ingredients_remove = IdOrNameRelatedField(Ingredient, write_only=True)
+    tags_add = IdOrNameRelatedField(Tag, write_only=True)
+    tags_remove = IdOrNameRelatedField(Tag, write_only=True)
+
+    # relation -> (model, field adding links, field removing links)
+    incremental_relations = {
+        'tags': (Tag, 'tags_add', 'tags_remove'),
+        'ingredients': (Ingredient, 'ingredients_add', 'ingredients_remove'),
+    }
 
     class Meta:
         model = Recipe
         fields = (
-            'id', 'title', 'ingredients', 'tags', 'time_minutes',
-            'price', 'link', 'image'
+            'id', 'title', 'ingredients', 'tags', 'quantities',
+            'time_minutes', 'price', 'link', 'image', 'thumbnail', 'version',
+            'ingredients_add', 'ingredients_remove', 'tags_add',
+            'tags_remove',
         )
-        read_only_fields = ('id',)
+        read_only_fields = ('id', 'version')
+
+    def get_thumbnail(self, recipe):
+        '''URL of a list sized copy of the image, see core.thumbnails'''
+
+        if not recipe.image:
+            return None
+        url = reverse('thumbnail', kwargs={
+            'size': getattr(settings, 'THUMBNAIL_LIST_SIZE', 256),
+            'name': recipe.image.name,
+        })
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+    def validate_quantities(self, value):
+        '''Check the ingredients with one query'''
+
+        ids = [item['ingredient_id'] for item in value]
+        if len(set(ids)) != len(ids):
+            raise serializers.ValidationError(
+                _('Each ingredient may only be given once.')
+            )
+        found = Ingredient.objects.filter(pk__in=ids)
+        request = self.context.get('request')
+        if request is not None:
+            found = found.filter(user=request.user)
+        missing = set(ids) - set(found.values_list('pk', flat=True))
+        if missing:
+            raise serializers.ValidationError(
+                _('Invalid ingredients {ids}.').format(ids=sorted(missing))
+            )
+        return value
+
+    def validate(self, attrs):
+        for relation, (_model, add, remove) in \
+                self.incremental_relations.items():
+            if relation in attrs and (attrs.get(add) or attrs.get(remove)):
+                raise serializers.ValidationError({
+                    relation: _('Cannot be combined with incremental '
+                                'changes of the same relation.')
+                })
+        return attrs
+
+    def _resolve(self, model, refs, user):
+        if refs is None:
+            return None
+        return refs.objects + [
+            obj for obj in resolve_names(model, user, refs.names)
+            if obj not in refs.objects
+        ]
+
+    def _save_related(self, recipe, tags, ingredients, created=False):
+        tags = self._resolve(Tag, tags, recipe.user)
+        ingredients = self._resolve(Ingredient, ingredients, recipe.user)
+        # A new recipe has no links to diff against
+        for manager, objs in ((recipe.tags, tags),
+                              (recipe.ingredients, ingredients)):
+            if objs is None:
+                continue
+            if created:
+                manager.add(*objs)
+            else:
+                manager.set(objs)
+
+    def _save_quantities(self, recipe, quantities, created=False):
+        '''Replace the quantities of a recipe, linking their ingredients'''
+
+        if quantities is None:
+            return
+        ids = [item['ingredient_id'] for item in quantities]
+        if ids:
+            recipe.ingredients.add(*ids)
+        if not created:
+            IngredientQuantity.objects.filter(recipe=recipe).delete()
+        IngredientQuantity.objects.bulk_create([
+            IngredientQuantity(recipe=recipe, **item) for item in quantities
+        ])
+
+    def create(self, validated_data):
+        '''Create a recipe, creating tags and ingredients given by name'''
+
+        tags = validated_data.pop('tags', None)
+        ingredients = validated_data.pop('ingredients', None)
+        quantities = validated_data.pop('quantities', None)
+        changes = self._pop_changes(validated_data)
+        with transaction.atomic(), batch_recipe_changes():
+            recipe = super().create(validated_data)
+            self._save_related(recipe, tags, ingredients, created=True)
+            self._apply_changes(recipe, changes)
+            self._save_quantities(recipe, quantities, created=True)
+        return recipe
+
+    def update(self, instance, validated_data):
+        '''Update a recipe, creating tags and ingredients given by name'''
+
+        tags = validated_data.pop('tags', None)
+        ingredients = validated_data.pop('ingredients', None)
+        quantities = validated_data.pop('quantities', None)
+        changes = self._pop_changes(validated_data)
+        with transaction.atomic(), batch_recipe_changes():
+            recipe = super().update(instance, validated_data)
+            self._save_related(recipe, tags, ingredients)
+            self._apply_changes(recipe, changes)
+            self._save_quantities(recipe, quantities)
+        return recipe
+
+    def _pop_changes(self, validated_data):
+        changes = []
+        for relation, (model, add, remove) in \
+                self.incremental_relations.items():
+            changes.append((
+                relation, model,
+                validated_data.pop(add, None),
+                validated_data.pop(remove, None),
+            ))
+        return changes
+
+    def _apply_changes(self, recipe, changes):
+        '''Add and remove single links without reading the whole relation
+
+        The related manager only looks up the given ids before its INSERT,
+        and removing is one DELETE, so the cost follows the size of the
+        change rather than of the relation.
+        '''
+
+        for relation, model, add, remove in changes:
+            manager = getattr(recipe, relation)
+            add = self._resolve(model, add, recipe.user) or []
+            if remove is not None:
+                # Names that do not exist cannot be linked, skip them
+                remove = remove.objects + list(model.objects.filter(
+                    user=recipe.user,
+                    normalized_name__in={
+                        normalize_name(name) for name in remove.names
+                    },
+                ))
+                remove = [obj for obj in remove if obj not in add]
+                if remove:
+                    manager.remove(*remove)
+            if add:
+                manager.add(*add)
 
 
 class RecipeDetailSerializer(RecipeSerializer):
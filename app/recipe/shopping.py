@@ -0,0 +1,75 @@
+from django.db.models import Case, Count, DecimalField, Exists, OuterRef, \
+    Sum, Value, When
+from core import quantities
+from core.models import Recipe, IngredientQuantity
+
+
+def _scale_expression(scales):
+    '''SQL CASE giving the scale of each recipe, None if all are 1'''
+
+    if all(scale == 1 for scale in scales.values()):
+        return None
+    return Case(
+        *[When(recipe_id=pk, then=Value(scale))
+          for pk, scale in scales.items()],
+        output_field=DecimalField(max_digits=10, decimal_places=3),
+    )
+
+
+def shopping_list(user_id, scales):
+    '''Return the ingredients needed for the user's recipes, summed up
+
+    scales maps recipe ids to how many times each is cooked. Quantities
+    are converted to the base unit of their dimension and summed per
+    ingredient in one grouped query, an ingredient measured by weight in
+    one recipe and by volume in another gets an entry for each. Linked
+    ingredients without a quantity are listed with quantity None.
+    '''
+
+    live = {
+        'recipe_id__in': list(scales),
+        'recipe__user_id': user_id,
+        'recipe__deleted_at__isnull': True,
+    }
+    amount = quantities.base_quantity_expression()
+    scale = _scale_expression(scales)
+    if scale is not None:
+        amount = amount * scale
+    measured = IngredientQuantity.objects.filter(**live) \
+        .annotate(dimension=quantities.dimension_expression()) \
+        .values('ingredient_id', 'ingredient__name', 'dimension') \
+        .annotate(
+            total=Sum(amount, output_field=DecimalField(max_digits=20,
+                                                        decimal_places=3)),
+            recipes=Count('recipe_id', distinct=True),
+        ).order_by()
+
+    unmeasured = Recipe.ingredients.through.objects.filter(**live) \
+        .annotate(measured=Exists(IngredientQuantity.objects.filter(
+            recipe_id=OuterRef('recipe_id'),
+            ingredient_id=OuterRef('ingredient_id'),
+        ))).filter(measured=False) \
+        .values('ingredient_id', 'ingredient__name') \
+        .annotate(recipes=Count('recipe_id', distinct=True)).order_by()
+
+    items = []
+    for row in measured:
+        quantity, unit = quantities.display(row['total'], row['dimension'])
+        items.append({
+            'ingredient': row['ingredient_id'],
+            'name': row['ingredient__name'],
+            'quantity': str(quantity),
+            'unit': unit,
+            'recipes': row['recipes'],
+        })
+    for row in unmeasured:
+        items.append({
+            'ingredient': row['ingredient_id'],
+            'name': row['ingredient__name'],
+            'quantity': None,
+            'unit': None,
+            'recipes': row['recipes'],
+        })
+    items.sort(key=lambda item: (item['name'].lower(), item['ingredient'],
+                                 item['unit'] or ''))
+    return items
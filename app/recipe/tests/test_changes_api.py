@@ -0,0 +1,227 @@
+import threading
+from datetime import timedelta
+from unittest import mock, skipUnless
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+from core import bulk
+from core.changes import prune_changes, read_changes, record_changes, \
+    latest_cursor, batch_recipe_changes
+from core.models import Recipe, Tag, Change
+
+
+CHANGES_URL = reverse('recipe:changes-list')
+
+
+def sample_recipe(user, title='Poha'):
+    return Recipe.objects.create(
+        user=user, title=title, time_minutes=10, price=5.00
+    )
+
+
+class ChangeFeedAPITests(TestCase):
+    '''Test the change feed used by offline clients'''
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'changes@gmail.com',
+            'password123'
+        )
+        self.client.force_authenticate(self.user)
+
+    def get_cursor(self):
+        return self.client.get(CHANGES_URL).data['cursor']
+
+    def test_login_required(self):
+        '''Test that the feed needs authentication'''
+
+        res = APIClient().get(CHANGES_URL)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_changes_since_cursor(self):
+        '''Test that only objects changed after the cursor are returned'''
+
+        old = sample_recipe(self.user, title='Old')
+        cursor = self.get_cursor()
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        recipe = sample_recipe(self.user, title='New')
+        recipe.tags.add(tag)
+        other = get_user_model().objects.create_user(
+            'other@gmail.com', 'password123'
+        )
+        sample_recipe(other)
+
+        res = self.client.get(CHANGES_URL, {'since': cursor})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['id'] for r in res.data['recipes']], [recipe.id])
+        self.assertEqual(res.data['recipes'][0]['tags'], [tag.id])
+        self.assertEqual([t['id'] for t in res.data['tags']], [tag.id])
+        self.assertNotIn(old.id, [r['id'] for r in res.data['recipes']])
+        self.assertFalse(res.data['has_more'])
+
+        res = self.client.get(CHANGES_URL, {'since': res.data['cursor']})
+        self.assertEqual(res.data['recipes'], [])
+
+    def test_tombstones(self):
+        '''Test that deleted objects are reported, also bulk deleted ones'''
+
+        recipe1 = sample_recipe(self.user)
+        recipe2 = sample_recipe(self.user)
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        deleted_ids = sorted([recipe1.id, recipe2.id])
+        tag_id = tag.id
+        cursor = self.get_cursor()
+        recipe1.delete()
+        tag.delete()
+        bulk.delete_recipes(Recipe.objects.filter(pk=recipe2.pk))
+
+        res = self.client.get(CHANGES_URL, {'since': cursor})
+
+        self.assertEqual(res.data['recipes'], [])
+        self.assertEqual(res.data['deleted']['recipes'], deleted_ids)
+        self.assertEqual(res.data['deleted']['tags'], [tag_id])
+
+    def test_paging(self):
+        '''Test that limit pages through the feed'''
+
+        cursor = self.get_cursor()
+        recipes = [sample_recipe(self.user) for i in range(3)]
+
+        res = self.client.get(CHANGES_URL, {'since': cursor, 'limit': 2})
+        self.assertTrue(res.data['has_more'])
+        self.assertEqual([r['id'] for r in res.data['recipes']],
+                         [recipes[0].id, recipes[1].id])
+        res = self.client.get(CHANGES_URL, {'since': res.data['cursor']})
+        self.assertEqual([r['id'] for r in res.data['recipes']],
+                         [recipes[2].id])
+
+    def test_invalid_since(self):
+        res = self.client.get(CHANGES_URL, {'since': 'yesterday'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_pruned_cursor_gone(self):
+        '''Test that a cursor older than the retained changes gets 410'''
+
+        cursor = self.get_cursor()
+        sample_recipe(self.user)
+        sample_recipe(self.user)
+        sample_recipe(self.user)
+        Change.objects.update(created_at=timezone.now() - timedelta(days=60))
+        total = Change.objects.count()
+
+        deleted = prune_changes(timezone.now() - timedelta(days=30))
+        self.assertEqual(deleted, total - 1)
+        res = self.client.get(CHANGES_URL, {'since': cursor})
+        self.assertEqual(res.status_code, status.HTTP_410_GONE)
+        res = self.client.get(CHANGES_URL, {'since': self.get_cursor()})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_running_transactions_held_back(self):
+        '''Test that the cursor doesn't pass changes that may still commit'''
+
+        cursor = self.get_cursor()
+        # Took its id first but its transaction is still running
+        late = sample_recipe(self.user, title='Late')
+        Change.objects.filter(object_id=late.id).update(txid=20)
+        early = sample_recipe(self.user, title='Early')
+        Change.objects.filter(object_id=early.id).update(txid=10)
+
+        with mock.patch('core.changes.commit_horizon', return_value=15):
+            res = self.client.get(CHANGES_URL, {'since': cursor})
+        self.assertEqual([r['id'] for r in res.data['recipes']], [early.id])
+
+        with mock.patch('core.changes.commit_horizon', return_value=21):
+            res = self.client.get(CHANGES_URL, {'since': res.data['cursor']})
+        self.assertEqual([r['id'] for r in res.data['recipes']], [late.id])
+
+    def test_batch_records_once(self):
+        '''Test that a batch writes one change per object at its end'''
+
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        with batch_recipe_changes():
+            recipe = sample_recipe(self.user)
+            recipe.tags.add(tag)
+            recipe.tags.remove(tag)
+            self.assertFalse(Change.objects.filter(object_id=recipe.id,
+                                                   kind=Change.RECIPE))
+        self.assertEqual(Change.objects.filter(object_id=recipe.id,
+                                               kind=Change.RECIPE).count(), 1)
+
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic(), batch_recipe_changes():
+                sample_recipe(self.user, title='Lost')
+                raise RuntimeError
+        self.assertFalse(Recipe.objects.filter(title='Lost').exists())
+        self.assertEqual(Change.objects.filter(kind=Change.RECIPE).count(),
+                         1)
+
+    def test_malformed_cursor(self):
+        for since in ('12', '1-x', '-1-2', '1-²'):
+            res = self.client.get(CHANGES_URL, {'since': since})
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'needs transaction ids')
+class ChangeFeedTransactionTests(TransactionTestCase):
+    '''Test the feed with transactions committing out of id order'''
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'changes@gmail.com',
+            'password123'
+        )
+
+    def in_thread(self, func):
+        def run():
+            try:
+                func()
+            finally:
+                connection.close()
+        thread = threading.Thread(target=run)
+        thread.start()
+        return thread
+
+    def test_interleaved_transactions(self):
+        '''Test that a change committed after a later one isn't skipped'''
+
+        started, inserted, committed, release = [
+            threading.Event() for i in range(4)
+        ]
+        start = latest_cursor()
+
+        def first():
+            # Gets the lower transaction id but the higher change id
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT txid_current()')
+                started.set()
+                inserted.wait(10)
+                record_changes(Change.RECIPE, [(self.user.id, 2)])
+            committed.set()
+
+        def second():
+            started.wait(10)
+            with transaction.atomic():
+                record_changes(Change.RECIPE, [(self.user.id, 1)])
+                inserted.set()
+                release.wait(10)
+
+        threads = [self.in_thread(first), self.in_thread(second)]
+        committed.wait(10)
+        during = latest_cursor()
+        changes, cursor, _more = read_changes(self.user.id, start, 10)
+        self.assertEqual(list(changes[Change.RECIPE]), [2])
+
+        release.set()
+        for thread in threads:
+            thread.join(10)
+        changes, cursor, _more = read_changes(self.user.id, cursor, 10)
+        self.assertEqual(list(changes[Change.RECIPE]), [1])
+        changes, cursor, _more = read_changes(self.user.id, during, 10)
+        self.assertEqual(list(changes[Change.RECIPE]), [1])
@@ -0,0 +1,92 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from core.models import Recipe, Tag, Ingredient
+
+
+FACETS_URL = reverse('recipe:recipe-facets')
+
+
+def sample_recipe(user, title='Poha', time_minutes=20, price=50.00):
+    return Recipe.objects.create(
+        user=user, title=title, time_minutes=time_minutes, price=price
+    )
+
+
+class RecipeFacetsAPITests(TestCase):
+    '''Test the recipe facet counts endpoint'''
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'facets@gmail.com',
+            'password123'
+        )
+        self.client.force_authenticate(self.user)
+        self.vegan = Tag.objects.create(user=self.user, name='Vegan')
+        self.quick = Tag.objects.create(user=self.user, name='Quick')
+        self.salt = Ingredient.objects.create(user=self.user, name='Salt')
+        recipe1 = sample_recipe(self.user, time_minutes=10)
+        recipe1.tags.add(self.vegan, self.quick)
+        recipe1.ingredients.add(self.salt)
+        recipe2 = sample_recipe(self.user, time_minutes=60)
+        recipe2.tags.add(self.vegan)
+
+    def test_facet_counts(self):
+        '''Test counting recipes per tag and ingredient'''
+
+        res = self.client.get(FACETS_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['count'], 2)
+        self.assertEqual(res.data['tags'], [
+            {'id': self.vegan.id, 'name': 'Vegan', 'count': 2},
+            {'id': self.quick.id, 'name': 'Quick', 'count': 1},
+        ])
+        self.assertEqual(res.data['ingredients'], [
+            {'id': self.salt.id, 'name': 'Salt', 'count': 1},
+        ])
+
+    def test_facets_follow_filters(self):
+        '''Test that facets only count recipes matching the filters'''
+
+        res = self.client.get(FACETS_URL, {'max_time': 30})
+        self.assertEqual(res.data['count'], 1)
+        counts = {tag['name']: tag['count'] for tag in res.data['tags']}
+        self.assertEqual(counts, {'Vegan': 1, 'Quick': 1})
+
+    def test_facets_limited_to_user(self):
+        '''Test that other users' recipes are not counted'''
+
+        user2 = get_user_model().objects.create_user(
+            'other@gmail.com',
+            'password123'
+        )
+        sample_recipe(user2).tags.add(
+            Tag.objects.create(user=user2, name='Vegan')
+        )
+        res = self.client.get(FACETS_URL)
+        self.assertEqual(res.data['count'], 2)
+        self.assertEqual(len(res.data['tags']), 2)
+
+    def test_facets_cached_and_invalidated(self):
+        '''Test that facets are cached until the user's recipes change'''
+
+        self.client.get(FACETS_URL)
+        # The version and the facets from the cache, no recipe queries
+        with self.assertNumQueries(2):
+            self.client.get(FACETS_URL)
+        sample_recipe(self.user).tags.add(self.quick)
+        res = self.client.get(FACETS_URL)
+        self.assertEqual(res.data['count'], 3)
+
+    def test_invalid_range_filters(self):
+        '''Test that malformed range filters are rejected'''
+
+        for params in ({'min_time': 'abc'}, {'max_time': '1.5'},
+                       {'min_price': 'abc'}, {'max_price': 'NaN'}):
+            res = self.client.get(FACETS_URL, params)
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
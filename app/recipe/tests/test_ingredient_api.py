@@ -4,6 +4,8 @@ from django.test import TestCase
 from rest_framework.test import APIClient
 from rest_framework import status
 from core.models import Ingredient, Recipe
+from core import catalog
+from core.testing import QueryAssertionsMixin
 from recipe.serializers import IngredientSerializer
 
 
@@ -23,7 +25,7 @@ class PublicIngredientAPITests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
 
 
-class PrivateIngredientAPITest(TestCase):
+class PrivateIngredientAPITest(QueryAssertionsMixin, TestCase):
     '''Test Ingredient API for authenticated user'''
 
     def setUp(self):
@@ -39,7 +41,8 @@ class PrivateIngredientAPITest(TestCase):
 
         Ingredient.objects.create(user=self.user, name='Cucumber')
         Ingredient.objects.create(user=self.user, name='Cheese')
-        res = self.client.get(INGREDIENT_URL)
+        with self.assertMaxQueries(1):
+            res = self.client.get(INGREDIENT_URL)
         ingredients = Ingredient.objects.all().order_by('-name')
         serializer = IngredientSerializer(ingredients, many=True)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
@@ -63,7 +66,12 @@ class PrivateIngredientAPITest(TestCase):
         '''Test creating a new tag'''
 
         payload = {'name': 'Test ingredient'}
-        self.client.post(INGREDIENT_URL, payload)
+        # Loaded once per process, not part of a request
+        catalog.CATALOGS[Ingredient].entries()
+        # Name lookup, insert, change feed entry and the facet version
+        # replaced in the database cache
+        with self.assertMaxQueries(10, duplicate_threshold=4):
+            self.client.post(INGREDIENT_URL, payload)
         exists = Ingredient.objects.filter(
             user=self.user,
             name=payload['name']
@@ -102,9 +110,11 @@ class PrivateIngredientAPITest(TestCase):
         )
         recipe1.ingredients.add(ingredient1)
         recipe2.ingredients.add(ingredient1)
+        ingredient1.refresh_from_db()
         serializer1 = IngredientSerializer(ingredient1)
         serializer2 = IngredientSerializer(ingredient2)
-        res = self.client.get(INGREDIENT_URL, {'assigned_only': 1})
+        with self.assertMaxQueries(1):
+            res = self.client.get(INGREDIENT_URL, {'assigned_only': 1})
         self.assertEqual(len(res.data), 1)
         self.assertIn(serializer1.data, res.data)
         self.assertNotIn(serializer2.data, res.data)
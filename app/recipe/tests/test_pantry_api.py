@@ -0,0 +1,79 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from core import throttling
+from core.models import Recipe, Ingredient
+from core.testing import QueryAssertionsMixin
+
+
+PANTRY_URL = reverse('recipe:recipe-pantry')
+
+
+class PantryAPITests(QueryAssertionsMixin, TestCase):
+
+    def setUp(self):
+        # The bulk scope allows few requests, start with a full bucket
+        throttling.get_counter_store().clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'pantry@gmail.com', 'password123'
+        )
+        self.client.force_authenticate(self.user)
+        self.rice, self.dal, self.salt, self.ghee = [
+            Ingredient.objects.create(user=self.user, name=name)
+            for name in ('Rice', 'Dal', 'Salt', 'Ghee')
+        ]
+
+    def recipe(self, title, ingredients, user=None):
+        recipe = Recipe.objects.create(user=user or self.user, title=title,
+                                       time_minutes=20, price=5)
+        recipe.ingredients.set(ingredients)
+        return recipe
+
+    def pantry(self, ingredients, **params):
+        params['ingredients'] = ','.join(str(obj.id) for obj in ingredients)
+        return self.client.get(PANTRY_URL, params)
+
+    def test_ranked_by_missing(self):
+        '''Test that recipes missing the fewest ingredients come first'''
+
+        khichdi = self.recipe('Khichdi', [self.rice, self.dal, self.salt,
+                                          self.ghee])
+        rice = self.recipe('Rice', [self.rice, self.salt])
+        self.recipe('Ghee', [self.ghee])
+        self.recipe('Water', [])
+
+        with self.assertMaxQueries(5):
+            res = self.pantry([self.rice, self.dal, self.salt])
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(item['id'], item['matched'], item['missing'])
+             for item in res.data],
+            [(rice.id, 2, 0), (khichdi.id, 3, 1)],
+        )
+        self.assertEqual(res.data[1]['missing_ingredients'], [self.ghee.id])
+
+    def test_max_missing(self):
+        self.recipe('Khichdi', [self.rice, self.dal, self.salt, self.ghee])
+        rice = self.recipe('Rice', [self.rice])
+
+        res = self.pantry([self.rice], max_missing=0)
+        self.assertEqual([item['id'] for item in res.data], [rice.id])
+
+    def test_limited_to_user(self):
+        other = get_user_model().objects.create_user(
+            'other@gmail.com', 'password123'
+        )
+        self.recipe('Rice', [self.rice], user=other)
+
+        res = self.pantry([self.rice])
+        self.assertEqual(res.data, [])
+
+    def test_ingredients_required(self):
+        res = self.client.get(PANTRY_URL)
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        res = self.client.get(PANTRY_URL, {'ingredients': '1,x'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
@@ -1,16 +1,22 @@
 from django.contrib.auth import get_user_model
+from django.db import IntegrityError, connection
 from django.test import TestCase
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient
-from core.models import Recipe, Tag, Ingredient
-from recipe.serializers import RecipeSerializer, RecipeDetailSerializer
+from core import catalog
+from core.models import Recipe, Tag, Ingredient, CatalogIngredient
+from core.testing import QueryAssertionsMixin
+from recipe.serializers import RecipeSerializer, RecipeDetailSerializer, \
+    resolve_names
 import tempfile
 import os
+from unittest.mock import patch
 from PIL import Image
 
 
 RECIPES_URL = reverse('recipe:recipe-list')
+STATS_URL = reverse('recipe:recipe-stats')
 
 
 def img_upload_url(recipe_id):
@@ -41,6 +47,7 @@ def sample_recipe(user, **params):
         'time_minutes': 25,
         'price': 200.00
     }
+    defaults.update(params)
     return Recipe.objects.create(user=user, **defaults)
 
 
@@ -57,7 +64,7 @@ class PublicRecipeAPITests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
 
 
-class PrivateRecipeAPITests(TestCase):
+class PrivateRecipeAPITests(QueryAssertionsMixin, TestCase):
     '''Test Authenticated User's Recipe API'''
 
     def setUp(self):
@@ -79,6 +86,38 @@ class PrivateRecipeAPITests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(res.data, serializer.data)
 
+    def test_retrieve_list_no_n_plus_one(self):
+        '''Test that listing recipes does not query per recipe'''
+
+        for name in ('Salt', 'Pepper', 'Chilli'):
+            recipe = sample_recipe(user=self.user)
+            recipe.tags.add(sample_tag(user=self.user, name=name))
+            recipe.ingredients.add(
+                sample_ingredient(user=self.user, name=name)
+            )
+        # Recipes, then tags, ingredients and quantities prefetched
+        with self.assertMaxQueries(4):
+            res = self.client.get(RECIPES_URL)
+        self.assertEqual(len(res.data), 3)
+
+    def test_recipe_stats(self):
+        '''Test the recipe stats of the authenticated user'''
+
+        sample_recipe(user=self.user, time_minutes=10, price=4.00)
+        sample_recipe(user=self.user, time_minutes=30, price=8.00)
+        user2 = get_user_model().objects.create_user(
+            'other@gmail.com',
+            'otherpassword'
+        )
+        sample_recipe(user=user2, time_minutes=500)
+        res = self.client.get(STATS_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['recipe_count'], 2)
+        self.assertEqual(res.data['average_time_minutes'], 20)
+        self.assertEqual(res.data['average_price'], 6)
+        self.assertEqual(res.data['price_distribution'][0]['count'], 1)
+        self.assertEqual(res.data['price_distribution'][1]['count'], 1)
+
     def test_recipes_limited_to_user(self):
         '''Test retrieving recipes limited to authenticated user only'''
 
@@ -136,6 +175,24 @@ class PrivateRecipeAPITests(TestCase):
         self.assertIn(tag1, tags)
         self.assertIn(tag2, tags)
 
+    def test_create_recipe_query_budget(self):
+        '''Test the queries of creating a recipe with a tag and ingredient'''
+        tag = sample_tag(user=self.user)
+        ingredient = sample_ingredient(user=self.user)
+        payload = {
+            'title': 'Paneer Tikka',
+            'time_minutes': 20,
+            'price': 200.00,
+            'tags': [tag.id],
+            'ingredients': [ingredient.id],
+        }
+        # Relation checks, the recipe with its first stats rows and both
+        # links. The change feed entry, the similarity job and the facet
+        # version are written once for the request.
+        with self.assertMaxQueries(31, duplicate_threshold=4):
+            res = self.client.post(RECIPES_URL, payload)
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
     def test_create_recipe_with_ingredients(self):
         '''Test creating a recipe with tags'''
         ingredient1 = sample_ingredient(user=self.user, name='Ginger')
@@ -154,6 +211,101 @@ class PrivateRecipeAPITests(TestCase):
         self.assertIn(ingredient1, ingredients)
         self.assertIn(ingredient2, ingredients)
 
+    def test_create_recipe_with_names(self):
+        '''Test creating a recipe with new and existing names and ids'''
+        tag = sample_tag(user=self.user, name='Vegan')
+        salt = sample_ingredient(user=self.user, name='Salt')
+        payload = {
+            'title': 'Dal',
+            'time_minutes': 30,
+            'price': 50.00,
+            'tags': [tag.id, 'Lunch'],
+            'ingredients': ['salt ', 'Lentils', 'Turmeric'],
+        }
+        # SQLite needs a second lookup per model after bulk_create. The
+        # change feed entry, the similarity job and the facet version are
+        # written once for the request.
+        with self.assertMaxQueries(40, duplicate_threshold=4) as queries:
+            res = self.client.post(RECIPES_URL, payload, format='json')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        # Names take one lookup and one insert per model, plus the re-read
+        # where bulk_create returns no ids
+        lookups = 1 if connection.features.can_return_ids_from_bulk_insert \
+            else 2
+        for table in ('core_tag', 'core_ingredient'):
+            self.assertEqual(len([
+                sql for sql, _ in queries.queries
+                if f'FROM "{table}"' in sql and '"normalized_name" IN' in sql
+            ]), lookups)
+            self.assertEqual(len([
+                sql for sql, _ in queries.queries
+                if sql.startswith(f'INSERT INTO "{table}"')
+            ]), 1)
+        recipe = Recipe.objects.get(id=res.data['id'])
+        self.assertEqual(
+            set(recipe.tags.values_list('name', flat=True)),
+            {'Vegan', 'Lunch'}
+        )
+        self.assertEqual(
+            set(recipe.ingredients.values_list('name', flat=True)),
+            {'Salt', 'Lentils', 'Turmeric'}
+        )
+        self.assertIn(salt.id, res.data['ingredients'])
+        self.assertEqual(Ingredient.objects.filter(user=self.user).count(), 3)
+
+    def test_create_recipe_with_other_users_tag(self):
+        '''Test that tags of other users cannot be used'''
+        user2 = get_user_model().objects.create_user(
+            'other@gmail.com',
+            'otherpassword'
+        )
+        tag = sample_tag(user=user2)
+        payload = {
+            'title': 'Dal',
+            'time_minutes': 30,
+            'price': 50.00,
+            'tags': [tag.id],
+        }
+        res = self.client.post(RECIPES_URL, payload, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_create_recipe_with_invalid_names(self):
+        '''Test that overlong names and impossible ids are bad requests'''
+        for tags in (['x' * 256], ['İ' * 200], [2 ** 40], ['9' * 20]):
+            payload = {
+                'title': 'Dal',
+                'time_minutes': 30,
+                'price': 50.00,
+                'tags': tags,
+            }
+            res = self.client.post(RECIPES_URL, payload, format='json')
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_create_recipe_with_digit_like_name(self):
+        '''Test that a name like '²' is a name, not an id'''
+        payload = {
+            'title': 'Dal',
+            'time_minutes': 30,
+            'price': 50.00,
+            'tags': ['²'],
+        }
+        res = self.client.post(RECIPES_URL, payload, format='json')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Tag.objects.get(pk=res.data['tags'][0]).name, '²')
+
+    def test_resolve_names_race_sets_canonical(self):
+        '''Test that names created after a conflict get their catalog id'''
+        catalog.clear_catalog_cache()
+        self.addCleanup(catalog.clear_catalog_cache)
+        entry = CatalogIngredient.objects.create(name='Salt')
+
+        with patch.object(Ingredient.objects, 'bulk_create',
+                          side_effect=IntegrityError):
+            salt, = resolve_names(Ingredient, self.user, ['salt'])
+
+        self.assertEqual(salt.canonical_id, entry.id)
+
     def test_partial_update_recipe(self):
         '''Test updating recipe with patch'''
 
@@ -171,6 +323,143 @@ class PrivateRecipeAPITests(TestCase):
         self.assertEqual(tags.count(), 1)
         self.assertIn(new_tag, tags)
 
+    def test_partial_update_skips_prefetch(self):
+        '''Test that relations are read once, for the response'''
+
+        recipe = sample_recipe(user=self.user)
+        recipe.ingredients.add(*[
+            sample_ingredient(user=self.user, name=f'Spice {i}')
+            for i in range(50)
+        ])
+        with self.assertMaxQueries(15, duplicate_threshold=4) as queries:
+            res = self.client.patch(detail_url(recipe.id),
+                                    {'title': 'Pasta'}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data['ingredients']), 50)
+        self.assertEqual(len([
+            sql for sql, _ in queries.queries
+            if sql.startswith('SELECT') and
+            'INNER JOIN "core_recipe_ingredients"' in sql
+        ]), 1)
+
+    def test_partial_update_add_remove_tags(self):
+        '''Test adding and removing single links with patch'''
+
+        recipe = sample_recipe(user=self.user)
+        kept = sample_tag(user=self.user, name='Kept')
+        dropped = sample_tag(user=self.user, name='Dropped')
+        recipe.tags.add(kept, dropped)
+        recipe.ingredients.add(*[
+            sample_ingredient(user=self.user, name=f'Spice {i}')
+            for i in range(20)
+        ])
+        payload = {
+            'tags_add': ['Spicy', kept.id],
+            'tags_remove': [dropped.id, 'Unknown'],
+        }
+        # Name lookups for add, remove and the SQLite re-read, relations
+        # are read once for the response. The facet version is bumped once
+        # for the request.
+        with self.assertMaxQueries(31, duplicate_threshold=4):
+            res = self.client.patch(detail_url(recipe.id), payload,
+                                    format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        names = set(recipe.tags.values_list('name', flat=True))
+        self.assertEqual(names, {'Kept', 'Spicy'})
+        self.assertEqual(recipe.ingredients.count(), 20)
+        dropped.refresh_from_db()
+        self.assertEqual(dropped.recipe_count, 0)
+
+    def test_partial_update_replace_and_add_rejected(self):
+        '''Test that tags cannot be replaced and changed at once'''
+
+        recipe = sample_recipe(user=self.user)
+        tag = sample_tag(user=self.user)
+        payload = {'tags': [tag.id], 'tags_add': [tag.id]}
+        res = self.client.patch(detail_url(recipe.id), payload,
+                                format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(recipe.tags.count(), 0)
+
+    def test_update_with_current_version(self):
+        '''Test that If-Match with the current ETag lets an update through'''
+
+        recipe = sample_recipe(user=self.user)
+        res = self.client.get(detail_url(recipe.id))
+        self.assertEqual(res['ETag'], '"1"')
+
+        res = self.client.patch(detail_url(recipe.id), {'title': 'Kheer'},
+                                HTTP_IF_MATCH=res['ETag'])
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['ETag'], '"2"')
+        self.assertEqual(res.data['version'], 2)
+
+    def test_update_with_stale_version(self):
+        '''Test that If-Match with an old ETag is refused with 412'''
+
+        recipe = sample_recipe(user=self.user)
+        self.client.patch(detail_url(recipe.id), {'title': 'Kheer'})
+
+        res = self.client.patch(detail_url(recipe.id), {'title': 'Halwa'},
+                                HTTP_IF_MATCH='"1"')
+
+        self.assertEqual(res.status_code,
+                         status.HTTP_412_PRECONDITION_FAILED)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.title, 'Kheer')
+
+    def test_concurrent_update_conflicts(self):
+        '''Test that a change between read and write gives 412'''
+
+        recipe = sample_recipe(user=self.user)
+        real_save = Recipe.save
+
+        def racing_save(instance, *args, **kwargs):
+            Recipe.objects.filter(pk=instance.pk).update(version=5)
+            return real_save(instance, *args, **kwargs)
+
+        with patch.object(Recipe, 'save', racing_save):
+            res = self.client.patch(detail_url(recipe.id), {'title': 'Kheer'})
+
+        self.assertEqual(res.status_code,
+                         status.HTTP_412_PRECONDITION_FAILED)
+        recipe.refresh_from_db()
+        self.assertNotEqual(recipe.title, 'Kheer')
+
+    def test_delete_recipe(self):
+        '''Test that deleting a recipe hides it until it is purged'''
+
+        recipe = sample_recipe(user=self.user)
+        res = self.client.delete(detail_url(recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        res = self.client.get(RECIPES_URL)
+        self.assertEqual(res.data, [])
+        res = self.client.get(detail_url(recipe.id))
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertIsNotNone(
+            Recipe.all_objects.get(pk=recipe.id).deleted_at
+        )
+
+    def test_queries_carry_partition_key(self):
+        '''Test that recipe queries filter on the owner, see partitioning'''
+
+        recipe = sample_recipe(user=self.user)
+        tag = sample_tag(user=self.user)
+        with self.assertPartitionKey('core_recipe', 'user_id'):
+            self.client.get(RECIPES_URL, {'tags': str(tag.id)})
+            self.client.get(detail_url(recipe.id))
+            self.client.get(reverse('recipe:recipe-facets'))
+            res = self.client.patch(detail_url(recipe.id), {
+                'title': 'Paneer tikka', 'tags_add': [tag.id],
+            })
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.client.delete(detail_url(recipe.id))
+
     def test_complete_update_recipe(self):
         '''Test updating recipe with put'''
 
@@ -269,3 +558,31 @@ class RecipeImageUploadTests(TestCase):
         self.assertIn(serializer1.data, res.data)
         self.assertIn(serializer2.data, res.data)
         self.assertNotIn(serializer3.data, res.data)
+
+    def test_filter_recipes_by_time_and_price(self):
+        '''Test filtering recipes by time and price ranges'''
+        recipe1 = sample_recipe(user=self.user, time_minutes=10, price=5)
+        recipe2 = sample_recipe(user=self.user, time_minutes=60, price=5)
+        recipe3 = sample_recipe(user=self.user, time_minutes=10, price=50)
+        res = self.client.get(
+            RECIPES_URL,
+            {'max_time': 30, 'max_price': '10.00'}
+        )
+        ids = [recipe['id'] for recipe in res.data]
+        self.assertIn(recipe1.id, ids)
+        self.assertNotIn(recipe2.id, ids)
+        self.assertNotIn(recipe3.id, ids)
+
+    def test_filter_recipes_invalid_ids(self):
+        '''Test that malformed tag and ingredient filters are rejected'''
+        for params in ({'tags': 'abc'}, {'ingredients': '1,²'},
+                       {'tags': '99999999999'}):
+            res = self.client.get(RECIPES_URL, params)
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_filter_recipes_invalid_range(self):
+        '''Test that a malformed range filter is a bad request'''
+        for params in ({'min_time': 'abc'}, {'max_price': 'cheap'},
+                       {'min_price': 'Infinity'}):
+            res = self.client.get(RECIPES_URL, params)
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,218 @@
+from decimal import Decimal
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from core import throttling
+from core.models import Recipe, Ingredient, IngredientQuantity
+from core.quantities import MASS, display
+from core.testing import QueryAssertionsMixin
+
+
+RECIPES_URL = reverse('recipe:recipe-list')
+SHOPPING_URL = reverse('recipe:recipe-shopping-list')
+
+
+def detail_url(recipe_id):
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+
+class ShoppingListAPITests(QueryAssertionsMixin, TestCase):
+
+    def setUp(self):
+        # The bulk scope allows few requests, start with a full bucket
+        throttling.get_counter_store().clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'shopping@gmail.com', 'password123'
+        )
+        self.client.force_authenticate(self.user)
+        self.flour, self.milk, self.eggs, self.salt = [
+            Ingredient.objects.create(user=self.user, name=name)
+            for name in ('Flour', 'Milk', 'Eggs', 'Salt')
+        ]
+
+    def recipe(self, title, quantities, user=None):
+        recipe = Recipe.objects.create(user=user or self.user, title=title,
+                                       time_minutes=20, price=5)
+        for ingredient, quantity, unit in quantities:
+            recipe.ingredients.add(ingredient)
+            if quantity is not None:
+                IngredientQuantity.objects.create(
+                    recipe=recipe, ingredient=ingredient, quantity=quantity,
+                    unit=unit,
+                )
+        return recipe
+
+    def shopping_list(self, *recipes):
+        param = ','.join(
+            str(item.id) if isinstance(item, Recipe) else
+            f'{item[0].id}:{item[1]}' for item in recipes
+        )
+        return self.client.get(SHOPPING_URL, {'recipes': param})
+
+    def test_create_with_quantities(self):
+        '''Test that quantities are saved and link their ingredients'''
+
+        payload = {
+            'title': 'Pancakes',
+            'time_minutes': 15,
+            'price': 2,
+            'quantities': [
+                {'ingredient': self.flour.id, 'quantity': '250',
+                 'unit': 'g'},
+                {'ingredient': self.milk.id, 'quantity': '0.5',
+                 'unit': 'l'},
+            ],
+        }
+        res = self.client.post(RECIPES_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        recipe = Recipe.objects.get(pk=res.data['id'])
+        self.assertEqual(set(recipe.ingredients.all()),
+                         {self.flour, self.milk})
+        self.assertEqual(
+            sorted((item['ingredient'], item['quantity'], item['unit'])
+                   for item in res.data['quantities']),
+            sorted([(self.flour.id, '250.000', 'g'),
+                    (self.milk.id, '0.500', 'l')]),
+        )
+
+    def test_invalid_quantities_rejected(self):
+        '''Test duplicate and foreign ingredients in quantities'''
+
+        other = get_user_model().objects.create_user(
+            'other@gmail.com', 'password123'
+        )
+        foreign = Ingredient.objects.create(user=other, name='Sugar')
+        for quantities in (
+            [{'ingredient': self.flour.id, 'quantity': '1', 'unit': 'g'},
+             {'ingredient': self.flour.id, 'quantity': '2', 'unit': 'g'}],
+            [{'ingredient': foreign.id, 'quantity': '1', 'unit': 'g'}],
+            [{'ingredient': self.flour.id, 'quantity': '0', 'unit': 'g'}],
+            [{'ingredient': self.flour.id, 'quantity': '1', 'unit': 'oz'}],
+        ):
+            payload = {'title': 'Cake', 'time_minutes': 5, 'price': 1,
+                       'quantities': quantities}
+            res = self.client.post(RECIPES_URL, payload, format='json')
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_unlinking_drops_quantity(self):
+        '''Test that removing an ingredient removes its quantity'''
+
+        recipe = self.recipe('Pancakes', [(self.flour, 250, 'g'),
+                                          (self.milk, 500, 'ml')])
+        res = self.client.patch(detail_url(recipe.id),
+                                {'ingredients_remove': [self.milk.id]},
+                                format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            list(recipe.quantities.values_list('ingredient_id', flat=True)),
+            [self.flour.id],
+        )
+        self.milk.delete()
+        recipe.ingredients.clear()
+        self.assertFalse(recipe.quantities.exists())
+
+    def test_detail_scaled(self):
+        '''Test that ?scale= multiplies the quantities of a recipe'''
+
+        recipe = self.recipe('Pancakes', [(self.flour, 250, 'g')])
+        res = self.client.get(detail_url(recipe.id), {'scale': '1.5'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['quantities'][0]['quantity'], '375.000')
+
+        for scale in ('-1', '1001', '1e30'):
+            res = self.client.get(detail_url(recipe.id), {'scale': scale})
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_shopping_list_sums_units(self):
+        '''Test that quantities are converted and summed per ingredient'''
+
+        pancakes = self.recipe('Pancakes', [
+            (self.flour, 250, 'g'), (self.milk, 1, 'cup'),
+            (self.eggs, 2, 'piece'), (self.salt, None, None),
+        ])
+        bread = self.recipe('Bread', [
+            (self.flour, '0.8', 'kg'), (self.milk, 2, 'tbsp'),
+            (self.salt, 1, 'tsp'),
+        ])
+
+        with self.assertMaxQueries(2):
+            res = self.shopping_list(pancakes, bread)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(item['name'], item['quantity'], item['unit'], item['recipes'])
+             for item in res.data['items']],
+            [('Eggs', '2.000', 'piece', 1),
+             ('Flour', '1.050', 'kg', 2),
+             ('Milk', '270.000', 'ml', 2),
+             ('Salt', None, None, 1),
+             ('Salt', '5.000', 'ml', 1)],
+        )
+
+    def test_shopping_list_scaled(self):
+        '''Test that recipe ids can be followed by a scale'''
+
+        pancakes = self.recipe('Pancakes', [(self.flour, 250, 'g'),
+                                            (self.eggs, 2, 'piece')])
+        bread = self.recipe('Bread', [(self.flour, 500, 'g')])
+
+        res = self.shopping_list((pancakes, 2), (bread, '0.5'))
+
+        self.assertEqual(
+            [(item['name'], item['quantity'], item['unit'])
+             for item in res.data['items']],
+            [('Eggs', '4.000', 'piece'), ('Flour', '750.000', 'g')],
+        )
+
+    def test_shopping_list_limited_to_user(self):
+        '''Test that recipes of other users and deleted ones are skipped'''
+
+        other = get_user_model().objects.create_user(
+            'other@gmail.com', 'password123'
+        )
+        theirs = self.recipe('Bread', [(self.flour, 500, 'g')], user=other)
+        deleted = self.recipe('Cake', [(self.flour, 100, 'g')])
+        Recipe.objects.filter(pk=deleted.pk).delete()
+        mine = self.recipe('Pancakes', [(self.flour, 250, 'g')])
+
+        res = self.shopping_list(theirs, deleted, mine)
+
+        self.assertEqual(
+            [(item['quantity'], item['unit'])
+             for item in res.data['items']],
+            [('250.000', 'g')],
+        )
+
+    def test_shopping_list_invalid(self):
+        '''Test that malformed recipe lists are rejected'''
+
+        for param in ('', 'abc', '1:0', '1:x', '²', '١', ','.join(
+                str(pk) for pk in range(1, 102))):
+            res = self.client.get(SHOPPING_URL, {'recipes': param})
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_shopping_list_scale_too_large(self):
+        '''Test that scales are capped, also when a recipe is repeated'''
+
+        recipe = self.recipe('Pancakes', [(self.flour, 250, 'g')])
+
+        for scales in ([1001], ['1e30'], [600, 600]):
+            res = self.shopping_list(*((recipe, scale) for scale in scales))
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_display_too_large(self):
+        '''Test that totals too large to round raise ValueError'''
+
+        with self.assertRaises(ValueError):
+            display(Decimal('1e30'), MASS)
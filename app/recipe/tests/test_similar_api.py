@@ -0,0 +1,86 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from core import similarity
+from core.models import Recipe, Tag, Ingredient
+from core.testing import QueryAssertionsMixin
+
+
+def similar_url(recipe_id):
+    return reverse('recipe:recipe-similar', args=[recipe_id])
+
+
+class SimilarRecipesAPITests(QueryAssertionsMixin, TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'similar@gmail.com', 'password123'
+        )
+        self.client.force_authenticate(self.user)
+        self.curry = Tag.objects.create(user=self.user, name='Curry')
+        self.rice = Ingredient.objects.create(user=self.user, name='Rice')
+        self.peas = Ingredient.objects.create(user=self.user, name='Peas')
+
+    def recipe(self, user, title, tags, ingredients):
+        recipe = Recipe.objects.create(user=user, title=title,
+                                       time_minutes=20, price=8)
+        recipe.tags.set(tags)
+        recipe.ingredients.set(ingredients)
+        similarity.refresh_bands([recipe.pk])
+        return recipe
+
+    def test_similar_recipes(self):
+        '''Test that recipes sharing the most are listed with a score'''
+
+        source = self.recipe(self.user, 'Pulao', [self.curry],
+                             [self.rice, self.peas])
+        same = self.recipe(self.user, 'Peas pulao', [self.curry],
+                           [self.rice, self.peas])
+        partial = self.recipe(self.user, 'Curry rice', [self.curry],
+                              [self.rice])
+        self.recipe(self.user, 'Salad', [], [])
+
+        # Tags and ingredients are prefetched for the source and results
+        with self.assertMaxQueries(12, duplicate_threshold=3):
+            res = self.client.get(similar_url(source.id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(item['id'], item['similarity']) for item in res.data],
+            [(same.id, 1.0), (partial.id, round(2 / 3, 4))],
+        )
+
+    def test_deleted_recipes_excluded_before_limit(self):
+        '''Test that a deleted recipe doesn't take a slot of the limit'''
+
+        source = self.recipe(self.user, 'Pulao', [self.curry],
+                             [self.rice, self.peas])
+        same = self.recipe(self.user, 'Peas pulao', [self.curry],
+                           [self.rice, self.peas])
+        partial = self.recipe(self.user, 'Curry rice', [self.curry],
+                              [self.rice])
+        self.client.delete(reverse('recipe:recipe-detail', args=[same.id]))
+
+        res = self.client.get(similar_url(source.id), {'limit': 1})
+
+        self.assertEqual([item['id'] for item in res.data], [partial.id])
+
+    def test_other_users_recipes_excluded(self):
+        other = get_user_model().objects.create_user(
+            'other@gmail.com', 'password123'
+        )
+        source = self.recipe(self.user, 'Pulao', [self.curry], [self.rice])
+        self.recipe(other, 'Pulao', [self.curry], [self.rice])
+
+        res = self.client.get(similar_url(source.id))
+        self.assertEqual(res.data, [])
+
+    def test_invalid_params(self):
+        source = self.recipe(self.user, 'Pulao', [], [self.rice])
+        res = self.client.get(similar_url(source.id), {'metric': 'euclid'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        res = self.client.get(similar_url(source.id), {'limit': 'many'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
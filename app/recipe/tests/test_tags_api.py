@@ -4,6 +4,8 @@ from django.test import TestCase
 from rest_framework.test import APIClient
 from rest_framework import status
 from core.models import Tag, Recipe
+from core import catalog
+from core.testing import QueryAssertionsMixin
 from recipe.serializers import TagSerializer
 
 
@@ -23,7 +25,7 @@ class PubliTagsAPITests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
 
 
-class PrivateTagsAPITests(TestCase):
+class PrivateTagsAPITests(QueryAssertionsMixin, TestCase):
     '''Test the authorized user tags'''
 
     def setUp(self):
@@ -39,7 +41,8 @@ class PrivateTagsAPITests(TestCase):
 
         Tag.objects.create(user=self.user, name='Vegan')
         Tag.objects.create(user=self.user, name='Dessert')
-        res = self.client.get(TAGS_URL)
+        with self.assertMaxQueries(1):
+            res = self.client.get(TAGS_URL)
         tags = Tag.objects.all().order_by('-name')
         serializer = TagSerializer(tags, many=True)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
@@ -63,13 +66,30 @@ class PrivateTagsAPITests(TestCase):
         '''Test creating a new tag'''
 
         payload = {'name': 'Test tag'}
-        self.client.post(TAGS_URL, payload)
+        # Loaded once per process, not part of a request
+        catalog.CATALOGS[Tag].entries()
+        # Name lookup, insert, change feed entry and the facet version
+        # replaced in the database cache
+        with self.assertMaxQueries(10, duplicate_threshold=4):
+            self.client.post(TAGS_URL, payload)
         exists = Tag.objects.filter(
             user=self.user,
             name=payload['name']
         ).exists()
         self.assertTrue(exists)
 
+    def test_create_tag_idempotent(self):
+        '''Test that creating a tag twice returns the existing one'''
+
+        res1 = self.client.post(TAGS_URL, {'name': 'Salt'})
+        with self.assertMaxQueries(1):
+            res2 = self.client.post(TAGS_URL, {'name': ' SALT  '})
+        self.assertEqual(res1.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res2.status_code, status.HTTP_200_OK)
+        self.assertEqual(res1.data['id'], res2.data['id'])
+        self.assertEqual(res2.data['name'], 'Salt')
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 1)
+
     def test_create_tag_invalid(self):
         '''Test creating a new tag with invalid payload'''
 
@@ -96,9 +116,29 @@ class PrivateTagsAPITests(TestCase):
         )
         recipe1.tags.add(tag1)
         recipe2.tags.add(tag1)
+        tag1.refresh_from_db()
         serializer1 = TagSerializer(tag1)
         serializer2 = TagSerializer(tag2)
-        res = self.client.get(TAGS_URL, {'assigned_only': 1})
+        with self.assertMaxQueries(1):
+            res = self.client.get(TAGS_URL, {'assigned_only': 1})
         self.assertEqual(len(res.data), 1)
         self.assertIn(serializer1.data, res.data)
         self.assertNotIn(serializer2.data, res.data)
+
+    def test_retrieve_tags_ordered_by_recipe_count(self):
+        '''Test ordering tags by the number of recipes using them'''
+
+        tag1 = Tag.objects.create(user=self.user, name='Breakfast')
+        tag2 = Tag.objects.create(user=self.user, name='Lunch')
+        recipe = Recipe.objects.create(
+            user=self.user,
+            title='Poha',
+            time_minutes=20,
+            price=50.00
+        )
+        recipe.tags.add(tag1)
+        with self.assertMaxQueries(1):
+            res = self.client.get(TAGS_URL, {'ordering': '-recipe_count'})
+        self.assertEqual(res.data[0]['id'], tag1.id)
+        self.assertEqual(res.data[0]['recipe_count'], 1)
+        self.assertEqual(res.data[1]['id'], tag2.id)
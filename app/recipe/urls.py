@@ -7,6 +7,7 @@ router = DefaultRouter()
 router.register('tags', views.TagViewSet)
 router.register('ingredients', views.IngredientViewSet)
 router.register('recipes', views.RecipeViewSet)
+router.register('changes', views.ChangeFeedViewSet, basename='changes')
 
 app_name = 'recipe'
 
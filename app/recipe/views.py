@@ -1,11 +1,39 @@
+from decimal import Decimal, InvalidOperation
+from django.utils.translation import gettext_lazy as _
 from rest_framework.decorators import action
+from rest_framework.exceptions import APIException, ValidationError
 from rest_framework.response import Response
 from rest_framework import viewsets, mixins, status
 from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
-from core.models import Tag, Ingredient, Recipe
+from core import changes, similarity
+from core.bulk import soft_delete_recipe
+from core.tasks import generate_thumbnails
+from core.models import Tag, Ingredient, Recipe, Change, VersionConflict, \
+    normalize_name
+from core.stats import get_recipe_stats
+from recipe import facets, shopping
+from recipe.pantry import match_pantry
 from recipe.serializers import TagSerializer, IngredientSerializer, \
-    RecipeSerializer, RecipeDetailSerializer, RecipeImageSerializer
+    RecipeSerializer, RecipeDetailSerializer, RecipeImageSerializer, \
+    parse_ids
+
+
+# Relations serialized with every recipe
+RECIPE_RELATIONS = ('tags', 'ingredients', 'quantities')
+
+
+class PreconditionFailed(APIException):
+    status_code = status.HTTP_412_PRECONDITION_FAILED
+    default_detail = _('The recipe was changed by another request.')
+    default_code = 'precondition_failed'
+
+
+class ChangesPruned(APIException):
+    status_code = status.HTTP_410_GONE
+    default_detail = _('Changes since this cursor were pruned, '
+                       'download everything again.')
+    default_code = 'changes_pruned'
 
 
 class BaseRecipeAPIView(viewsets.GenericViewSet,
@@ -15,6 +43,7 @@ class BaseRecipeAPIView(viewsets.GenericViewSet,
 
     authentication_classes = (TokenAuthentication,)
     permission_classes = (IsAuthenticated,)
+    allowed_orderings = ('name', '-name', 'recipe_count', '-recipe_count')
 
     def get_queryset(self):
         '''Get queryset for the authenticated user only'''
@@ -22,18 +51,39 @@ class BaseRecipeAPIView(viewsets.GenericViewSet,
         assigned_only = bool(
             int(self.request.query_params.get('assigned_only', 0))
         )
+        ordering = self.request.query_params.get('ordering', '-name')
+        if ordering not in self.allowed_orderings:
+            ordering = '-name'
         queryset = self.queryset
         if assigned_only:
-            queryset = queryset.filter(recipe__isnull=False)
+            queryset = queryset.filter(recipe_count__gt=0)
 
         return queryset.filter(
             user=self.request.user
-        ).order_by('-name').distinct()
+        ).order_by(ordering, '-id')
+
+    def create(self, request, *args, **kwargs):
+        '''Create an attribute, 200 with the existing one if already there'''
+
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        created = self.perform_create(serializer)
+        return Response(
+            serializer.data,
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+        )
 
     def perform_create(self, serializer):
-        '''Create new attributes'''
+        '''Create new attributes unless one with the same name exists'''
 
-        serializer.save(user=self.request.user)
+        name = serializer.validated_data['name']
+        serializer.instance, created = self.queryset.model.objects \
+            .get_or_create(
+                user=self.request.user,
+                normalized_name=normalize_name(name),
+                defaults={'name': name},
+            )
+        return created
 
 
 class TagViewSet(BaseRecipeAPIView):
@@ -57,25 +107,120 @@ class RecipeViewSet(viewsets.ModelViewSet):
     permission_classes = (IsAuthenticated,)
     serializer_class = RecipeSerializer
     queryset = Recipe.objects.all()
+    # pantry and shopping_list read many recipes per request
+    throttle_scopes = {
+        'upload_image': 'upload',
+        'pantry': 'bulk',
+        'shopping_list': 'bulk',
+    }
+    # Responses of these actions carry the recipe version as ETag
+    etag_actions = ('retrieve', 'create', 'update', 'partial_update')
+    max_similar = 50
+    max_pantry_matches = 100
+    max_shopping_recipes = 100
+    # Scaled quantities must still fit their decimal columns
+    max_scale = 1000
+
+    filter_params = (
+        'tags', 'ingredients', 'min_time', 'max_time', 'min_price',
+        'max_price',
+    )
+    # query param -> (lookup, type of the value)
+    range_filters = {
+        'min_time': ('time_minutes__gte', int),
+        'max_time': ('time_minutes__lte', int),
+        'min_price': ('price__gte', Decimal),
+        'max_price': ('price__lte', Decimal),
+    }
 
-    def _params_to_ints(self, qs):
+    def _params_to_ints(self, qs, name=None):
         '''To convert a list of string Ids to Integer'''
-        return [int(str_id) for str_id in qs.split(',')]
+        try:
+            return parse_ids(qs)
+        except ValueError:
+            raise ValidationError({name: _(
+                'A comma separated list of ids is required.'
+            )})
 
-    def get_queryset(self):
-        '''Retrive the recipes for the authenticated user'''
+    def _int_param(self, name, default=None, minimum=0, maximum=None):
+        '''Return a whole number query param clamped to a range'''
+
+        value = self.request.query_params.get(name, default)
+        if value is None:
+            return None
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            raise ValidationError({name: _('A whole number is required.')})
+        value = max(value, minimum)
+        return min(value, maximum) if maximum is not None else value
+
+    def _number(self, name, value, number, positive=False, maximum=None):
+        '''Parse a finite number of the given type from a query param
+
+        positive rejects zero and below, maximum caps the value.
+        '''
+
+        try:
+            value = number(value)
+        except (ValueError, InvalidOperation):
+            raise ValidationError({name: _('A number is required.')})
+        if isinstance(value, Decimal) and not value.is_finite():
+            raise ValidationError({name: _('A number is required.')})
+        if positive and value <= 0:
+            raise ValidationError({name: _('Must be greater than zero.')})
+        if maximum is not None and value > maximum:
+            raise ValidationError({name: _(
+                'Must be at most {maximum}.'
+            ).format(maximum=maximum)})
+        return value
+
+    def _filter_recipes(self):
+        '''Return the user's recipes narrowed by the query params'''
 
         tags = self.request.query_params.get('tags')
         ingredients = self.request.query_params.get('ingredients')
         queryset = self.queryset
         if tags:
-            tags_id = self._params_to_ints(tags)
+            tags_id = self._params_to_ints(tags, 'tags')
             queryset = queryset.filter(tags__id__in=tags_id)
         if ingredients:
-            ingredients_id = self._params_to_ints(ingredients)
+            ingredients_id = self._params_to_ints(ingredients,
+                                                  'ingredients')
             queryset = queryset.filter(ingredients__id__in=ingredients_id)
+        for param, (lookup, number) in self.range_filters.items():
+            value = self.request.query_params.get(param)
+            if value:
+                queryset = queryset.filter(
+                    **{lookup: self._number(param, value, number)}
+                )
+
+        return queryset.filter(user=self.request.user)
+
+    def get_queryset(self):
+        '''Retrive the recipes for the authenticated user'''
+
+        queryset = self._filter_recipes().distinct().order_by('-id')
+        # Updates drop prefetched relations before serializing the result,
+        # so prefetching them would only cost queries
+        if self.action in ('update', 'partial_update'):
+            return queryset
+        return queryset.prefetch_related(*RECIPE_RELATIONS)
 
-        return queryset.filter(user=self.request.user).distinct()
+    def _scale(self, name, value):
+        '''Parse how many times a recipe is cooked'''
+
+        return self._number(name, value, Decimal, positive=True,
+                            maximum=self.max_scale)
+
+    def get_serializer_context(self):
+        '''Add the scale quantities are shown at, from ?scale='''
+
+        context = super().get_serializer_context()
+        scale = self.request.query_params.get('scale')
+        if scale is not None and self.request.method == 'GET':
+            context['scale'] = self._scale('scale', scale)
+        return context
 
     def get_serializer_class(self):
         '''Return appropriate serializer class'''
@@ -90,6 +235,36 @@ class RecipeViewSet(viewsets.ModelViewSet):
         '''Create new recipe'''
         serializer.save(user=self.request.user)
 
+    def perform_destroy(self, instance):
+        '''Hide the recipe, the purge_recipes command deletes it later'''
+        soft_delete_recipe(instance)
+
+    def perform_update(self, serializer):
+        '''Save the recipe if If-Match names its current version'''
+
+        header = self.request.META.get('HTTP_IF_MATCH')
+        if header is not None:
+            etags = {etag.strip() for etag in header.split(',')}
+            current = f'"{serializer.instance.version}"'
+            if '*' not in etags and current not in etags:
+                raise PreconditionFailed()
+        # The UPDATE itself checks the version again, see Recipe._do_update
+        serializer.save()
+
+    def handle_exception(self, exc):
+        if isinstance(exc, VersionConflict):
+            exc = PreconditionFailed()
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(
+            request, response, *args, **kwargs
+        )
+        if self.action in self.etag_actions and \
+                status.is_success(response.status_code):
+            response['ETag'] = f'"{response.data["version"]}"'
+        return response
+
     @action(methods=['POST'], detail=True, url_path='upload-image')
     def upload_image(self, request, pk=None):
         '''Upload an image to a recipe'''
@@ -101,6 +276,8 @@ class RecipeViewSet(viewsets.ModelViewSet):
         )
         if serializer.is_valid():
             serializer.save()
+            generate_thumbnails.delay(recipe_id=recipe.id,
+                                      user_id=recipe.user_id)
             return Response(
                 serializer.data,
                 status=status.HTTP_200_OK,
@@ -110,3 +287,174 @@ class RecipeViewSet(viewsets.ModelViewSet):
             serializer.errors,
             status=status.HTTP_400_BAD_REQUEST,
         )
+
+    @action(methods=['GET'], detail=False)
+    def facets(self, request):
+        '''Count recipes per tag and ingredient under the current filters'''
+
+        params = {
+            key: request.query_params[key] for key in self.filter_params
+            if key in request.query_params
+        }
+        return Response(facets.get_facets(
+            request.user.id, params, self._filter_recipes()
+        ))
+
+    @action(methods=['GET'], detail=False)
+    def stats(self, request):
+        '''Return totals and price distribution of the user's recipes'''
+
+        return Response(get_recipe_stats(request.user.id))
+
+    @action(methods=['GET'], detail=False)
+    def pantry(self, request):
+        '''Rank recipes by how many of their ingredients the user has
+
+        ingredients lists the ids at hand. Each recipe carries matched,
+        missing and missing_ingredients, fewest missing first. Recipes
+        missing more than max_missing are left out.
+        '''
+
+        pantry = set(self._params_to_ints(
+            request.query_params.get('ingredients', ''), 'ingredients'
+        ))
+        max_missing = self._int_param('max_missing')
+        limit = self._int_param('limit', 20, 1, self.max_pantry_matches)
+
+        recipes = list(
+            match_pantry(request.user.id, pantry, max_missing)
+            .prefetch_related(*RECIPE_RELATIONS)[:limit]
+        )
+        data = self.get_serializer(recipes, many=True).data
+        for item, recipe in zip(data, recipes):
+            item['matched'] = recipe.matched
+            item['missing'] = recipe.missing
+            item['missing_ingredients'] = [
+                pk for pk in item['ingredients'] if pk not in pantry
+            ]
+        return Response(data)
+
+    @action(methods=['GET'], detail=False, url_path='shopping-list')
+    def shopping_list(self, request):
+        '''Sum up the ingredients of several recipes
+
+        recipes lists recipe ids, each optionally followed by how many
+        times it is cooked, e.g. recipes=4,7:2,9:0.5. Quantities are
+        summed per ingredient and unit dimension.
+        '''
+
+        scales = {}
+        for item in request.query_params.get('recipes', '').split(','):
+            pk, _sep, scale = item.partition(':')
+            pk = self._params_to_ints(pk, 'recipes')[0]
+            scale = self._scale('recipes', scale) if scale else 1
+            scales[pk] = scales.get(pk, 0) + scale
+        if any(scale > self.max_scale for scale in scales.values()):
+            raise ValidationError({'recipes': _(
+                'A recipe is cooked at most {maximum} times.'
+            ).format(maximum=self.max_scale)})
+        if len(scales) > self.max_shopping_recipes:
+            raise ValidationError({'recipes': _(
+                'At most {count} recipes are allowed.'
+            ).format(count=self.max_shopping_recipes)})
+        try:
+            items = shopping.shopping_list(request.user.id, scales)
+        except ValueError:
+            raise ValidationError({'recipes': _('Quantities are too large.')})
+        return Response({'items': items})
+
+    @action(methods=['GET'], detail=True)
+    def similar(self, request, pk=None):
+        '''Return the user's recipes sharing the most tags and ingredients
+
+        Each recipe carries its similarity score, highest first. metric
+        is jaccard (default) or cosine.
+        '''
+
+        metric = request.query_params.get('metric', 'jaccard')
+        if metric not in similarity.METRICS:
+            raise ValidationError({'metric': _('Unknown metric.')})
+        limit = self._int_param('limit', 10, 1, self.max_similar)
+
+        scores = similarity.similar_recipes(self.get_object(), limit, metric)
+        recipes = self.queryset.filter(user=request.user) \
+            .prefetch_related(*RECIPE_RELATIONS) \
+            .in_bulk([pk for pk, _score in scores])
+        found = [(recipes[pk], score) for pk, score in scores
+                 if pk in recipes]
+        data = self.get_serializer(
+            [recipe for recipe, _score in found], many=True
+        ).data
+        for item, (_recipe, score) in zip(data, found):
+            item['similarity'] = round(score, 4)
+        return Response(data)
+
+
+class ChangeFeedViewSet(viewsets.ViewSet):
+    '''Recipes, tags and ingredients changed since a cursor
+
+    Without since only the current cursor is returned, clients take it
+    before their first full download and pass it as since afterwards.
+    Deleted objects are listed under deleted, a deleted tag or ingredient
+    also disappears from the recipes using it.
+    '''
+
+    authentication_classes = (TokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+    default_limit = 500
+    max_limit = 1000
+
+    # response key -> (Change.kind, queryset, serializer)
+    feeds = {
+        'recipes': (
+            Change.RECIPE,
+            Recipe.objects.prefetch_related(*RECIPE_RELATIONS),
+            RecipeSerializer,
+        ),
+        'tags': (Change.TAG, Tag.objects.all(), TagSerializer),
+        'ingredients': (
+            Change.INGREDIENT, Ingredient.objects.all(), IngredientSerializer
+        ),
+    }
+
+    def _int_param(self, name, default=None):
+        value = self.request.query_params.get(name, default)
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise ValidationError({name: _('A whole number is required.')})
+
+    def list(self, request):
+        if 'since' not in request.query_params:
+            return Response(
+                {'cursor': changes.format_cursor(changes.latest_cursor())}
+            )
+
+        try:
+            since = changes.parse_cursor(request.query_params['since'])
+        except ValueError:
+            raise ValidationError({'since': _('Invalid cursor.')})
+        pruned = changes.pruned_cursor()
+        if pruned is not None and since < pruned:
+            raise ChangesPruned()
+        limit = min(self._int_param('limit', self.default_limit),
+                    self.max_limit)
+        changed, cursor, has_more = changes.read_changes(
+            request.user.id, since, max(limit, 1)
+        )
+
+        data = {'cursor': changes.format_cursor(cursor),
+                'has_more': has_more, 'deleted': {}}
+        for key, (kind, queryset, serializer) in self.feeds.items():
+            live = [pk for pk, deleted in changed[kind].items()
+                    if not deleted]
+            objects = queryset.filter(user=request.user, pk__in=live) \
+                .order_by('id')
+            data[key] = serializer(
+                objects, many=True, context={'request': request}
+            ).data
+            found = {obj['id'] for obj in data[key]}
+            data['deleted'][key] = sorted(
+                pk for pk in changed[kind] if pk not in found
+            )
+        return Response(data)
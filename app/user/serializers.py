@@ -20,11 +20,9 @@ class UserSerializer(serializers.ModelSerializer):
         '''Update a user, setting password correctly and return it'''
 
         password = validated_data.pop('password', None)
-        user = super().update(instance, validated_data)
         if password:
-            user.set_password(password)
-            user.save()
-        return user
+            instance.set_password(password)
+        return super().update(instance, validated_data)
 
 
 class AuthTokenSerializer(serializers.Serializer):
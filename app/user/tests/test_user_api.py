@@ -3,6 +3,7 @@ from django.contrib.auth import get_user_model
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient
+from core.testing import QueryAssertionsMixin
 
 
 CREATE_USER_URL = reverse('user:create')
@@ -14,7 +15,7 @@ def create_user(**params):
     return get_user_model().objects.create_user(**params)
 
 
-class PublicUserApiTest(TestCase):
+class PublicUserApiTest(QueryAssertionsMixin, TestCase):
     '''Test the User API (Public)'''
 
     def setUp(self):
@@ -28,7 +29,9 @@ class PublicUserApiTest(TestCase):
             'password': 'test123',
             'name': 'Test user',
         }
-        res = self.client.post(CREATE_USER_URL, payload)
+        # Uniqueness check and insert
+        with self.assertMaxQueries(2):
+            res = self.client.post(CREATE_USER_URL, payload)
         self.assertEqual(res.status_code, status.HTTP_201_CREATED)
         user = get_user_model().objects.get(**res.data)
         self.assertTrue(user.check_password(payload['password']))
@@ -66,7 +69,9 @@ class PublicUserApiTest(TestCase):
 
         payload = {'email': 'test@gmail.com', 'password': 'test123'}
         create_user(**payload)
-        res = self.client.post(TOKEN_URL, payload)
+        # User lookup, token lookup, and the token insert in a savepoint
+        with self.assertMaxQueries(5):
+            res = self.client.post(TOKEN_URL, payload)
         self.assertIn('token', res.data)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
 
@@ -102,7 +107,7 @@ class PublicUserApiTest(TestCase):
         self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
 
 
-class PrivateUserAPITests(TestCase):
+class PrivateUserAPITests(QueryAssertionsMixin, TestCase):
     '''Test API requests that require authentication'''
 
     def setUp(self):
@@ -117,7 +122,8 @@ class PrivateUserAPITests(TestCase):
     def test_retrieve_profile_success(self):
         '''Test retrieving user profile for logged in user'''
 
-        res = self.client.get(ME_URL)
+        with self.assertMaxQueries(1):
+            res = self.client.get(ME_URL)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(res.data,
             {
@@ -136,7 +142,9 @@ class PrivateUserAPITests(TestCase):
         '''Test updating user profile for authenticated user'''
 
         payload = {'email': 'new@gmail.com', 'password': 'newPass'}
-        res = self.client.patch(ME_URL, payload)
+        # Email uniqueness check and a single update
+        with self.assertMaxQueries(2):
+            res = self.client.patch(ME_URL, payload)
         self.user.refresh_from_db()
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(self.user.email, payload['email'])